@@ -130,4 +130,7 @@ def create_app(test_config=None):
     from .routes import client_profile
     app.register_blueprint(client_profile.bp)
 
+    # Background jobs (raspagem, limpeza de auditoria, treino) are not started here: only the
+    # server entry points start the scheduler (run.py, gunicorn.conf.py), never CLIs or scripts
+
     return app
@@ -0,0 +1,193 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.database import db_pool
+
+# Flush policy: whichever comes first
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL_MS = 500
+AUDIT_QUEUE_MAX = 5000
+
+# Events that must hit the disk before the request returns
+CRITICAL_AUDIT_ACTIONS = {'LOGIN_FAILED'}
+
+INSERT_AUDIT_SQL = 'INSERT INTO audits (user_id, action, details, ts) VALUES (?, ?, ?, ?)'
+
+
+def _utc_now():
+    # Same format as CURRENT_TIMESTAMP, captured at submit time (not at flush time)
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class AuditSink:
+    """
+    Bounded in-memory queue + background flusher that group-commits audit rows.
+    Rows are written in a single transaction every AUDIT_FLUSH_INTERVAL_MS or AUDIT_BATCH_SIZE rows.
+    """
+
+    def __init__(self, pool, batch_size=AUDIT_BATCH_SIZE, flush_interval_ms=AUDIT_FLUSH_INTERVAL_MS, max_queue=AUDIT_QUEUE_MAX):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._stats = {
+            'enqueued': 0, 'written': 0, 'flushes': 0, 'sync_writes': 0, 'errors': 0,
+            'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0
+        }
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker (post-fork) gets its own flusher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='AuditFlusher')
+            self._thread.start()
+
+    def record(self, user_id, action, details='', db=None):
+        """Entry point used by database.log_audit."""
+        if action in CRITICAL_AUDIT_ACTIONS:
+            self.write_sync([(user_id, action, details, _utc_now())], db=db)
+        else:
+            self.submit(user_id, action, details)
+
+    def submit(self, user_id, action, details=''):
+        row = (user_id, action, details, _utc_now())
+        if self._stopping.is_set():
+            self.write_sync([row])
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(row)
+            with self._lock:
+                self._stats['enqueued'] += 1
+        except queue.Full:
+            # Back-pressure: never drop audit rows, write inline instead
+            self.write_sync([row])
+
+    def write_sync(self, rows, db=None):
+        """Writes rows immediately (critical events, full queue, shutdown)."""
+        if db is not None:
+            db.executemany(INSERT_AUDIT_SQL, rows)
+            db.commit()
+        else:
+            with self.pool.connection() as conn:
+                conn.executemany(INSERT_AUDIT_SQL, rows)
+                conn.commit()
+        with self._lock:
+            self._stats['sync_writes'] += len(rows)
+            self._stats['written'] += len(rows)
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                conn.executemany(INSERT_AUDIT_SQL, batch)
+                conn.commit()
+        except Exception as e:
+            print(f"Erro gravando auditoria ({len(batch)} linhas): {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return False
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self._stats['flushes'] += 1
+            self._stats['written'] += len(batch)
+            self._stats['last_flush_ms'] = round(elapsed_ms, 2)
+            self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], elapsed_ms), 2)
+            self._stats['total_flush_ms'] += elapsed_ms
+        return True
+
+    def _run(self):
+        pending = []
+        while not (self._stopping.is_set() and self._queue.empty() and not pending):
+            if not pending:
+                pending = self._collect_batch()
+                if not pending:
+                    continue
+            if self._flush(pending):
+                pending = []
+            else:
+                time.sleep(self.flush_interval)
+        self.pool.discard()
+
+    def drain(self, timeout=5.0):
+        """Shutdown hook: flushes everything still queued and stops the flusher."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        # Anything left (flusher dead or timed out) goes out synchronously
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftovers:
+            try:
+                self.write_sync(leftovers)
+            except Exception as e:
+                print(f"Erro drenando auditoria: {e}")
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        total_ms = data.pop('total_flush_ms')
+        data['avg_flush_ms'] = round(total_ms / data['flushes'], 2) if data['flushes'] else 0.0
+        data['queue_depth'] = self._queue.qsize()
+        data['flusher_alive'] = bool(self._thread and self._thread.is_alive())
+        return data
+
+
+AUDIT_PURGE_CHUNK = 5000
+
+
+def purge_audits(db, retention_days, chunk_size=AUDIT_PURGE_CHUNK):
+    """
+    Deletes audit rows older than retention_days in short transactions (ids grow with ts,
+    so the cut is one scan for the boundary id and then primary-key range deletes).
+    """
+    row = db.execute("SELECT MAX(id) FROM audits WHERE ts < datetime('now', ?)", (f'-{int(retention_days)} days',)).fetchone()
+    last_id = row[0] if row else None
+    if last_id is None:
+        return 0
+    deleted = 0
+    while True:
+        cur = db.execute("DELETE FROM audits WHERE id IN (SELECT id FROM audits WHERE id <= ? ORDER BY id LIMIT ?)", (last_id, chunk_size))
+        db.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < chunk_size:
+            return deleted
+
+
+audit_sink = AuditSink(db_pool)
+atexit.register(audit_sink.drain)
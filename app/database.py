@@ -1,44 +1,180 @@
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from flask import g
 
 DATABASE = os.path.join(os.path.dirname(__file__), 'app.db')
 
+# Tuning applied to every new connection.
+# WAL lets readers (ex: /api/kpis) run while a writer holds the lock (ex: /api/kanban/update).
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16 MB de page cache por conexão
+    "PRAGMA mmap_size=134217728",    # 128 MB
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+]
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived SQLite connection per thread (gunicorn worker, scraper thread, etc).
+    Connections are health-checked on checkout and reopened if they went bad.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._live = {}  # thread ident -> connection
+        self._stats = {'opened': 0, 'reused': 0, 'recycled': 0, 'closed': 0, 'rollbacks': 0}
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._stats['opened'] += 1
+            self._live[threading.get_ident()] = conn
+            self._prune_dead_threads()
+        return conn
+
+    def _prune_dead_threads(self):
+        # Dev server spawns one thread per request; drop connections of threads that already ended.
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._live if i not in alive]:
+            try:
+                self._live.pop(ident).close()
+                self._stats['closed'] += 1
+            except sqlite3.Error:
+                pass
+
+    def _check_fork(self):
+        # After a fork (gunicorn --preload) inherited connections must not be reused.
+        if os.getpid() != self._pid:
+            with self._lock:
+                self._pid = os.getpid()
+                self._local = threading.local()
+                self._live = {}
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """Returns the connection bound to the current thread, opening it if needed."""
+        self._check_fork()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not self._healthy(conn):
+            with self._lock:
+                self._stats['recycled'] += 1
+                self._live.pop(threading.get_ident(), None)
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            conn = None
+
+        if conn is None:
+            conn = self._local.conn = self._open()
+            self._local.depth = 0
+        else:
+            with self._lock:
+                self._stats['reused'] += 1
+
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        return conn
+
+    def release(self, conn):
+        """Gives the connection back. Uncommitted work is rolled back when the outermost user releases it."""
+        depth = getattr(self._local, 'depth', 1) - 1
+        self._local.depth = max(0, depth)
+        if depth > 0:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+                with self._lock:
+                    self._stats['rollbacks'] += 1
+        except sqlite3.Error:
+            self.discard()
+
+    def discard(self):
+        """Closes the current thread's connection (next acquire opens a fresh one)."""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        self._local.depth = 0
+        if conn is not None:
+            with self._lock:
+                self._live.pop(threading.get_ident(), None)
+                self._stats['closed'] += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    @contextmanager
+    def connection(self):
+        """For code running outside a Flask request (threads, scripts)."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['live_connections'] = len(self._live)
+        data['path'] = self.path
+        return data
+
+
+db_pool = ConnectionPool(DATABASE)
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = db_pool.acquire()
     return db
 
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 def init_db(app):
+    """Brings the schema up to date (see app/migrations.py) and seeds the admin user."""
+    from app.migrations import migrate
     with app.app_context():
         db = get_db()
-        with app.open_resource('../schemas/schema.sql', mode='r') as f:
-            db.cursor().executescript(f.read())
-        
+        migrate(db)
+
         # Ensure Admin User
         try:
             db.execute("INSERT INTO users (username, password, role) VALUES ('admin', 'admin', 'admin')")
             print("Admin user created (if not existed).")
         except sqlite3.IntegrityError:
             pass
-            
-        # Default Settings - seed if empty
-        try:
-             # Basic check if settings table exists via schema
-             pass 
-        except:
-             pass
         db.commit()
 
+def table_version(db, name):
+    """Change counter kept by triggers (table_versions); used to build ETags without reading the table."""
+    row = db.execute("SELECT version FROM table_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
 def log_audit(user_id, action, details=''):
-    db = get_db()
-    db.execute('INSERT INTO audits (user_id, action, details) VALUES (?, ?, ?)',
-               (user_id, action, details))
-    db.commit()
+    """
+    Queues an audit row for the background flusher (group commit).
+    Critical events are written synchronously on the request connection.
+    """
+    from app.audit import audit_sink
+    audit_sink.record(user_id, action, details, db=get_db())
@@ -0,0 +1,900 @@
+import json
+import os
+import re
+import sqlite3
+import unicodedata
+from datetime import datetime
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schemas')
+
+
+# --- Helpers ---
+
+def _split_sql(script):
+    """Splits a .sql file into complete statements (executescript would commit our transaction)."""
+    statements, buf = [], ''
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            if buf.strip():
+                statements.append(buf.strip())
+            buf = ''
+    return statements
+
+
+def _run_sql_file(db, filename):
+    with open(os.path.join(SCHEMA_DIR, filename), encoding='utf-8') as f:
+        for stmt in _split_sql(f.read()):
+            db.execute(stmt)
+
+
+def _columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _add_columns(db, table, columns):
+    """ALTER TABLE ADD COLUMN only for the columns that are still missing."""
+    existing = _columns(db, table)
+    for name, decl in columns:
+        if name not in existing:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+# --- Migrations (ordered, each one idempotent) ---
+# Consolidates schemas/schema_*.sql, scripts/migrate_*.py, fix_db.py and the DDL
+# that used to run inside request handlers.
+
+def _m001_baseline(db):
+    _run_sql_file(db, 'schema.sql')
+
+
+def _m002_orcamentos_columns(db):
+    _add_columns(db, 'orcamentos', [
+        ('client_id', 'INTEGER'),
+        ('prazo_entrega', 'DATE'),
+        ('data_instalacao', 'DATE'),
+        ('total_horas_mo', 'REAL DEFAULT 0'),
+        ('pagamento_json', 'TEXT'),
+        ('selected_tier_id', 'INTEGER REFERENCES budget_tiers(id)'),
+    ])
+    _add_columns(db, 'cards_kanban', [
+        ('orcamento_id', 'INTEGER'),
+        ('data_json', 'TEXT'),
+    ])
+
+
+def _m003_estoque_columns(db):
+    _add_columns(db, 'estoque', [
+        ('is_acessorio', 'INTEGER DEFAULT 0'),
+        ('area_unidade', 'REAL DEFAULT 0'),
+        ('url_madeiranit', 'TEXT'),
+        ('url_leomadeiras', 'TEXT'),
+        ('url_madeverde', 'TEXT'),
+        ('preco_madeiranit', 'REAL'),
+        ('preco_leomadeiras', 'REAL'),
+        ('preco_madeverde', 'REAL'),
+        ('price_strategy', "TEXT DEFAULT 'auto_max'"),
+        ('price_group_id', 'INTEGER REFERENCES price_groups(id)'),
+        ('margem_lucro', 'REAL DEFAULT 0.35'),
+        ('preco_venda', 'REAL DEFAULT 0'),
+        ('minimo', 'REAL DEFAULT 0'),
+        ('localizacao', 'TEXT'),
+    ])
+
+
+def _m004_price_groups_color(db):
+    # /api/price_groups creates groups with (name, color) only: price must not be NOT NULL
+    info = {row[1]: row for row in db.execute("PRAGMA table_info(price_groups)").fetchall()}
+    if info.get('price') is not None and info['price'][3]:
+        db.execute('''
+            CREATE TABLE price_groups_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                price REAL DEFAULT 0,
+                description TEXT,
+                color TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cols = ', '.join(c for c in info if c in ('id', 'name', 'price', 'description', 'color', 'created_at'))
+        db.execute(f"INSERT INTO price_groups_new ({cols}) SELECT {cols} FROM price_groups")
+        db.execute("DROP TABLE price_groups")
+        db.execute("ALTER TABLE price_groups_new RENAME TO price_groups")
+    else:
+        _add_columns(db, 'price_groups', [('color', 'TEXT')])
+
+
+def _m005_catalogo_columns(db):
+    _add_columns(db, 'itens_catalogo', [
+        ('fator_consumo', 'REAL'),
+        ('estoque_id', 'INTEGER'),
+        ('categoria', 'TEXT'),
+        ('horas_mo', 'REAL'),
+        ('imagem_url', 'TEXT'),
+    ])
+
+
+def _m006_budget_tiers(db):
+    db.executemany(
+        "INSERT OR IGNORE INTO budget_tiers (id, name, description, order_index) VALUES (?, ?, ?, ?)", [
+            (1, 'Econômico', 'Opção mais acessível com materiais padrão.', 1),
+            (2, 'Intermediário', 'Melhor custo-benefício com acabamentos superiores.', 2),
+            (3, 'Premium', 'Acabamento de alto padrão e ferragens de ponta.', 3),
+        ])
+
+
+def _m007_payroll(db):
+    _add_columns(db, 'funcionarios', [('nome_ponto', 'TEXT')])
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS ponto_registros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            funcionario_id INTEGER,
+            data DATE NOT NULL,
+            entrada_1 TEXT,
+            saida_1 TEXT,
+            entrada_2 TEXT,
+            saida_2 TEXT,
+            extras_minutos INTEGER DEFAULT 0,
+            atrasos_minutos INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'Presente',
+            FOREIGN KEY(funcionario_id) REFERENCES funcionarios(id)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS holerites_pagos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            funcionario_id INTEGER NOT NULL,
+            mes_referencia TEXT NOT NULL,
+            valor_pago REAL NOT NULL,
+            data_pagamento DATE DEFAULT (date('now')),
+            conta_id INTEGER,
+            UNIQUE(funcionario_id, mes_referencia)
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS funcionario_saldos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            funcionario_id INTEGER NOT NULL,
+            valor REAL NOT NULL,
+            mes_origem TEXT NOT NULL,
+            status TEXT DEFAULT 'pendente',
+            FOREIGN KEY(funcionario_id) REFERENCES funcionarios(id)
+        )
+    ''')
+
+
+def _m008_users_columns(db):
+    _add_columns(db, 'users', [
+        ('is_active', 'INTEGER DEFAULT 1'),
+        ('whatsapp', 'TEXT'),
+    ])
+
+
+def _m009_crm(db):
+    _run_sql_file(db, 'schema_crm.sql')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS crm_activities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            activity_type TEXT DEFAULT 'note', -- 'note', 'visit', 'meeting', 'call'
+            scheduled_at DATETIME,
+            created_by INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(client_id) REFERENCES clientes(id)
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_crm_activities_client ON crm_activities(client_id, created_at)")
+
+
+def _m010_promob_import(db):
+    _run_sql_file(db, 'schema_promob_import.sql')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS discovered_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            avg_L REAL,
+            avg_A REAL,
+            avg_P REAL,
+            occurrences INTEGER DEFAULT 0,
+            is_reviewed INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _m011_whatsapp(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS whatsapp_chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            remote_jid TEXT UNIQUE NOT NULL,
+            name TEXT,
+            last_message_at DATETIME,
+            unread_count INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'open',
+            camila_active INTEGER DEFAULT 1,
+            is_simulation INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS whatsapp_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            sender TEXT NOT NULL, -- 'user', 'agent', 'camila'
+            content TEXT,
+            status TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            waha_msg_id TEXT UNIQUE,
+            FOREIGN KEY(chat_id) REFERENCES whatsapp_chats(id)
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_whatsapp_messages_chat ON whatsapp_messages(chat_id, timestamp)")
+
+
+def _m012_indexes(db):
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orcamentos_client_id ON orcamentos(client_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orcamentos_prazo ON orcamentos(prazo_entrega)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orcamentos_instalacao ON orcamentos(data_instalacao)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_clientes_nome ON clientes(nome)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_cards_kanban_orcamento ON cards_kanban(orcamento_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ponto_func_data ON ponto_registros(funcionario_id, data)")
+
+
+def _m013_orcamento_itens(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS orcamento_ambientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            orcamento_id INTEGER NOT NULL,
+            posicao INTEGER DEFAULT 0,
+            codigo TEXT,
+            nome TEXT,
+            ambiente TEXT,
+            material TEXT,
+            quantidade REAL DEFAULT 1,
+            imagem_url TEXT,
+            FOREIGN KEY(orcamento_id) REFERENCES orcamentos(id) ON DELETE CASCADE
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS orcamento_itens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            orcamento_id INTEGER NOT NULL,
+            ambiente_id INTEGER NOT NULL,
+            posicao INTEGER DEFAULT 0,
+            catalogo_id INTEGER,
+            nome TEXT,
+            descricao TEXT,
+            largura REAL,
+            altura REAL,
+            profundidade REAL,
+            complexidade REAL DEFAULT 1,
+            horas_mo REAL DEFAULT 0,
+            subtotal REAL DEFAULT 0,
+            preco_final REAL,
+            FOREIGN KEY(orcamento_id) REFERENCES orcamentos(id) ON DELETE CASCADE,
+            FOREIGN KEY(ambiente_id) REFERENCES orcamento_ambientes(id) ON DELETE CASCADE
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orc_ambientes_orc ON orcamento_ambientes(orcamento_id, posicao)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orc_itens_orc ON orcamento_itens(orcamento_id, ambiente_id, posicao)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orc_itens_catalogo ON orcamento_itens(catalogo_id)")
+    _add_columns(db, 'orcamentos', [
+        ('itens_count', 'INTEGER DEFAULT 0'),
+        ('ambientes_count', 'INTEGER DEFAULT 0'),
+        ('valor_itens', 'REAL DEFAULT 0'),
+    ])
+
+    # Backfill every budget from its itens_json: frozen copy of orcamento_itens.normalize_itens /
+    # sync_orcamento_itens as of this migration (both legacy formats, 'Geral' for a flat list)
+    def num(value, default=None):
+        try:
+            return float(value) if value not in (None, '') else default
+        except (TypeError, ValueError):
+            return default
+
+    def first(item, *keys):
+        return next((item[k] for k in keys if item.get(k) not in (None, '')), None)
+
+    for orcamento_id, raw in db.execute('SELECT id, itens_json FROM orcamentos').fetchall():
+        try:
+            raw = json.loads(raw) if raw else []
+        except ValueError:
+            raw = []
+        if not isinstance(raw, list) or not raw:
+            raw = []
+        elif not (isinstance(raw[0], dict) and 'items' in raw[0]):
+            raw = [{'name': 'Geral', 'items': raw}]
+        groups = [g for g in raw if isinstance(g, dict)]
+
+        itens_count, valor_itens = 0, 0.0
+        for g_pos, g in enumerate(groups):
+            qty = num(g.get('qty'), 1) or 1
+            ambiente_id = db.execute('''
+                INSERT INTO orcamento_ambientes (orcamento_id, posicao, codigo, nome, ambiente, material, quantidade, imagem_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (orcamento_id, g_pos, g.get('code'), g.get('name'), g.get('ambient'), g.get('material'), qty,
+                  g.get('imagem_url'))).lastrowid
+            rows = []
+            for i_pos, it in enumerate(it for it in (g.get('items') or []) if isinstance(it, dict)):
+                subtotal = num(first(it, 'subtotal', 'preco_final', 'custo'), 0.0)
+                rows.append((orcamento_id, ambiente_id, i_pos, first(it, 'catalogo_id'), first(it, 'nome'),
+                             first(it, 'descricao'), num(first(it, 'L', 'largura')), num(first(it, 'A', 'altura')),
+                             num(first(it, 'P', 'profundidade')), num(first(it, 'complex'), 1.0),
+                             num(first(it, 'horas_mo'), 0.0), subtotal, num(first(it, 'preco_final'))))
+                valor_itens += subtotal * qty
+            db.executemany('''
+                INSERT INTO orcamento_itens (orcamento_id, ambiente_id, posicao, catalogo_id, nome, descricao,
+                                             largura, altura, profundidade, complexidade, horas_mo, subtotal, preco_final)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            itens_count += len(rows)
+        db.execute('UPDATE orcamentos SET itens_count = ?, ambientes_count = ?, valor_itens = ? WHERE id = ?',
+                   (itens_count, len(groups), round(valor_itens, 2), orcamento_id))
+
+
+def _m014_promob_parse_cache(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS promob_parse_cache (
+            file_hash TEXT PRIMARY KEY,
+            parser_version INTEGER NOT NULL,
+            filename TEXT,
+            result_json TEXT NOT NULL,
+            parsed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _m015_processed_files_stages(db):
+    # processed_files is shared by the miner and the training: one checkpoint column per stage
+    _add_columns(db, 'processed_files', [
+        ('mined_at', 'DATETIME'),
+        ('trained_at', 'DATETIME'),
+    ])
+    db.execute("UPDATE processed_files SET mined_at = processed_at WHERE mined_at IS NULL")
+
+
+def _m016_pattern_stats(db):
+    cols = []
+    for d in ('L', 'A', 'P'):
+        cols += [(f'sum_{d}', 'REAL DEFAULT 0'), (f'sumsq_{d}', 'REAL DEFAULT 0'),
+                 (f'min_{d}', 'REAL'), (f'max_{d}', 'REAL'), (f'hist_{d}', 'TEXT')]
+    _add_columns(db, 'discovered_patterns', cols)
+
+    # Old rows only kept the (drifted) average: seed the stats as occurrences x avg, i.e. n
+    # observations of avg in one 10 mm histogram bucket (frozen; the live layout is in
+    # discovery_service.pattern_to_row)
+    rows = db.execute("SELECT id, avg_L, avg_A, avg_P, occurrences FROM discovered_patterns WHERE hist_L IS NULL").fetchall()
+    updates = []
+    for row in rows:
+        n = row['occurrences'] or 0
+        if n <= 0 or any(row[f'avg_{d}'] is None for d in ('L', 'A', 'P')):
+            continue
+        values = [n]
+        for d in ('L', 'A', 'P'):
+            v = float(row[f'avg_{d}'])
+            values += [round(v * n / n, 0), v * n, v * v * n, v, v, json.dumps({str(int(round(v / 10))): n})]
+        updates.append(values + [row['id']])
+    columns = ['occurrences'] + [f'{c}_{d}' for d in ('L', 'A', 'P') for c in ('avg', 'sum', 'sumsq', 'min', 'max', 'hist')]
+    db.executemany(f"UPDATE discovered_patterns SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?", updates)
+
+def _m017_promob_mapping_keys(db):
+    _add_columns(db, 'promob_mappings', [('promob_key', 'TEXT')])
+
+    # Frozen copy of promob_service.mapping_key as of this migration: $VAR$/#VAR# removed,
+    # accents stripped, case-folded, whitespace collapsed
+    def mapping_key(name):
+        if not name:
+            return ''
+        name = re.sub(r'#[\w]+#', ' ', re.sub(r'\$[\w]+\$', ' ', name))
+        name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+        return ' '.join(name.casefold().split())
+
+    rows = db.execute("SELECT id, promob_name FROM promob_mappings").fetchall()
+    db.executemany("UPDATE promob_mappings SET promob_key = ? WHERE id = ?", [(mapping_key(r[1]), r[0]) for r in rows])
+    db.execute("CREATE INDEX IF NOT EXISTS idx_promob_mappings_key ON promob_mappings(promob_key, target_type)")
+
+
+def _m018_promob_import_jobs(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS promob_import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            filename TEXT,
+            filepath TEXT NOT NULL,
+            file_hash TEXT,
+            status TEXT DEFAULT 'queued', -- queued, running, done, error
+            progress INTEGER DEFAULT 0,
+            stage TEXT,
+            partial_json TEXT,
+            result_json TEXT,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            updated_at DATETIME,
+            finished_at DATETIME
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_promob_jobs_status ON promob_import_jobs(status, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_promob_jobs_hash ON promob_import_jobs(file_hash, status)")
+
+
+def _m019_scrape_jobs(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            status TEXT DEFAULT 'queued', -- queued, running, cancel_requested, cancelled, done, error
+            total INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            updated INTEGER DEFAULT 0,
+            errors INTEGER DEFAULT 0,
+            results_json TEXT,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            updated_at DATETIME,
+            finished_at DATETIME
+        )
+    ''')
+
+
+def _m020_scrape_cache(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_cache (
+            url TEXT PRIMARY KEY,
+            site TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            price REAL,
+            parser_version INTEGER,
+            status_code INTEGER,
+            fetched_at DATETIME,
+            checked_at DATETIME
+        )
+    ''')
+
+
+def _m021_estoque_precos(db):
+    # Append-only price history: one row per (item, site) price change
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS estoque_precos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            estoque_id INTEGER NOT NULL REFERENCES estoque(id) ON DELETE CASCADE,
+            site TEXT NOT NULL,
+            preco REAL NOT NULL,
+            coletado_em DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Latest per (item, site) = first row of this index in DESC order
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_precos_item_site ON estoque_precos(estoque_id, site, coletado_em DESC, id DESC)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_precos_coletado ON estoque_precos(coletado_em)")
+
+    # Seed with the current per-site prices (and the site_origem cost when that site has no column value)
+    for site in ('madeiranit', 'leomadeiras', 'madeverde'):
+        db.execute(f'''
+            INSERT INTO estoque_precos (estoque_id, site, preco, coletado_em)
+            SELECT id, ?, COALESCE(preco_{site}, custo_unitario), COALESCE(last_update, CURRENT_TIMESTAMP)
+            FROM estoque
+            WHERE COALESCE(preco_{site}, CASE WHEN site_origem = ? THEN custo_unitario END, 0) > 0
+        ''', (site, site))
+
+
+def _m022_scheduler(db):
+    # Times are local, written by app/scheduler.py
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            cron TEXT NOT NULL,
+            enabled INTEGER DEFAULT 1,
+            description TEXT,
+            next_run_at DATETIME,
+            last_run_at DATETIME,
+            lease_owner TEXT,
+            lease_until DATETIME,
+            updated_at DATETIME
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_name TEXT NOT NULL,
+            owner TEXT,
+            status TEXT, -- running, ok, error
+            started_at DATETIME,
+            finished_at DATETIME,
+            duration_ms INTEGER,
+            result_json TEXT,
+            error TEXT
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job_name, id)")
+
+
+def _m023_estoque_listing(db):
+    # Keyset pagination of /api/estoque: one index per sort (see services/estoque_listing.SORTS)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_nome ON estoque(nome, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_categoria ON estoque(COALESCE(categoria, ''), nome, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_custo ON estoque(COALESCE(custo_unitario, 0), id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_quantidade ON estoque(COALESCE(quantidade, 0), id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_last_update ON estoque(COALESCE(last_update, ''), id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_estoque_price_group ON estoque(price_group_id)")
+
+    # Change counter per table (ETags without reading the rows), bumped by triggers
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    db.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('estoque', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_estoque_version_{event.lower()} AFTER {event} ON estoque
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'estoque';
+            END
+        ''')
+
+
+def _m024_search_index(db):
+    # External-content FTS5 table + sync triggers + initial build per source. Frozen here (not
+    # read from app/services/search.py): changing an index later means a new migration
+    sources = (
+        ('estoque', 'estoque_fts', ('nome', 'categoria')),
+        ('itens_catalogo', 'catalogo_fts', ('nome', 'categoria')),
+        ('clientes', 'clientes_fts', ('nome', 'cpf_cnpj', 'email', 'telefone', 'whatsapp', 'cidade')),
+        ('crm_contatos', 'contatos_fts', ('nome', 'telefone', 'email')),
+    )
+    for table, fts, cols in sources:
+        col_list = ', '.join(cols)
+        new_vals = ', '.join(f'new.{c}' for c in cols)
+        old_vals = ', '.join(f'old.{c}' for c in cols)
+        db.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {col_list}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});
+            END
+        ''')
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+            END
+        ''')
+        # Only when an indexed column changes (price/stock updates don't touch the index)
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{fts}_au AFTER UPDATE OF {col_list} ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+                INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});
+            END
+        ''')
+        # rank = bm25 with matches in the first column (nome) weighing more than the others
+        weights = ', '.join(['10.0'] + ['1.0'] * (len(cols) - 1))
+        db.execute(f"INSERT INTO {fts}({fts}, rank) VALUES ('rank', 'bm25({weights})')")
+        db.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _m025_kpi_rollup(db):
+    # Dashboard KPI rollup (read by app/services/kpis.py): table, maintenance triggers and the
+    # initial backfill, frozen here. Changing a trigger later means a new migration
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS kpi_rollup (
+            metric TEXT NOT NULL,
+            bucket TEXT NOT NULL DEFAULT '',
+            valor REAL NOT NULL DEFAULT 0,
+            qtd INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (metric, bucket)
+        ) WITHOUT ROWID
+    ''')
+    upsert = '''
+        INSERT INTO kpi_rollup (metric, bucket, valor, qtd) VALUES ({metric}, {bucket}, {valor}, {qtd})
+        ON CONFLICT(metric, bucket) DO UPDATE SET valor = valor + excluded.valor, qtd = qtd + excluded.qtd;
+    '''
+
+    def contas(row, sign):
+        return upsert.format(metric=f"'contas:' || COALESCE({row}.tipo, '') || ':' || COALESCE({row}.status, '')",
+                             bucket=f"COALESCE(date({row}.vencimento), '')",
+                             valor=f"{sign}COALESCE({row}.valor, 0)", qtd=f"{sign}1")
+
+    def orcamentos(row, sign):
+        return (upsert.format(metric="'orcamentos'", bucket="''", valor='0', qtd=f'{sign}1')
+                + upsert.format(metric="'orcamentos_cliente'", bucket=f"COALESCE({row}.client_id, '')", valor='0', qtd=f'{sign}1')
+                + upsert.format(metric="'orcamentos_cliente_mes'",
+                                bucket=f"COALESCE(strftime('%Y-%m', {row}.created_at), '') || '|' || COALESCE({row}.client_id, '')",
+                                valor='0', qtd=f'{sign}1'))
+
+    def critico(row):
+        return f"(COALESCE({row}.quantidade, 0) > 0 AND COALESCE({row}.quantidade, 0) < 10)"
+
+    triggers = {
+        'trg_kpi_contas_ai': f"AFTER INSERT ON contas BEGIN {contas('new', '+')} END",
+        'trg_kpi_contas_ad': f"AFTER DELETE ON contas BEGIN {contas('old', '-')} END",
+        'trg_kpi_contas_au': f"AFTER UPDATE OF tipo, status, valor, vencimento ON contas BEGIN {contas('old', '-')} {contas('new', '+')} END",
+        'trg_kpi_orcamentos_ai': f"AFTER INSERT ON orcamentos BEGIN {orcamentos('new', '+')} END",
+        'trg_kpi_orcamentos_ad': f"AFTER DELETE ON orcamentos BEGIN {orcamentos('old', '-')} END",
+        'trg_kpi_orcamentos_au': f"AFTER UPDATE OF client_id, created_at ON orcamentos BEGIN {orcamentos('old', '-')} {orcamentos('new', '+')} END",
+        'trg_kpi_estoque_ai': f"AFTER INSERT ON estoque WHEN {critico('new')} BEGIN "
+                              + upsert.format(metric="'estoque_critico'", bucket="''", valor='0', qtd='1') + " END",
+        'trg_kpi_estoque_ad': f"AFTER DELETE ON estoque WHEN {critico('old')} BEGIN "
+                              + upsert.format(metric="'estoque_critico'", bucket="''", valor='0', qtd='-1') + " END",
+        'trg_kpi_estoque_au': f"AFTER UPDATE OF quantidade ON estoque WHEN {critico('new')} != {critico('old')} BEGIN "
+                              + upsert.format(metric="'estoque_critico'", bucket="''", valor='0',
+                                              qtd=f"CASE WHEN {critico('new')} THEN 1 ELSE -1 END") + " END",
+    }
+    for name, body in triggers.items():
+        db.execute(f"DROP TRIGGER IF EXISTS {name}")
+        db.execute(f"CREATE TRIGGER {name} {body}")
+
+    # Backfill (same aggregation as kpis.rebuild at the time of this migration)
+    db.execute("DELETE FROM kpi_rollup")
+    db.execute('''
+        INSERT INTO kpi_rollup (metric, bucket, valor, qtd)
+        SELECT 'contas:' || COALESCE(tipo, '') || ':' || COALESCE(status, ''), COALESCE(date(vencimento), ''), SUM(COALESCE(valor, 0)), COUNT(*)
+        FROM contas GROUP BY 1, 2
+    ''')
+    db.execute("INSERT INTO kpi_rollup (metric, bucket, qtd) SELECT 'orcamentos', '', COUNT(*) FROM orcamentos")
+    db.execute('''
+        INSERT INTO kpi_rollup (metric, bucket, qtd)
+        SELECT 'orcamentos_cliente', COALESCE(client_id, ''), COUNT(*) FROM orcamentos GROUP BY 2
+    ''')
+    db.execute('''
+        INSERT INTO kpi_rollup (metric, bucket, qtd)
+        SELECT 'orcamentos_cliente_mes', COALESCE(strftime('%Y-%m', created_at), '') || '|' || COALESCE(client_id, ''), COUNT(*)
+        FROM orcamentos GROUP BY 2
+    ''')
+    db.execute(f'''
+        INSERT INTO kpi_rollup (metric, bucket, qtd)
+        SELECT 'estoque_critico', '', COUNT(*) FROM estoque WHERE {critico('estoque')}
+    ''')
+
+
+def _m026_report_indexes(db):
+    # Range scans for app/services/reports.py; contas' index covers the cash-flow aggregation
+    db.execute("CREATE INDEX IF NOT EXISTS idx_contas_vencimento ON contas(vencimento, tipo, status, valor)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orcamentos_created_at ON orcamentos(created_at, status)")
+
+
+def _m027_calendar_sync(db):
+    # Incremental sync of app/services/calendar_feed.py: updated_at columns + touch triggers,
+    # deletion log and range indexes (frozen here; later changes go in a new migration)
+    ts = '%Y-%m-%d %H:%M:%f'
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS calendar_deletions (
+            source TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            deleted_at TEXT NOT NULL
+        )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_calendar_deletions_at ON calendar_deletions(deleted_at)")
+    for table in ('orcamentos', 'contas', 'crm_activities'):
+        _add_columns(db, table, [('updated_at', 'TEXT')])
+        db.execute(f"UPDATE {table} SET updated_at = strftime('{ts}', COALESCE(created_at, 'now')) WHERE updated_at IS NULL")
+        db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated_at ON {table}(updated_at)")
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_touch_ai AFTER INSERT ON {table} BEGIN
+                UPDATE {table} SET updated_at = strftime('{ts}', 'now') WHERE id = new.id;
+            END
+        ''')
+        # Writers don't set updated_at; the WHEN keeps the trigger's own UPDATE from looping
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_touch_au AFTER UPDATE ON {table}
+            WHEN new.updated_at IS old.updated_at BEGIN
+                UPDATE {table} SET updated_at = strftime('{ts}', 'now') WHERE id = new.id;
+            END
+        ''')
+        db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_calendar_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO calendar_deletions (source, source_id, deleted_at) VALUES ('{table}', old.id, strftime('{ts}', 'now'));
+            END
+        ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_crm_activities_data ON crm_activities(COALESCE(scheduled_at, created_at))")
+
+
+def _m028_ponto_unique_day(db):
+    # One row per employee-day (the importer upserts on it). The old importer updated the
+    # first row it found, so that one is kept
+    db.execute('''
+        DELETE FROM ponto_registros
+        WHERE id NOT IN (SELECT MIN(id) FROM ponto_registros GROUP BY funcionario_id, data)
+    ''')
+    db.execute("DROP INDEX IF EXISTS idx_ponto_func_data")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_ponto_func_data ON ponto_registros(funcionario_id, data)")
+
+
+def _m029_day_minutes(day, punches, settings):
+    # Frozen copy of ponto.compute_day as of this migration (punches paired in order, late
+    # minutes per matching period, CLT tolerance); later rule changes get their own migration
+    def hhmm(value):
+        try:
+            h, m = (int(v) for v in value.strip().split(':')[:2])
+        except (AttributeError, ValueError):
+            return None
+        return h * 60 + m if 0 <= h < 24 and 0 <= m < 60 else None
+
+    def periods(text):
+        out = []
+        for part in (text or '').split(','):
+            if '-' in part:
+                start, end = (hhmm(v) for v in part.split('-', 1))
+                if start is not None and end is not None:
+                    out.append((start, end))
+        return out
+
+    try:
+        weekday = datetime.strptime(day, '%Y-%m-%d').weekday()
+    except (TypeError, ValueError):
+        weekday = 0
+    schedule = periods(settings.get('ponto_jornada', '07:00-12:00,14:00-18:00')) if weekday < 5 else \
+        periods(settings.get('ponto_jornada_sabado', '')) if weekday == 5 else []
+    tolerancia = int(settings.get('ponto_tolerancia_minutos', 10))
+    expected = sum(end - start for start, end in schedule)
+    times = [t for t in (hhmm(p) for p in punches) if t is not None]
+    if not times:
+        return 0, 0, 0, 'Falta' if expected else 'Folga'
+
+    trabalhado, atrasos = 0, 0
+    for i in range(0, len(times), 2):
+        if i + 1 < len(times):
+            trabalhado += (times[i + 1] - times[i]) % 1440
+        if i // 2 < len(schedule):
+            start, end = schedule[i // 2]
+            if start < times[i] < end:
+                atrasos += times[i] - start
+    extras = trabalhado - expected if trabalhado - expected > tolerancia else 0
+    return trabalhado, extras, atrasos if atrasos > tolerancia else 0, 'Presente'
+
+
+def _m029_ponto_minutes(db):
+    _add_columns(db, 'ponto_registros', [('trabalhado_minutos', 'INTEGER DEFAULT 0')])
+    # Month summaries over all employees: range on data, covering the stored minutes
+    db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ponto_data ON ponto_registros(
+            data, funcionario_id, status, trabalhado_minutos, extras_minutos, atrasos_minutos
+        )
+    ''')
+    settings = {r['key']: r['value'] for r in db.execute("SELECT key, value FROM settings WHERE key LIKE 'ponto_%'")
+                if r['value'] not in (None, '')}
+    rows = db.execute("SELECT id, data, entrada_1, saida_1, entrada_2, saida_2 FROM ponto_registros").fetchall()
+    db.executemany('''
+        UPDATE ponto_registros SET trabalhado_minutos = ?, extras_minutos = ?, atrasos_minutos = ?, status = ? WHERE id = ?
+    ''', [(*_m029_day_minutes(r['data'], (r['entrada_1'], r['saida_1'], r['entrada_2'], r['saida_2']), settings), r['id'])
+          for r in rows])
+
+
+def _m030_contas_indexes(db):
+    # One index per contas query shape (checked by scripts/verify_query_plans.py):
+    # financeiro list (tipo, ORDER BY vencimento), vales per employee and month (payroll,
+    # holerite print) and the billing lookup by orçamento. Range-only scans use idx_contas_vencimento
+    db.execute("CREATE INDEX IF NOT EXISTS idx_contas_tipo_vencimento ON contas(tipo, vencimento)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_contas_funcionario ON contas(funcionario_id, categoria, vencimento, valor)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_contas_orcamento ON contas(orcamento_id, categoria)")
+
+
+
+def _m031_ponto_sem_registro(db):
+    # Days without punches outside every employment period (before hire, after dismissal) were
+    # stored as Falta; they are 'Sem registro' now (ponto.compute_day) and don't count as absences
+    db.execute('''
+        UPDATE ponto_registros SET status = 'Sem registro'
+        WHERE status = 'Falta' AND NOT EXISTS (
+            SELECT 1 FROM funcionario_periodos p
+            WHERE p.funcionario_id = ponto_registros.funcionario_id
+              AND substr(p.data_contratacao, 1, 10) <= ponto_registros.data
+              AND (p.data_demissao IS NULL OR p.data_demissao = '' OR substr(p.data_demissao, 1, 10) >= ponto_registros.data)
+        )
+    ''')
+
+
+MIGRATIONS = [
+    (1, 'baseline schema.sql', _m001_baseline),
+    (2, 'orcamentos/kanban columns', _m002_orcamentos_columns),
+    (3, 'estoque pricing columns', _m003_estoque_columns),
+    (4, 'price_groups color', _m004_price_groups_color),
+    (5, 'itens_catalogo columns', _m005_catalogo_columns),
+    (6, 'budget tiers seed', _m006_budget_tiers),
+    (7, 'payroll tables', _m007_payroll),
+    (8, 'users columns', _m008_users_columns),
+    (9, 'crm tables', _m009_crm),
+    (10, 'promob import tables', _m010_promob_import),
+    (11, 'whatsapp tables', _m011_whatsapp),
+    (12, 'lookup indexes', _m012_indexes),
+    (13, 'normalized orcamento itens', _m013_orcamento_itens),
+    (14, 'promob parse cache', _m014_promob_parse_cache),
+    (15, 'processed_files stage checkpoints', _m015_processed_files_stages),
+    (16, 'discovered_patterns sufficient stats', _m016_pattern_stats),
+    (17, 'promob_mappings normalized keys', _m017_promob_mapping_keys),
+    (18, 'promob import jobs', _m018_promob_import_jobs),
+    (19, 'scrape jobs', _m019_scrape_jobs),
+    (20, 'scrape cache', _m020_scrape_cache),
+    (21, 'estoque price history', _m021_estoque_precos),
+    (22, 'job scheduler', _m022_scheduler),
+    (23, 'estoque listing indexes and version', _m023_estoque_listing),
+    (24, 'full-text search index', _m024_search_index),
+    (25, 'dashboard KPI rollup', _m025_kpi_rollup),
+    (26, 'report range indexes', _m026_report_indexes),
+    (27, 'calendar feed sync', _m027_calendar_sync),
+    (28, 'ponto_registros unique employee-day', _m028_ponto_unique_day),
+    (29, 'ponto worked/overtime minutes', _m029_ponto_minutes),
+    (30, 'contas composite indexes', _m030_contas_indexes),
+    (31, 'ponto days outside employment', _m031_ponto_sem_registro),
+]
+
+
+# --- Runner ---
+
+def current_version(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    row = db.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(db, verbose=True):
+    """
+    Applies pending migrations in order. Each one runs in its own BEGIN IMMEDIATE
+    transaction and re-checks the version, so concurrent gunicorn workers don't race.
+    Returns the list of applied versions.
+    """
+    if db.in_transaction:
+        db.commit()
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version <= current_version(db):
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(db):
+                db.rollback()
+                continue
+            fn(db)
+            db.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            db.commit()
+        except Exception:
+            db.rollback()
+            print(f"Migration {version} ({name}) failed")
+            raise
+        applied.append(version)
+        if verbose:
+            print(f"Migration {version:03d} applied: {name}")
+    schema.refresh(db)
+    return applied
+
+
+def status(db):
+    done = {row['version']: row['applied_at'] for row in db.execute("SELECT version, applied_at FROM schema_version").fetchall()} \
+        if schema.has_table('schema_version') else {}
+    return [{'version': v, 'name': n, 'applied_at': done.get(v)} for v, n, _ in MIGRATIONS]
+
+
+class SchemaCapabilities:
+    """
+    Table/column map read once at startup (after migrations).
+    Handlers check it instead of probing the database or running DDL per request.
+    """
+
+    def __init__(self):
+        self.tables = {}
+
+    def refresh(self, db):
+        names = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+        self.tables = {name: _columns(db, name) for name in names}
+
+    def has_table(self, table):
+        return table in self.tables
+
+    def has_column(self, table, column):
+        return column in self.tables.get(table, ())
+
+
+schema = SchemaCapabilities()
@@ -44,7 +44,10 @@ def client_profile(id):
         })
         
     # B. Orçamentos Events
-    orcamentos = db.execute("SELECT * FROM orcamentos WHERE client_id = ? ORDER BY created_at DESC", (id,)).fetchall()
+    orcamentos = db.execute('''
+        SELECT id, client, client_id, total, status, created_at, prazo_entrega, itens_count, ambientes_count
+        FROM orcamentos WHERE client_id = ? ORDER BY created_at DESC
+    ''', (id,)).fetchall()
     budgets = []
     for orc in orcamentos:
         budgets.append(dict(orc))
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.database import get_db, log_audit
+from app.services.search import fts_query, match_clause
 import sqlite3
 
 bp = Blueprint('clientes', __name__)
@@ -21,10 +22,10 @@ def api_clientes_list():
     query = "SELECT * FROM clientes"
     params = []
     
-    if search_term:
-        query += " WHERE nome LIKE ? OR cpf_cnpj LIKE ? OR email LIKE ?"
-        term = f"%{search_term}%"
-        params = [term, term, term]
+    if search_term and fts_query(search_term):
+        # Full-text index (accent-insensitive prefix match on nome, documento, email, telefone, cidade)
+        query += " WHERE " + match_clause('clientes')
+        params = [fts_query(search_term)]
         
     query += " ORDER BY nome"
     
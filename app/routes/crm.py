@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.database import get_db, log_audit
+from app.services.search import normalize_text
 import datetime
 
 bp = Blueprint('crm', __name__)
@@ -78,27 +79,27 @@ def api_contatos_sync():
 def api_contatos_import():
     # Import from existing Clientes/Funcionarios tables
     db = get_db()
-    count = 0
-    
+    # Existing contacts by normalized name (accents/case), loaded once instead of one query per row
+    existing = {normalize_text(r['nome']) for r in db.execute("SELECT nome FROM crm_contatos").fetchall()}
+    rows = []
+
     # Import Clientes
-    clientes = db.execute("SELECT * FROM clientes").fetchall()
-    for c in clientes:
-        exists = db.execute("SELECT id FROM crm_contatos WHERE nome = ?", (c['nome'],)).fetchone()
-        if not exists:
-            db.execute('''INSERT INTO crm_contatos (nome, tipo, telefone, email, origem, observacoes) 
-                          VALUES (?, 'cliente', ?, ?, ?, ?)''',
-                       (c['nome'], c['telefone'] or c['whatsapp'], c['email'], 'sistema_antigo', f"Importado de Clientes ID {c['id']}"))
-            count += 1
-            
+    for c in db.execute("SELECT id, nome, telefone, whatsapp, email FROM clientes").fetchall():
+        key = normalize_text(c['nome'])
+        if key and key not in existing:
+            existing.add(key)
+            rows.append((c['nome'], 'cliente', c['telefone'] or c['whatsapp'], c['email'], f"Importado de Clientes ID {c['id']}"))
+
     # Import Funcionarios
-    funcionarios = db.execute("SELECT * FROM funcionarios").fetchall()
-    for f in funcionarios:
-        exists = db.execute("SELECT id FROM crm_contatos WHERE nome = ?", (f['nome'],)).fetchone()
-        if not exists:
-            db.execute('''INSERT INTO crm_contatos (nome, tipo, telefone, email, origem, observacoes) 
-                          VALUES (?, 'funcionario', '', '', 'sistema_antigo', f"Importado de Funcionarios ID {f['id']}")''',
-                       (f['nome'],))
-            count += 1
-            
+    for f in db.execute("SELECT id, nome FROM funcionarios").fetchall():
+        key = normalize_text(f['nome'])
+        if key and key not in existing:
+            existing.add(key)
+            rows.append((f['nome'], 'funcionario', '', '', f"Importado de Funcionarios ID {f['id']}"))
+
+    db.executemany('''INSERT INTO crm_contatos (nome, tipo, telefone, email, origem, observacoes)
+                      VALUES (?, ?, ?, ?, 'sistema_antigo', ?)''', rows)
+    count = len(rows)
+
     db.commit()
     return jsonify({'success': True, 'imported': count})
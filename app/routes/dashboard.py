@@ -1,29 +1,23 @@
 from flask import Blueprint, render_template, jsonify, request
 from flask_jwt_extended import jwt_required
 from app.database import get_db
+from datetime import date, timedelta
 
 bp = Blueprint('dashboard', __name__)
 
 @bp.route('/dashboard')
 @jwt_required()
 def dashboard():
+    from app.services.kpis import read_kpis
     db = get_db()
-    
-    # KPIs for initial render
-    row_fat = db.execute("SELECT SUM(valor) as total FROM contas WHERE tipo='receber' AND strftime('%Y-%m', vencimento) = strftime('%Y-%m', 'now')").fetchone()
-    total_revenue = row_fat['total'] if row_fat and row_fat['total'] else 0
-    
-    row_orc = db.execute("SELECT COUNT(*) as c FROM orcamentos").fetchone()
-    total_budgets = row_orc['c'] if row_orc else 0
-    
-    row_est = db.execute("SELECT COUNT(*) as c FROM estoque WHERE quantidade < 10 AND quantidade > 0").fetchone()
-    critical_stock_count = row_est['c'] if row_est else 0
-    
-    row_cli = db.execute("SELECT COUNT(DISTINCT client_id) as c FROM orcamentos").fetchone()
-    total_clients = row_cli['c'] if row_cli else 0
-    
-    row_venc = db.execute("SELECT SUM(valor) as total FROM contas WHERE tipo='pagar' AND status='pendente' AND vencimento < date('now')").fetchone()
-    expired_accounts_total = row_venc['total'] if row_venc and row_venc['total'] else 0
+
+    # KPIs for initial render: precomputed counters (kpi_rollup, kept by triggers)
+    kpis = read_kpis(db)
+    total_revenue = kpis['faturamento_mes']
+    total_budgets = kpis['orcamentos_total']
+    critical_stock_count = kpis['estoque_critico']
+    total_clients = kpis['clientes_total']
+    expired_accounts_total = kpis['contas_vencidas']
 
     return render_template('dashboard_kpi.html', 
                           total_revenue=total_revenue,
@@ -40,28 +34,13 @@ def relatorios():
 @bp.route('/api/kpis')
 @jwt_required()
 def api_kpis():
+    from app.services.kpis import read_kpis
+    from app.services.reports import cash_flow
     db = get_db()
-    
-    # 1. Faturamento Mês
-    row_fat = db.execute("SELECT SUM(valor) as total FROM contas WHERE tipo='receber' AND strftime('%Y-%m', vencimento) = strftime('%Y-%m', 'now')").fetchone()
-    faturamento = row_fat['total'] if row_fat and row_fat['total'] else 0
-    
-    # 2. Orçamentos (Total vs Approved)
-    row_orc = db.execute("SELECT COUNT(*) as c FROM orcamentos").fetchone()
-    total_orc = row_orc['c'] if row_orc else 0
-    
-    # 3. Estoque Crítico (< 10)
-    row_est = db.execute("SELECT COUNT(*) as c FROM estoque WHERE quantidade < 10 AND quantidade > 0").fetchone()
-    estoque_crit = row_est['c'] if row_est else 0
-    
-    # 4. Clientes Novos (This Month)
-    row_cli = db.execute("SELECT COUNT(DISTINCT client_id) as c FROM orcamentos WHERE strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now')").fetchone()
-    clientes = row_cli['c'] if row_cli else 0
-    
-    # 5. Contas Vencidas
-    row_venc = db.execute("SELECT SUM(valor) as total FROM contas WHERE tipo='pagar' AND status='pendente' AND vencimento < date('now')").fetchone()
-    vencidas = row_venc['total'] if row_venc and row_venc['total'] else 0
-    
+
+    # 1-5. Faturamento mês, orçamentos, estoque crítico (< 10), clientes novos (mês), contas vencidas
+    kpis = read_kpis(db)
+
     # 6. Margem Média Projetos (Target from Config)
     # Check if config_fabrica table exists first (handling migration edge cases)
     try:
@@ -72,17 +51,9 @@ def api_kpis():
 
     # 7. Charts Data
     # A. Faturamento (Last 30 days)
-    fat_query = '''
-        SELECT strftime('%d/%m', vencimento) as day, SUM(valor) as total
-        FROM contas
-        WHERE tipo='receber' 
-        AND vencimento >= date('now', '-30 days')
-        GROUP BY day
-        ORDER BY vencimento ASC
-    '''
-    fat_rows = db.execute(fat_query).fetchall()
-    fat_labels = [r['day'] for r in fat_rows]
-    fat_data = [r['total'] for r in fat_rows]
+    fat_rows = cash_flow(db, date.today() - timedelta(days=30), None, 'day')
+    fat_labels = [r['label'] for r in fat_rows]
+    fat_data = [r['receita'] for r in fat_rows]
     
     # B. Estoque por Categoria
     est_query = '''
@@ -102,11 +73,11 @@ def api_kpis():
         est_data = [db.execute("SELECT COUNT(*) FROM estoque").fetchone()[0]]
 
     return jsonify({
-        'faturamento_mes': faturamento,
-        'orcamentos_total': total_orc,
-        'estoque_critico': estoque_crit,
-        'clientes_novos': clientes,
-        'contas_vencidas': vencidas,
+        'faturamento_mes': kpis['faturamento_mes'],
+        'orcamentos_total': kpis['orcamentos_total'],
+        'estoque_critico': kpis['estoque_critico'],
+        'clientes_novos': kpis['clientes_novos'],
+        'contas_vencidas': kpis['contas_vencidas'],
         'margem_projetos': margem,
         'charts': {
             'fat_labels': fat_labels,
@@ -1,7 +1,13 @@
+import hashlib
+
 from flask import Blueprint, render_template, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.database import get_db, log_audit
-from app.scraper import run_scraping_job, raspador_site
+
+from app.database import get_db, log_audit, table_version
+from app.migrations import schema
+from app.scraper import run_scraping_job, scrape_item, start_bulk_refresh, get_bulk_job
+from app.services.estoque_listing import list_estoque
+from app.utils import conditional_json
 
 bp = Blueprint('estoque', __name__)
 
@@ -10,20 +16,13 @@ bp = Blueprint('estoque', __name__)
 def estoque():
     db = get_db()
     
-    # Check if price_groups table exists
-    try:
-        db.execute('SELECT 1 FROM price_groups LIMIT 1')
-        has_price_groups = True
-    except:
-        has_price_groups = False
-        
-    items = db.execute('SELECT * FROM estoque').fetchall()
-    
+    # Items are loaded page by page by the grid (/api/estoque?limit=...)
+    # Capability map is filled at startup by the migrations (no per-request probe)
     price_groups = []
-    if has_price_groups:
+    if schema.has_table('price_groups'):
         price_groups = db.execute('SELECT * FROM price_groups').fetchall()
         
-    return render_template('estoque.html', items=items, price_groups=price_groups)
+    return render_template('estoque.html', price_groups=price_groups)
 
 @bp.route('/catalogo')
 @jwt_required()
@@ -33,9 +32,27 @@ def catalogo():
 @bp.route('/api/estoque', methods=['GET'])
 @jwt_required()
 def api_estoque_list():
+    """
+    Query: fields=a,b (projection), categoria, price_group_id, is_acessorio=0|1, baixo_estoque=1, q,
+    sort=nome|categoria|custo|quantidade|last_update, dir=asc|desc, limit + cursor (keyset pages).
+    Without limit returns the plain list (legacy callers).
+    """
+    db = get_db()
+    query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    etag = f"estoque-{table_version(db, 'estoque')}-{hashlib.md5(query.encode()).hexdigest()[:12]}"
+    try:
+        return conditional_json(etag, lambda: list_estoque(db, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@bp.route('/api/estoque/<int:id>', methods=['GET'])
+@jwt_required()
+def api_estoque_get(id):
     db = get_db()
-    items = db.execute('SELECT * FROM estoque').fetchall()
-    return jsonify([dict(item) for item in items])
+    item = db.execute('SELECT * FROM estoque WHERE id = ?', (id,)).fetchone()
+    if not item:
+        return jsonify({'error': 'Item não encontrado'}), 404
+    return jsonify(dict(item))
 
 @bp.route('/api/estoque', methods=['POST'])
 @jwt_required()
@@ -122,62 +139,16 @@ def api_estoque_raspar_individual():
         return jsonify({'success': False, 'error': 'Item não encontrado'}), 404
     
     try:
-        urls = {
-            'madeiranit': item['url_madeiranit'],
-            'leomadeiras': item['url_leomadeiras'],
-            'madeverde': item['url_madeverde']
-        }
-        
-        precos_encontrados = {}
-        updates = []
-        params = []
-        
-        for source, url in urls.items():
-            if url:
-                novos_items = raspador_site(source, url_override=url) 
-                if novos_items:
-                    novo_preco = novos_items[0]['preco']
-                    precos_encontrados[source] = novo_preco
-                    updates.append(f"preco_{source} = ?")
-                    params.append(novo_preco)
-
-        if not precos_encontrados:
+        # Every source of the item is fetched concurrently (pooled sessions, retries)
+        result = scrape_item(db, item)
+        if not result:
              return jsonify({'success': False, 'error': 'Nenhuma URL válida ou falha na raspagem de todas as fontes'}), 500
-
-        strategy = item['price_strategy'] if item.get('price_strategy') else 'auto_max'
-        novo_custo = item['custo_unitario'] 
-        site_escolhido = item['site_origem']
-
-        if strategy == 'auto_max':
-            if precos_encontrados:
-                max_source = max(precos_encontrados, key=precos_encontrados.get)
-                novo_custo = precos_encontrados[max_source]
-                site_escolhido = max_source
-        elif strategy in precos_encontrados:
-            novo_custo = precos_encontrados[strategy]
-            site_escolhido = strategy
-        
-        updates.append("custo_unitario = ?")
-        params.append(novo_custo)
-        updates.append("site_origem = ?")
-        params.append(site_escolhido)
-        updates.append("last_update = datetime('now')")
-        params.append(item_id)
-        
-        query = f"UPDATE estoque SET {', '.join(updates)} WHERE id = ?"
-        db.execute(query, params)
         db.commit()
         
         log_audit(user_id, 'ESTOQUE_RASPAGEM_SMART', 
-                f"Item {item['nome']} (ID {item_id}) atualizado. Strat: {strategy}, Novo Custo: {novo_custo}, Detalhes: {precos_encontrados}")
+                f"Item {item['nome']} (ID {item_id}) atualizado. Strat: {result['strategy']}, Novo Custo: {result['preco']}, Detalhes: {result['detalhes']}")
         
-        return jsonify({
-            'success': True,
-            'preco': novo_custo,
-            'site': site_escolhido,
-            'detalhes': precos_encontrados,
-            'strategy': strategy
-        })
+        return jsonify({'success': True, 'item': item['nome'], **result})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -196,6 +167,33 @@ def api_estoque_ids_para_raspar():
     ids = [row[0] for row in rows]
     return jsonify({'ids': ids, 'count': len(ids)})
 
+@bp.route('/api/estoque/raspar-todos', methods=['POST'])
+@jwt_required()
+def api_estoque_raspar_todos():
+    """Starts (or joins) the server-side bulk refresh of every item with URLs."""
+    user_id = get_jwt_identity()
+    db = get_db()
+    job_id, started = start_bulk_refresh(db, user_id)
+    if started:
+        log_audit(user_id, 'ESTOQUE_RASPAGEM_LOTE', f"Bulk scrape job #{job_id} started")
+    return jsonify({'success': True, 'job_id': job_id, 'started': started}), 202
+
+@bp.route('/api/estoque/raspar-todos/<int:job_id>', methods=['GET'])
+@jwt_required()
+def api_estoque_raspar_todos_status(job_id):
+    job = get_bulk_job(get_db(), job_id, since=request.args.get('since', 0, type=int))
+    if not job:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    return jsonify({'success': True, **job})
+
+@bp.route('/api/estoque/raspar-todos/<int:job_id>/cancelar', methods=['POST'])
+@jwt_required()
+def api_estoque_raspar_todos_cancel(job_id):
+    db = get_db()
+    db.execute("UPDATE scrape_jobs SET status = 'cancel_requested' WHERE id = ? AND status IN ('queued', 'running')", (job_id,))
+    db.commit()
+    return jsonify({'success': True})
+
 @bp.route('/api/estoque/raspar', methods=['POST'])
 @jwt_required()
 def api_estoque_raspar():
@@ -1,7 +1,6 @@
 from flask import Blueprint, render_template, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.database import get_db, log_audit
-from datetime import datetime
 import json
 
 bp = Blueprint('financeiro', __name__)
@@ -64,48 +63,20 @@ def api_contas_from_orcamento(orc_id):
     if not orc:
         return jsonify({'error': 'Orcamento not found'}), 404
         
-    # Get Payment Details
-    metodo = data.get('metodo', 'outro')
-    entrada = float(data.get('entrada') or 0)
-    parcelas = int(data.get('parcelas') or 1)
-    
-    total = orc['total']
-    saldo = total - entrada
-    
-    # 1. Register Down Payment (if any)
-    if entrada > 0:
-        db.execute('INSERT INTO contas (tipo, descricao, valor, vencimento, status, categoria, orcamento_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                   ('receber', f"Entrada Orç. #{orc_id} - {orc['client']}", entrada, datetime.now().strftime('%Y-%m-%d'), 'pago', 'venda_entrada', orc_id))
-
-    # 2. Register Installments (if any saldo left)
-    if saldo > 0:
-        valor_parcela = saldo / parcelas
-        from datetime import timedelta
-        hoje = datetime.now()
-        
-        for i in range(parcelas):
-            venc = hoje + timedelta(days=30 * (i+1))
-            desc = f"Parc. {i+1}/{parcelas} Orç. #{orc_id} ({metodo})"
-            db.execute('INSERT INTO contas (tipo, descricao, valor, vencimento, status, categoria, orcamento_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                       ('receber', desc, valor_parcela, venc.strftime('%Y-%m-%d'), 'pendente', 'venda_parcela', orc_id))
-
-    # 3. Save Payment Info in Orcamento
-    pag_info = {
-        'metodo': metodo,
-        'entrada': entrada,
-        'parcelas': parcelas,
-        'valor_parcela': saldo/parcelas if parcelas > 0 else 0
-    }
-    
+    # Entrada + parcelas (meses de calendário a partir de hoje) numa única escrita
+    from app.services import ledger
+    if ledger.is_billed(db, orc_id):
+        return jsonify({'error': f'Orçamento #{orc_id} já foi faturado'}), 409
     try:
-        db.execute("ALTER TABLE orcamentos ADD COLUMN pagamento_json TEXT")
-    except:
-        pass # Already exists
-        
+        pag_info = ledger.bill_orcamento(db, orc, data.get('metodo', 'outro'),
+                                         float(data.get('entrada') or 0), int(data.get('parcelas') or 1))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
     db.execute("UPDATE orcamentos SET status = 'Faturado', pagamento_json = ? WHERE id = ?", (json.dumps(pag_info), orc_id))
     db.commit()
     
-    log_audit(user_id, 'CONTA_FROM_ORCAMENTO', f"Faturado Orc #{orc_id}. Entrada: {entrada}")
+    log_audit(user_id, 'CONTA_FROM_ORCAMENTO', f"Faturado Orc #{orc_id}. Entrada: {pag_info['entrada']}")
     return jsonify({'success': True})
 
 
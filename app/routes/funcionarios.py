@@ -199,33 +199,9 @@ def api_rescisao_calc(id):
 @bp.route('/api/holerite/<int:id>', methods=['POST'])
 @jwt_required()
 def api_holerite_calc(id):
-    user_id = get_jwt_identity()
+    from app.services import payroll
     db = get_db()
     
-    # Garantir que tabelas de suporte existam
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS holerites_pagos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            funcionario_id INTEGER NOT NULL,
-            mes_referencia TEXT NOT NULL,
-            valor_pago REAL NOT NULL,
-            data_pagamento DATE DEFAULT (date('now')),
-            conta_id INTEGER,
-            UNIQUE(funcionario_id, mes_referencia)
-        )
-    ''')
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS funcionario_saldos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            funcionario_id INTEGER NOT NULL,
-            valor REAL NOT NULL,
-            mes_origem TEXT NOT NULL,
-            status TEXT DEFAULT 'pendente',
-            FOREIGN KEY(funcionario_id) REFERENCES funcionarios(id)
-        )
-    ''')
-    db.commit()
-
     data_ref = request.json.get('data') if request.json else None
     if not data_ref:
         now = datetime.now()
@@ -234,146 +210,83 @@ def api_holerite_calc(id):
     ref_date = datetime.strptime(data_ref, '%Y-%m-%d')
     month_str = ref_date.strftime('%Y-%m') 
     
-    func = db.execute('SELECT * FROM funcionarios WHERE id=?', (id,)).fetchone()
+    func = db.execute('SELECT id FROM funcionarios WHERE id=?', (id,)).fetchone()
     if not func: return jsonify({'error': 'Not found'}), 404
     
-    # 🕵️ Verificação de Atividade no Mês de Referência
-    query_active = '''
-        SELECT 1 FROM funcionario_periodos 
-        WHERE funcionario_id = ? 
-        AND strftime('%Y-%m', data_contratacao) <= ? 
-        AND (data_demissao IS NULL OR data_demissao = '' OR strftime('%Y-%m', data_demissao) >= ?)
-    '''
-    is_active = db.execute(query_active, (id, month_str, month_str)).fetchone()
-    
-    if not is_active:
+    # 🕵️ Só calcula se estava ativo no mês de referência (funcionario_periodos)
+    slip = payroll.calculate(db, month_str, [id]).get(id)
+    if not slip:
         return jsonify({
             'error': f'Funcionário não estava ativo em {month_str}.'
         }), 400
 
-    # Verifica se já foi pago
-    pago = db.execute('SELECT * FROM holerites_pagos WHERE funcionario_id=? AND mes_referencia=?', (id, month_str)).fetchone()
-
-    salario_base = func['salario_base']
-    inss_percent = func['inss_percent'] if func['inss_percent'] else 0.11
-    
-    # 1. Buscando Vales do mês atual
-    vales_query = '''
-        SELECT SUM(valor) as total 
-        FROM contas 
-        WHERE funcionario_id = ? 
-        AND categoria = 'vale_funcionario'
-        AND strftime('%Y-%m', vencimento) = ?
-    '''
-    vales_total = db.execute(vales_query, (id, month_str)).fetchone()['total'] or 0.0
-    
-    # 2. Buscando Saldos Devedores de meses anteriores
-    saldo_devedor = db.execute('''
-        SELECT SUM(valor) as total 
-        FROM funcionario_saldos 
-        WHERE funcionario_id = ? AND status = 'pendente' AND mes_origem < ?
-    ''', (id, month_str)).fetchone()['total'] or 0.0
-    
-    inss_val = salario_base * inss_percent
-    fgts_val = salario_base * (func['fgts_percent'] if func['fgts_percent'] else 0.08)
-    
-    descontos_list = json.loads(func['descontos_json']) if func['descontos_json'] else []
-    
-    total_descontos = inss_val + vales_total + saldo_devedor
-    for d in descontos_list:
-        total_descontos += d.get('valor', 0)
-        
-    liquido = max(0, salario_base - total_descontos)
-    
-    # Se o total de descontos supera o salário, geraremos um saldo devedor REAL quando finalizado
-    excedente = max(0, total_descontos - salario_base)
-
-    return jsonify({
-        'funcionario': func['nome'],
-        'referencia': month_str,
-        'salario_base': salario_base,
-        'inss_percent': inss_percent,
-        'inss_val': inss_val,
-        'fgts_val': fgts_val,
-        'vales_val': vales_total,
-        'saldo_devedor_anterior': saldo_devedor,
-        'outros_descontos': descontos_list,
-        'liquido': liquido,
-        'status_pagamento': 'Pago' if pago else 'Pendente',
-        'pago_em': pago['data_pagamento'] if pago else None,
-        'excedente_para_proximo': excedente
-    })
+    return jsonify(slip)
 
 @bp.route('/api/holerite/<int:id>/finalize', methods=['POST'])
 @jwt_required()
 def api_holerite_finalize(id):
+    from app.services import payroll
     user_id = get_jwt_identity()
     db = get_db()
     mes = request.json.get('month')
     if not mes: return jsonify({'error': 'Mês necessário'}), 400
     
-    # Recalcula para garantir valores frescos
-    calc_res = api_holerite_calc(id)
-    if calc_res.status_code != 200: return calc_res
-    data = calc_res.get_json()
-    
-    # 1. Registra o Holerite como Pago
     try:
-        db.execute('INSERT INTO holerites_pagos (funcionario_id, mes_referencia, valor_pago) VALUES (?, ?, ?)',
-                   (id, mes, data['liquido']))
-    except Exception as e:
+        res = payroll.run_payroll(db, mes, [id], dry_run=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not res['resultados']:
+        return jsonify({'error': f'Funcionário não estava ativo em {mes}.'}), 400
+    slip = res['resultados'][0]
+    if slip['status'] == 'ja_pago':
         return jsonify({'error': 'Holerite deste mês já estava finalizado.'}), 400
-        
-    # 2. Registra a despesa no financeiro se houver valor líquido
-    if data['liquido'] > 0:
-        db.execute('''
-            INSERT INTO contas (tipo, descricao, valor, vencimento, status, categoria, funcionario_id) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', ('pagar', f"Salário {mes} - {data['funcionario']}", data['liquido'], datetime.now().strftime('%Y-%m-%d'), 'pago', 'pagamento_salario', id))
-        
-    # 3. Gerir Saldo Devedor (Excedente)
-    # Primeiro marca os saldos anteriores como compensados
-    db.execute("UPDATE funcionario_saldos SET status = 'compensado' WHERE funcionario_id = ? AND mes_origem < ?", (id, mes))
-    
-    # Se sobrou dívida, cria um novo saldo devedor
-    if data['excedente_para_proximo'] > 0:
-        db.execute('INSERT INTO funcionario_saldos (funcionario_id, valor, mes_origem) VALUES (?, ?, ?)',
-                   (id, data['excedente_para_proximo'], mes))
                    
-    db.commit()
-    log_audit(user_id, 'HOLERITE_FINALIZE', f"Finalizado holerite {mes} para {data['funcionario']}")
+    log_audit(user_id, 'HOLERITE_FINALIZE', f"Finalizado holerite {mes} para {slip['funcionario']}")
     return jsonify({'success': True})
 
 @bp.route('/api/holerite/bulk', methods=['POST'])
 @jwt_required()
 def api_holerite_bulk():
+    """
+    Folha do mês inteira. Body: {month: 'YYYY-MM', dry_run: true (default, prévia) | false (finaliza
+    todos os pendentes numa transação), ids: [opcional]}. Returns the per-employee report.
+    """
+    from app.services import payroll
+    user_id = get_jwt_identity()
     db = get_db()
-    mes = request.json.get('month')
+    data = request.json or {}
+    mes = data.get('month')
     if not mes: return jsonify({'error': 'Mês necessário'}), 400
+    dry_run = data.get('dry_run', True) is not False
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(type(i) is int for i in ids)):
+        return jsonify({'error': 'ids deve ser uma lista de IDs numéricos'}), 400
     
-    funcs = db.execute('SELECT id FROM funcionarios').fetchall()
-    count = 0
-    ref_date = mes + "-01"
+    try:
+        res = payroll.run_payroll(db, mes, ids, dry_run=dry_run)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    for f in funcs:
-        # Apenas tenta calcular. Se der erro (ex: inativo), ignora no bulk
-        try:
-            # Simulando internamente o cálculo (opcional: apenas validar se existe período ativo)
-            count += 1
-        except:
-            pass
-            
-    return jsonify({'success': True, 'count': count, 'message': 'Processamento em lote concluído'})
+    if not dry_run:
+        log_audit(user_id, 'HOLERITE_BULK', f"Folha {mes}: {res['totais']['pendentes']} holerites finalizados, líquido R$ {res['totais']['liquido']:.2f}")
+    res.update({'success': True, 'count': res['totais']['funcionarios']})
+    return jsonify(res)
     
 
 @bp.route('/holerite/print/<int:id>', methods=['GET'])
 @jwt_required()
 def holerite_print(id):
+    from app.services.payroll import month_bounds
     db = get_db()
     month_str = request.args.get('mes')
     if not month_str:
         month_str = datetime.now().strftime('%Y-%m')
     
+    try:
+        inicio, fim = month_bounds(month_str)
+    except ValueError as e:
+        return str(e), 400
+    
     func = db.execute('SELECT * FROM funcionarios WHERE id=?', (id,)).fetchone()
     if not func: return "Funcionário não encontrado", 404
     
@@ -395,9 +308,9 @@ def holerite_print(id):
         FROM contas 
         WHERE funcionario_id = ? 
         AND categoria = 'vale_funcionario'
-        AND strftime('%Y-%m', vencimento) = ?
+        AND vencimento >= ? AND vencimento < ?
     '''
-    vales_total = db.execute(vales_query, (id, month_str)).fetchone()['total'] or 0.0
+    vales_total = db.execute(vales_query, (id, inicio, fim)).fetchone()['total'] or 0.0
     
     inss_val = salario_base * inss_percent
     fgts_val = salario_base * (func['fgts_percent'] if func['fgts_percent'] else 0.08)
@@ -430,7 +343,7 @@ def holerite_print(id):
 @bp.route('/api/ponto/upload', methods=['POST'])
 @jwt_required()
 def api_ponto_upload():
-    import pandas as pd
+    from app.services.ponto import import_ponto
     
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -443,70 +356,12 @@ def api_ponto_upload():
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
+        db = get_db()
         try:
-            xls = pd.ExcelFile(filepath)
-            sheet = '1.2.3' if '1.2.3' in xls.sheet_names else xls.sheet_names[0]
-            df = pd.read_excel(filepath, sheet_name=sheet, header=None)
-        except Exception as e:
+            logs = import_ponto(db, filepath, filename)
+        except (ValueError, OSError, ImportError) as e:
+            db.rollback()
             return jsonify({'error': f"Erro ao ler Excel: {str(e)}"}), 400
-            
-        db = get_db()
-        logs = []
-        
-        num_cols = df.shape[1]
-        block_size = 15
-        
-        for start_col in range(0, num_cols, block_size):
-            name_col_idx = start_col + 9
-            if name_col_idx >= num_cols: break
-            
-            emp_name = str(df.iloc[2, name_col_idx]).strip()
-            if emp_name == 'nan': continue
-            
-            func = db.execute("SELECT id FROM funcionarios WHERE nome_ponto = ? OR nome LIKE ?", (emp_name, f"%{emp_name}%")).fetchone()
-            
-            func_id = None
-            if func:
-                func_id = func['id']
-                db.execute("UPDATE funcionarios SET nome_ponto = ? WHERE id = ? AND (nome_ponto IS NULL OR nome_ponto = '')", (emp_name, func_id))
-            else:
-                logs.append(f"Funcionario não encontrado: {emp_name}")
-                continue
-                
-            for i in range(10, min(50, len(df))):
-                date_cell = str(df.iloc[i, start_col]).strip()
-                if len(date_cell) > 0 and date_cell[0].isdigit() and ' ' in date_cell:
-                    day_str = date_cell.split(' ')[0]
-                    
-                    try:
-                        period_str = str(df.iloc[3, start_col+3])
-                        year = int(period_str[0:4])
-                        month = int(period_str[5:7])
-                        full_date = f"{year}-{month:02d}-{day_str}"
-                    except:
-                        try:
-                            parts = filename.split('_')
-                            full_date = f"{parts[1]}-{int(parts[2]):02d}-{day_str}"
-                        except:
-                            full_date = datetime.now().strftime(f"%Y-%m-{day_str}")
-                    
-                    def get_time(r, c):
-                        val = str(df.iloc[r, c]).strip()
-                        return val if ':' in val else None
-
-                    e1 = get_time(i, start_col + 1)
-                    s1 = get_time(i, start_col + 3)
-                    e2 = get_time(i, start_col + 6)
-                    s2 = get_time(i, start_col + 8)
-                    
-                    exists = db.execute("SELECT id FROM ponto_registros WHERE funcionario_id=? AND data=?", (func_id, full_date)).fetchone()
-                    if exists:
-                         db.execute("UPDATE ponto_registros SET entrada_1=?, saida_1=?, entrada_2=?, saida_2=? WHERE id=?", (e1, s1, e2, s2, exists['id']))
-                    else:
-                        db.execute("INSERT INTO ponto_registros (funcionario_id, data, entrada_1, saida_1, entrada_2, saida_2) VALUES (?, ?, ?, ?, ?, ?)",
-                                   (func_id, full_date, e1, s1, e2, s2))
-                                   
-            logs.append(f"Processado: {emp_name}")
 
         db.commit()
         return jsonify({'success': True, 'logs': logs})
@@ -517,6 +372,7 @@ def api_ponto_upload():
 @bp.route('/api/ponto/registros', methods=['GET'])
 @jwt_required()
 def api_ponto_list():
+    from app.services.payroll import month_bounds
     db = get_db()
     month = request.args.get('month')
     func_id = request.args.get('funcionario_id')
@@ -530,8 +386,12 @@ def api_ponto_list():
     clauses = []
     
     if month:
-        clauses.append("strftime('%Y-%m', p.data) = ?")
-        params.append(month)
+        try:
+            inicio, fim = month_bounds(month)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        clauses.append("p.data >= ? AND p.data < ?")
+        params += [inicio, fim]
         
     if func_id:
         clauses.append("p.funcionario_id = ?")
@@ -544,3 +404,41 @@ def api_ponto_list():
     
     rows = db.execute(query, params).fetchall()
     return jsonify([dict(r) for r in rows])
+
+@bp.route('/api/ponto/resumo', methods=['GET'])
+@jwt_required()
+def api_ponto_resumo():
+    """Totais do mês por funcionário (minutos trabalhados, extras, atrasos, faltas). Query: month=YYYY-MM, funcionario_id."""
+    from app.services.payroll import month_bounds
+    from app.services.ponto import monthly_summary, format_minutes
+    db = get_db()
+    month = request.args.get('month') or datetime.now().strftime('%Y-%m')
+    try:
+        inicio, fim = month_bounds(month)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    resumo = monthly_summary(db, inicio, fim, request.args.get('funcionario_id'))
+    for r in resumo:
+        for key in ('trabalhado', 'extras', 'atrasos'):
+            r[f'{key}_horas'] = format_minutes(r[f'{key}_minutos'])
+    return jsonify({'month': month, 'funcionarios': resumo})
+
+@bp.route('/api/ponto/recalcular', methods=['POST'])
+@jwt_required()
+def api_ponto_recalcular():
+    """Recalcula os minutos gravados (ex.: depois de mudar ponto_jornada). Body: {month: 'YYYY-MM'} opcional."""
+    from app.services.payroll import month_bounds
+    from app.services.ponto import recompute
+    user_id = get_jwt_identity()
+    db = get_db()
+    month = (request.json or {}).get('month')
+    try:
+        inicio, fim = month_bounds(month) if month else (None, None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    count = recompute(db, inicio, fim)
+    db.commit()
+    log_audit(user_id, 'PONTO_RECALC', f"Recalculated {count} time-clock days ({month or 'all'})")
+    return jsonify({'success': True, 'count': count})
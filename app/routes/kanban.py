@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.database import get_db, log_audit
+from app.services.search import search_ids
 import json
 from datetime import datetime, timedelta
 
@@ -146,87 +147,29 @@ def api_kanban_convert(id):
 @bp.route('/api/calendar/events', methods=['GET'])
 @jwt_required()
 def api_calendar_events():
+    """
+    Query: start/end (YYYY-MM-DD, end exclusive; default previous..next month), updated_since (cursor).
+    Without updated_since: list of events in the window, sorted by start; the sync cursor
+    goes in the X-Sync-Cursor header. With it: {'events', 'removed', 'reset', 'cursor'}.
+    """
+    from app.services.calendar_feed import parse_window, window_events, changed_events, sync_cursor
     db = get_db()
-    events = []
-    
-    # Internal Events only for now (Google Auth removed/simplified)
-    # 1. Orçamentos (Prazos, Instalação, Visitas)
-    orcamentos = db.execute('SELECT id, client, client_id, prazo_entrega, data_instalacao, created_at, status FROM orcamentos').fetchall()
-    for orc in orcamentos:
-        if orc['prazo_entrega']:
-            events.append({
-                'id': f"orc_{orc['id']}",
-                'title': f"Prazo: {orc['client']}",
-                'start': orc['prazo_entrega'],
-                'type': 'project',
-                'description': f"Orçamento #{orc['id']} - {orc['status']}",
-                'cli_id': orc['client_id']
-            })
-        if orc['data_instalacao']:
-            events.append({
-                'id': f"inst_{orc['id']}",
-                'title': f"Instalação: {orc['client']}",
-                'start': orc['data_instalacao'],
-                'type': 'install',
-                'description': f"Instalação confirmada - {orc['client']}",
-                'cli_id': orc['client_id']
-            })
-        if orc['created_at']:
-            # Maybe restrict simple 'created_at' to only recent or vital ones to avoid clutter?
-            # Keeping it for now as "Visita/Contato" marker
-            events.append({
-                'id': f"visit_{orc['id']}",
-                'title': f"Visita/Contato: {orc['client']}",
-                'start': orc['created_at'].split(' ')[0], 
-                'type': 'visit',
-                'description': f"Primeiro contato/Visita técnica",
-                'cli_id': orc['client_id']
-            })
+    try:
+        start, end = parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # 2. Financeiro (Contas)
-    contas = db.execute('SELECT id, descricao, valor, tipo, vencimento, status FROM contas WHERE status="pendente"').fetchall()
-    for conta in contas:
-        evt_type = 'receber' if conta['tipo'] == 'receber' else 'payable'
-        title_prefix = 'Receber' if conta['tipo'] == 'receber' else 'Pagar'
-        
-        events.append({
-            'id': f"fin_{conta['id']}",
-            'title': f"{title_prefix}: {conta['descricao']}",
-            'start': conta['vencimento'],
-            'type': evt_type,
-            'description': f"R$ {conta['valor']:.2f} - {conta['status']}"
-        })
-        
-    # 3. CRM Activities (NEW)
-    activities = db.execute("SELECT * FROM crm_activities").fetchall()
-    for act in activities:
-        # Determine color/type mapping
-        # types: note, visit, meeting, call
-        etype = 'visit' # default purple for unknown
-        if act['activity_type'] == 'note': etype = 'note'
-        elif act['activity_type'] == 'visit': etype = 'visit'
-        elif act['activity_type'] == 'meeting': etype = 'visit'
-        
-        # If pending or future? 
-        # Show all for history? Or only future? 
-        # Calendar usually shows everything.
-        
-        # Check if date exists (some notes might not have scheduled date, only created_at)
-        # We use scheduled_at if available, else created_at
-        date_str = act['scheduled_at'] if act['scheduled_at'] else act['created_at']
-        if date_str:
-            events.append({
-                'id': f"act_{act['id']}",
-                'title': act['title'],
-                'start': date_str, # Return full DATETIME for frontend sorting
-                'type': etype,
-                'description': act['description'],
-                'cli_id': act['client_id']
-            })
+    # Cursor taken before reading: anything written during the read is in the next delta
+    cursor = sync_cursor(db)
+    since = request.args.get('updated_since')
+    if since:
+        delta = changed_events(db, start, end, since)
+        delta['cursor'] = cursor
+        return jsonify(delta)
 
-    # Final Sort by Start Date
-    events.sort(key=lambda x: x['start'])
-    return jsonify(events)
+    resp = jsonify(window_events(db, start, end))
+    resp.headers['X-Sync-Cursor'] = cursor
+    return resp
 
 @bp.route('/api/kanban/activity', methods=['POST'])
 @jwt_required()
@@ -243,10 +186,10 @@ def add_kanban_activity():
     # Try to find client_id by text if provided
     client_id = None
     if client_name:
-        # Simple lookup
-        cli = db.execute("SELECT id FROM clientes WHERE nome LIKE ?", (f"%{client_name}%",)).fetchone()
-        if cli:
-            client_id = cli['id']
+        # Best full-text match
+        ids = search_ids(db, 'clientes', client_name, limit=1)
+        if ids:
+            client_id = ids[0]
             
     # Insert
     # We use 'scheduled_at' for the calendar date
@@ -64,6 +64,75 @@ def api_system_metadata():
     }
     return jsonify(metadata)
 
+@bp.route('/api/system/stats', methods=['GET'])
+@jwt_required()
+def api_system_stats():
+    """
+    Runtime stats for this worker process (DB connection pool, audit queue, Promob imports, scheduler).
+    """
+    from app.database import db_pool
+    from app.audit import audit_sink
+    from app.services.promob_jobs import import_queue
+    from app.scheduler import scheduler
+    import os
+
+    return jsonify({
+        'pid': os.getpid(),
+        'db_pool': db_pool.stats(),
+        'audit': audit_sink.stats(),
+        'promob_imports': import_queue.stats(),
+        'scheduler': scheduler.stats()
+    })
+
+@bp.route('/api/system/jobs', methods=['GET'])
+@jwt_required()
+def api_system_jobs():
+    from app.database import get_db
+    from app.scheduler import list_jobs
+    return jsonify(list_jobs(get_db()))
+
+@bp.route('/api/system/jobs/<name>', methods=['POST'])
+@jwt_required()
+def api_system_jobs_update(name):
+    """Body: {cron?, enabled?, run_now?}"""
+    from flask import request
+    from app.database import get_db
+    from app.scheduler import scheduler, update_job
+    data = request.json or {}
+    db = get_db()
+    try:
+        found = update_job(db, name, cron=data.get('cron'), enabled=data.get('enabled'), run_now=bool(data.get('run_now')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not found:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    db.commit()
+    scheduler.wake()
+    return jsonify({'success': True})
+
+@bp.route('/api/system/jobs/runs', methods=['GET'])
+@jwt_required()
+def api_system_job_runs():
+    from flask import request
+    from app.database import get_db
+    from app.scheduler import list_runs
+    return jsonify(list_runs(get_db(), request.args.get('job'), request.args.get('limit', 50, type=int)))
+
+@bp.route('/api/search', methods=['GET'])
+@jwt_required()
+def api_search():
+    """
+    Unified full-text search. Query: q, types=estoque,catalogo,clientes,contatos (default all), limit (per type).
+    Accent/case-insensitive prefix match, best results first.
+    """
+    from flask import request
+    from app.database import get_db
+    from app.services.search import search
+    q = request.args.get('q', '')
+    types = [t for t in request.args.get('types', '').split(',') if t] or None
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    return jsonify({'q': q, 'results': search(get_db(), q, types, limit)})
+
 @bp.route('/api/upload', methods=['POST'])
 # @jwt_required() # User might not be logged in or token issue? Let's check headers, but frontend sends it. Usually safe to enable, but let's check if the frontend appends the token to upload request.
 # The user's js code uses fetch('/api/upload', { method: 'POST', body: formData }) without explicit headers for auth in the snippets, but the main fetch might be intercepted or cookies used.
@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, request, jsonify, flash, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.database import get_db, log_audit
-from app.services.promob_service import PromobService
+from app.services.promob_service import save_mapping
+from app.services.promob_jobs import import_queue
 from app.services.discovery_service import DiscoveryService
+from app.services.orcamento_itens import sync_orcamento_itens, delete_orcamento_itens, load_groups
 from datetime import datetime
 import json
 import os
@@ -14,10 +16,12 @@ bp = Blueprint('orcamentos', __name__)
 def orcamentos():
     db = get_db()
     show_all = request.args.get('show_all')
+    # Listing uses the stored counters; itens_json is only loaded by the editor (GET /api/orcamentos/<id>)
+    cols = 'id, client, client_id, total, status, created_at, itens_count, ambientes_count'
     if show_all:
-        orcamentos = db.execute('SELECT * FROM orcamentos ORDER BY created_at DESC').fetchall()
+        orcamentos = db.execute(f'SELECT {cols} FROM orcamentos ORDER BY created_at DESC').fetchall()
     else:
-        orcamentos = db.execute("SELECT * FROM orcamentos WHERE status != 'Faturado' ORDER BY created_at DESC").fetchall()
+        orcamentos = db.execute(f"SELECT {cols} FROM orcamentos WHERE status != 'Faturado' ORDER BY created_at DESC").fetchall()
     return render_template('orcamentos.html', orcamentos=orcamentos, showing_all=show_all)
 
 @bp.route('/api/orcamentos', methods=['GET'])
@@ -50,6 +54,7 @@ def api_orcamentos_create():
     cur.execute('INSERT INTO orcamentos (client_id, client, itens_json, total, status, total_horas_mo, created_at) VALUES (?, ?, ?, ?, ?, ?, datetime("now"))',
                 (client_id, client, itens, total, data.get('status', 'Rascunho'), total_horas_mo))
     orcamento_id = cur.lastrowid
+    sync_orcamento_itens(db, orcamento_id, data.get('itens'))
     
     # Auto-create Kanban Card
     cur.execute('INSERT INTO cards_kanban (titulo, etapa, client, orcamento_id) VALUES (?, ?, ?, ?)',
@@ -82,6 +87,7 @@ def update_orcamento(id):
     db = get_db()
     db.execute('''UPDATE orcamentos SET client_id=?, client=?, itens_json=?, total=?, total_horas_mo=?, status=? WHERE id=?''',
                 (client_id, client, json.dumps(data.get('itens')), data.get('total'), data.get('total_horas_mo', 0), data.get('status'), id))
+    sync_orcamento_itens(db, id, data.get('itens'))
     
     log_audit(user_id, 'UPDATE_ORCAMENTO', f'Updated budget #{id}')
     db.commit()
@@ -93,6 +99,7 @@ def delete_orcamento(id):
     user_id = get_jwt_identity()
     db = get_db()
     db.execute('DELETE FROM orcamentos WHERE id = ?', (id,))
+    delete_orcamento_itens(db, id)
     db.execute('DELETE FROM cards_kanban WHERE orcamento_id = ?', (id,))
     db.commit()
     log_audit(user_id, 'DELETE_ORCAMENTO', f'Deleted budget #{id}')
@@ -142,7 +149,7 @@ def api_orcamento_calcular():
 @bp.route('/api/orcamentos/calculate-tiers', methods=['POST'])
 @jwt_required()
 def api_orcamento_calculate_tiers():
-    from app.services.calculator import calculate_item_tier_cost
+    from app.services.calculator import price_tiers
     
     data = request.json
     items = data.get('items', [])
@@ -164,18 +171,12 @@ def api_orcamento_calculate_tiers():
     margem_negociacao = float(config.get('margem_negociacao', 0.10))
     margem_impostos = float(config.get('margem_impostos', 0.05))
 
+    # All tiers x items priced in one batch (bulk-loaded context + consumption matrix)
+    priced = price_tiers(db, items, [t['id'] for t in tiers])
+
     for tier in tiers:
-        tier_id = tier['id']
         tier_name = tier['name']
-        
-        tier_total_cost = 0.0
-        tier_breakdown = []
-        
-        for item in items:
-            # Calculate cost for this item in this tier
-            cost, details = calculate_item_tier_cost(db, item, tier_id)
-            tier_total_cost += cost
-            tier_breakdown.extend(details)
+        tier_total_cost, tier_breakdown = priced[tier['id']]
             
         # Final Price Calculation
         preco_venda = tier_total_cost * (1 + margem_lucro) * (1 + margem_negociacao) * (1 + margem_impostos)
@@ -219,18 +220,9 @@ def render_contract_template(template_str, orc, cliente, db):
     itens_html = "<table><thead><tr><th>Ambiente</th><th>Descrição</th><th>Dimensões/Detalhes</th><th>Valor</th></tr></thead><tbody>"
     
     itens_data = []
-    if orc['itens_json']:
-        try:
-            raw = json.loads(orc['itens_json'])
-            if isinstance(raw, list) and len(raw) > 0 and 'items' in raw[0]:
-                for group in raw:
-                    for item in group['items']:
-                        itens_data.append({'ambiente': group['name'], 'item': item})
-            else:
-                 for item in raw:
-                    itens_data.append({'ambiente': 'Geral', 'item': item})
-        except:
-            pass
+    for group in load_groups(db, orc['id']):
+        for item in group['items']:
+            itens_data.append({'ambiente': group['name'], 'item': item})
 
     for row in itens_data:
         it = row['item']
@@ -310,21 +302,9 @@ def gerar_proposta(orc_id):
     data_hoje = datetime.now().strftime('%d/%m/%Y')
     
     groups = []
-    if orc['itens_json']:
-        try:
-            raw = json.loads(orc['itens_json'])
-            if isinstance(raw, list) and len(raw) > 0 and 'items' in raw[0]:
-                groups = []
-                for group in raw:
-                    new_group = dict(group)
-                    if 'items' in new_group:
-                        new_group['itens'] = new_group.pop('items')
-                    groups.append(new_group)
-            else:
-                groups = [{'name': 'Geral', 'itens': raw}]
-        except Exception as e:
-            print(f"Error parsing items for proposal: {e}")
-            groups = []
+    for group in load_groups(db, orc_id):
+        group['itens'] = group.pop('items')
+        groups.append(group)
 
     return render_template('proposta_print.html', orcamento=orc, data_hoje=data_hoje, prop_numero=prop_numero, groups=groups)
 
@@ -343,17 +323,20 @@ def api_orcamentos_import_promob():
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
+        # Parsing runs in the background worker; an already-seen file comes back right away
         db = get_db()
-        raw_data = PromobService.extract_data(filepath)
-        if not raw_data:
-            return jsonify({'success': False, 'error': 'Falha ao processar arquivo Promob'}), 500
-            
-        mapped_data = PromobService.map_data(db, raw_data)
-        
-        # Cleanup uploaded file (optional, depends on policy)
-        # os.remove(filepath)
-        
-        return jsonify({'success': True, 'data': mapped_data})
+        job_id, mapped_data = import_queue.submit(db, get_jwt_identity(), filepath, file.filename)
+        if mapped_data is not None:
+            return jsonify({'success': True, 'job_id': job_id, 'cached': True, 'data': mapped_data})
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+
+@bp.route('/api/orcamentos/import-promob/<int:job_id>', methods=['GET'])
+@jwt_required()
+def api_orcamentos_import_promob_status(job_id):
+    job = import_queue.get(get_db(), job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Importação não encontrada'}), 404
+    return jsonify({'success': True, **job})
 
 @bp.route('/api/promob/save-mapping', methods=['POST'])
 @jwt_required()
@@ -369,11 +352,7 @@ def api_promob_save_mapping():
         
     db = get_db()
     try:
-        db.execute('''
-            INSERT INTO promob_mappings (promob_name, target_type, target_id)
-            VALUES (?, ?, ?)
-            ON CONFLICT(promob_name) DO UPDATE SET target_type=excluded.target_type, target_id=excluded.target_id
-        ''', (promob_name, target_type, int(target_id)))
+        save_mapping(db, promob_name, target_type, int(target_id))
         db.commit()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -449,11 +428,7 @@ def api_promob_discovery_register():
                     (cat_id, dobradica_id, num_dobradicas, 'fixo'))
 
     # 3. Create Promob Mapping
-    cur.execute('''
-        INSERT INTO promob_mappings (promob_name, target_type, target_id)
-        VALUES (?, ?, ?)
-        ON CONFLICT(promob_name) DO UPDATE SET target_type=excluded.target_type, target_id=excluded.target_id
-    ''', (name, 'item', cat_id))
+    save_mapping(cur, name, 'item', cat_id)
 
     # 4. Mark as reviewed in discovery patterns
     cur.execute('UPDATE discovered_patterns SET is_reviewed = 1 WHERE name = ?', (name,))
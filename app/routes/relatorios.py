@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.database import get_db
-from datetime import datetime, timedelta
+from datetime import date, timedelta
+import math
 
 bp = Blueprint('relatorios', __name__)
 
@@ -13,135 +14,190 @@ def relatorios():
 @bp.route('/api/relatorios/dashboard')
 @jwt_required()
 def api_relatorios_dashboard():
+    """
+    Query: granularidade=day|week|month|quarter (default month), inicio/fim (YYYY-MM-DD, default:
+    last 6 periods including the current one). Cash flow comes from one GROUP BY pass.
+    """
+    from app.services.kpis import read_kpis
+    from app.services import reports
     db = get_db()
-    
-    # Dates
-    today = datetime.now()
-    first_day = today.replace(day=1)
-    
+
+    granularidade = request.args.get('granularidade', 'month')
+    if granularidade not in reports.GRANULARITIES:
+        return jsonify({'error': f'Granularidade inválida: {granularidade}'}), 400
+    try:
+        inicio, fim = reports.parse_range(request.args, granularidade)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    today = date.today()
+    mes_inicio = today.replace(day=1)
+    mes_fim = reports.add_months(today, 1)
+
     # 1. Faturamento Mês (Orçamentos Aprovados/Concluídos neste mês)
-    # Consideramos status que indicam venda fechada
-    query_fat = '''
-        SELECT SUM(total) as total 
-        FROM orcamentos 
-        WHERE status IN ('aprovado', 'producao', 'concluido', 'entregue')
-        AND date(created_at) >= date(?)
-    '''
-    faturamento_row = db.execute(query_fat, (first_day.strftime('%Y-%m-%d'),)).fetchone()
-    faturamento = faturamento_row['total'] if faturamento_row and faturamento_row['total'] else 0.0
-    
-    # 2. Contas Pendentes (Pagar) - Geral
-    query_contas = "SELECT SUM(valor) as total FROM contas WHERE tipo='pagar' AND status='pendente'"
-    pendente_row = db.execute(query_contas).fetchone()
-    pendente = pendente_row['total'] if pendente_row and pendente_row['total'] else 0.0
-    
+    faturamento = reports.vendas(db, mes_inicio, mes_fim)['total']
+
+    # 2. Contas Pendentes (Pagar) - Geral, from the KPI rollup
+    pendente = read_kpis(db)['contas_pendentes']
+
     # 3. Lucro Estimado do Mês (Entradas Reais - Saídas Reais do Mês)
     # Entradas: Contas Receber (Pagas no mês) | Saídas: Contas Pagar (Pagas no mês)
-    query_in = "SELECT SUM(valor) as t FROM contas WHERE tipo='receber' AND status='pago' AND strftime('%Y-%m', vencimento) = ?"
-    query_out = "SELECT SUM(valor) as t FROM contas WHERE tipo='pagar' AND status='pago' AND strftime('%Y-%m', vencimento) = ?"
-    
-    mes_str = today.strftime('%Y-%m')
-    entradas_row = db.execute(query_in, (mes_str,)).fetchone()
-    entradas = entradas_row['t'] if entradas_row and entradas_row['t'] else 0.0
-    
-    saidas_row = db.execute(query_out, (mes_str,)).fetchone()
-    saidas = saidas_row['t'] if saidas_row and saidas_row['t'] else 0.0
-    
-    lucro = entradas - saidas
-    
-    # 4. Fluxo de Caixa (Últimos 6 meses)
-    # Agrupado por Mês: Receitas vs Despesas
-    fluxo = []
-    for i in range(5, -1, -1):
-        d = today - timedelta(days=i*30)
-        m_str = d.strftime('%Y-%m')
-        
-        rec_row = db.execute("SELECT SUM(valor) as t FROM contas WHERE tipo='receber' AND strftime('%Y-%m', vencimento) = ?", (m_str,)).fetchone()
-        rec = rec_row['t'] if rec_row and rec_row['t'] else 0.0
-        
-        pag_row = db.execute("SELECT SUM(valor) as t FROM contas WHERE tipo='pagar' AND strftime('%Y-%m', vencimento) = ?", (m_str,)).fetchone()
-        pag = pag_row['t'] if pag_row and pag_row['t'] else 0.0
-        
-        fluxo.append({
-            'label': d.strftime('%b/%Y'),
-            'receita': rec,
-            'despesa': pag
-        })
-        
+    mes = reports.cash_flow(db, mes_inicio, mes_fim, 'month')[0]
+    lucro = round(mes['receita_paga'] - mes['despesa_paga'], 2)
+
+    # 4. Fluxo de Caixa: Receitas vs Despesas por período
+    fluxo = reports.cash_flow(db, inicio, fim, granularidade)
+
     return jsonify({
         'faturamento_mes': faturamento,
         'contas_pendentes': pendente,
         'lucro_estimado': lucro,
-        'fluxo_caixa': fluxo
+        'fluxo_caixa': fluxo,
+        'periodo': {'inicio': inicio.isoformat(), 'fim': (fim - timedelta(days=1)).isoformat(), 'granularidade': granularidade}
     })
 
 @bp.route('/api/relatorios/data')
 @jwt_required()
 def api_relatorios_data():
+    """Contas (receivables and payables), newest first. Optional inicio/fim (YYYY-MM-DD), limit (default 100)."""
+    from app.services import reports
     db = get_db()
-    # Get all transactions (receivables and payables) ordered by date
-    query = '''
-        SELECT descricao, valor, vencimento, tipo, status 
-        FROM contas 
-        ORDER BY vencimento DESC
-        LIMIT 100
-    '''
-    rows = db.execute(query).fetchall()
+    try:
+        inicio = reports.parse_date(request.args['inicio']) if request.args.get('inicio') else None
+        fim = reports.parse_date(request.args['fim']) + timedelta(days=1) if request.args.get('fim') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    except ValueError:
+        return jsonify({'error': 'limit inválido'}), 400
+    sql, params = reports.contas_query(inicio, fim)
+    rows = db.execute(sql + ' LIMIT ?', params + [limit]).fetchall()
     return jsonify([dict(r) for r in rows])
 
+@bp.route('/api/relatorios/export')
+@jwt_required()
+def api_relatorios_export():
+    """
+    Streaming export. relatorio=contas (lines) | fluxo (cash flow per period), formato=csv|json,
+    inicio/fim (YYYY-MM-DD), granularidade (fluxo), tipo=pagar|receber (contas).
+    """
+    from app.services import reports
+    db = get_db()
+    relatorio = request.args.get('relatorio', 'contas')
+    formato = request.args.get('formato', 'csv')
+    granularidade = request.args.get('granularidade', 'month')
+    if relatorio not in ('contas', 'fluxo') or formato not in ('csv', 'json') or granularidade not in reports.GRANULARITIES:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+    try:
+        inicio, fim = reports.parse_range(request.args, granularidade)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if relatorio == 'contas':
+        sql, params = reports.contas_query(inicio, fim, request.args.get('tipo'), newest_first=False)
+        rows = reports.iter_rows(db, sql, params)
+        fields = reports.CONTAS_EXPORT_FIELDS
+    else:
+        rows = iter(reports.cash_flow(db, inicio, fim, granularidade))
+        fields = ('periodo', 'label', 'receita', 'despesa', 'receita_paga', 'despesa_paga', 'saldo')
+
+    filename = f"{relatorio}_{inicio.isoformat()}_{(fim - timedelta(days=1)).isoformat()}.{formato}"
+    body = reports.stream_csv(rows, fields) if formato == 'csv' else reports.stream_json(rows)
+    mimetype = 'text/csv' if formato == 'csv' else 'application/json'
+    return Response(stream_with_context(body), mimetype=f'{mimetype}; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 @bp.route('/api/relatorios/comercial')
 @jwt_required()
 def api_relatorios_comercial():
+    """Top 5 clientes por valor de orçamentos aprovados; optional inicio/fim (created_at)."""
+    from app.services import reports
     db = get_db()
-    
-    # Top 5 Clientes por Valor Total de Orçamentos Aprovados
-    # Note: Using client name directly from orcamentos as we don't have a clients table linked by ID in this query context from reporting usually
-    # But let's check legacy query: JOIN orcamentos o ON c.id = o.client_id
-    # Wait, the legacy query used JOIN clientes c.
-    # Let's assume clientes table exists (it should, from previous tasks).
-    
-    query = '''
-        SELECT c.nome, COUNT(o.id) as qtd_orcamentos, SUM(o.total) as valor_total
-        FROM clientes c
-        JOIN orcamentos o ON c.id = o.client_id
-        WHERE o.status IN ('aprovado', 'producao', 'concluido', 'entregue')
-        GROUP BY c.id
-        ORDER BY valor_total DESC
-        LIMIT 5
-    '''
-    rows = db.execute(query).fetchall()
-    return jsonify([dict(r) for r in rows])
+    try:
+        inicio = reports.parse_date(request.args['inicio']) if request.args.get('inicio') else None
+        fim = reports.parse_date(request.args['fim']) + timedelta(days=1) if request.args.get('fim') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(reports.top_clientes(db, inicio, fim))
+
+MELHOR_COMPRA_SQL = '''
+    WITH serie AS (
+        SELECT estoque_id, site, preco, coletado_em,
+               LEAD(coletado_em) OVER (PARTITION BY estoque_id, site ORDER BY coletado_em, id) AS proximo
+        FROM estoque_precos
+    ),
+    -- Preços vigentes em algum momento da janela (inclui o que já valia no início dela)
+    vigentes AS (
+        SELECT estoque_id, site, preco, proximo,
+               FIRST_VALUE(preco) OVER (PARTITION BY estoque_id, site ORDER BY coletado_em) AS inicial
+        FROM serie
+        WHERE proximo IS NULL OR proximo > datetime('now', ?)
+    ),
+    por_site AS (
+        SELECT estoque_id, site,
+               MAX(CASE WHEN proximo IS NULL THEN preco END) AS atual,
+               MAX(inicial) AS inicial,
+               COUNT(*) AS niveis,
+               AVG(preco * preco) / (AVG(preco) * AVG(preco)) - 1 AS var_rel
+        FROM vigentes
+        GROUP BY estoque_id, site
+    ),
+    ofertas AS (
+        SELECT e.nome, e.unidade, s.site, s.atual AS preco, s.inicial, s.niveis, s.var_rel
+        FROM por_site s JOIN estoque e ON e.id = s.estoque_id
+        UNION ALL
+        -- Itens sem histórico (preço manual)
+        SELECT e.nome, e.unidade, COALESCE(e.site_origem, 'Manual'), e.custo_unitario, e.custo_unitario, 1, 0
+        FROM estoque e
+        WHERE NOT EXISTS (SELECT 1 FROM estoque_precos p WHERE p.estoque_id = e.id)
+    ),
+    ranked AS (
+        SELECT ofertas.*, ROW_NUMBER() OVER (PARTITION BY nome ORDER BY preco, site) AS ordem
+        FROM ofertas
+    )
+    SELECT nome,
+           MAX(unidade) AS unidade,
+           MAX(preco) AS preco_orcamento,
+           MIN(preco) AS preco_oportunidade,
+           MAX(CASE WHEN ordem = 1 THEN site END) AS site_barato,
+           COUNT(*) AS qtd_ofertas,
+           SUM(preco) AS soma_atual,
+           SUM(inicial) AS soma_inicial,
+           SUM(niveis) - COUNT(*) AS alteracoes,
+           MAX(var_rel) AS var_rel
+    FROM ranked
+    GROUP BY nome
+    ORDER BY MAX(preco) - MIN(preco) DESC
+'''
+
 
 @bp.route('/api/relatorios/melhor_compra')
 @jwt_required()
 def api_relatorios_melhor_compra():
+    """
+    Melhor compra por material a partir do histórico estoque_precos (último preço por site),
+    com tendência (variação na janela de `dias`) e volatilidade (desvio/média, pior site).
+    """
     db = get_db()
-    query = '''
-        SELECT nome, 
-               MAX(custo_unitario) as preco_orcamento,
-               MIN(custo_unitario) as preco_oportunidade,
-               COUNT(*) as qtd_ofertas,
-               unidade
-        FROM estoque
-        GROUP BY nome
-        HAVING qtd_ofertas >= 1
-        ORDER BY (MAX(custo_unitario) - MIN(custo_unitario)) DESC
-    '''
-    rows = db.execute(query).fetchall()
-    
+    dias = request.args.get('dias', 90, type=int)
+    rows = db.execute(MELHOR_COMPRA_SQL, (f'-{max(dias, 1)} days',)).fetchall()
+
     result = []
     for r in rows:
         d = dict(r)
-        # Find who has the min price
-        best = db.execute('SELECT site_origem FROM estoque WHERE nome = ? AND custo_unitario = ?', 
-                          (d['nome'], d['preco_oportunidade'])).fetchone()
-        d['site_barato'] = best['site_origem'] if best else 'Manual'
-        
+        soma_atual, soma_inicial, var_rel = d.pop('soma_atual'), d.pop('soma_inicial'), d.pop('var_rel')
+        d['site_barato'] = d['site_barato'] or 'Manual'
+        d['preco_orcamento'] = d['preco_orcamento'] or 0
+        d['preco_oportunidade'] = d['preco_oportunidade'] or 0
+
         if d['preco_orcamento'] > 0:
             d['economia_percent'] = round(((d['preco_orcamento'] - d['preco_oportunidade']) / d['preco_orcamento']) * 100, 1)
         else:
             d['economia_percent'] = 0
-            
+        d['tendencia_percent'] = round((soma_atual - soma_inicial) / soma_inicial * 100, 1) if soma_inicial else 0
+        d['volatilidade_percent'] = round(math.sqrt(max(var_rel or 0, 0)) * 100, 1)
+
         result.append(d)
-        
+
     return jsonify(result)
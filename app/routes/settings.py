@@ -32,6 +32,11 @@ def api_settings_update():
     db = get_db()
     for key, value in data.items():
         db.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value)))
+    if 'raspagem_ativa' in data or 'raspagem_hora' in data:
+        from app.scheduler import scheduler, sync_scraping_settings
+        sync_scraping_settings(db)
+        db.commit()
+        scheduler.wake()
     db.commit()
     return jsonify({'success': True})
 
@@ -0,0 +1,429 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.database import db_pool
+
+# Job scheduler: cron-like schedules live in scheduled_jobs, every process (gunicorn worker)
+# runs one scheduler thread that sleeps until the next due time. A due job is claimed with a
+# conditional UPDATE that also advances next_run_at and takes a lease, so exactly one process
+# runs each occurrence; every run is recorded in job_runs with its duration.
+# Times are local (same as settings.raspagem_hora), stored as 'YYYY-MM-DD HH:MM:SS'.
+
+# Upper bound for one sleep: picks up schedules edited by another process / directly in the DB
+SCHEDULER_MAX_SLEEP_S = 3600
+SCHEDULER_ERROR_RETRY_S = 30
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _fmt(dt):
+    return dt.strftime(TS_FORMAT)
+
+
+# --- Cron expressions (minute hour day-of-month month day-of-week) ---
+
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_cron_field(expr, lo, hi):
+    values = set()
+    for part in expr.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = lo, hi
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if step < 1 or start < lo or end > hi or start > end:
+            raise ValueError(f"Campo cron fora do intervalo: {expr}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Standard 5-field cron; day-of-week 0 or 7 = domingo. Dom/dow restricted together match either (cron rule)."""
+
+    def __init__(self, expr):
+        fields = (expr or '').split()
+        if len(fields) != 5:
+            raise ValueError(f"Expressão cron inválida: {expr!r}")
+        try:
+            parsed = [_parse_cron_field(f, lo, hi) for f, (lo, hi) in zip(fields, CRON_FIELDS)]
+        except ValueError as e:
+            raise ValueError(f"Expressão cron inválida: {expr!r} ({e})")
+        self.expr = expr
+        self.minutes = sorted(parsed[0])
+        self.hours, self.days, self.months = parsed[1], parsed[2], parsed[3]
+        self.weekdays = {d % 7 for d in parsed[4]}
+        self.dom_any = fields[2] == '*'
+        self.dow_any = fields[4] == '*'
+
+    def _day_matches(self, dt):
+        dom = dt.day in self.days
+        dow = dt.isoweekday() % 7 in self.weekdays
+        if self.dom_any or self.dow_any:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, after):
+        """First matching minute strictly after `after` (skips whole months/days/hours that can't match)."""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            else:
+                minute = next((m for m in self.minutes if m >= t.minute), None)
+                if minute is not None:
+                    return t.replace(minute=minute)
+                t = t.replace(minute=0) + timedelta(hours=1)
+        raise ValueError(f"Expressão cron nunca dispara: {self.expr!r}")
+
+
+def next_run(cron, after=None):
+    return CronSchedule(cron).next_after(after or datetime.now())
+
+
+# --- Jobs ---
+
+def _setting(db, key, default=None):
+    row = db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+    return row['value'] if row and row['value'] not in (None, '') else default
+
+
+def job_raspagem(db):
+    from app.scraper import run_scraping_job
+    return run_scraping_job('all', db)
+
+
+def job_limpeza_auditoria(db):
+    from app.audit import purge_audits
+    from app.services.calendar_feed import purge_deletions
+    dias = int(_setting(db, 'auditoria_retencao_dias', 180))
+    return {'retencao_dias': dias, 'removidos': purge_audits(db, dias), 'calendario_exclusoes': purge_deletions(db)}
+
+
+def job_treino_catalogo(db):
+    # Separate process: the training uses its own process pool and can run for a long time
+    train_dir = _setting(db, 'treino_dir', os.path.join(BASE_DIR, 'treino'))
+    if not os.path.isdir(train_dir):
+        return {'skipped': True, 'motivo': f'Diretório {train_dir} não encontrado'}
+    cmd = [sys.executable, os.path.join(BASE_DIR, 'scripts', 'train_catalog.py'), train_dir]
+    workers = _setting(db, 'treino_workers')
+    if workers:
+        cmd += ['--workers', str(int(workers))]
+    proc = subprocess.run(cmd, cwd=BASE_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"train_catalog saiu com código {proc.returncode}: {proc.stderr[-500:]}")
+    return {'saida': proc.stdout[-1000:]}
+
+
+def job_consistencia_kpis(db):
+    # The rollup is trigger-maintained; this catches writes that bypassed it (restores, manual edits)
+    from app.services.kpis import check, rebuild
+    diffs = check(db)
+    if diffs:
+        rebuild(db)
+    return {'divergencias': diffs, 'reconstruido': bool(diffs)}
+
+
+def _raspagem_cron(db):
+    hora = _setting(db, 'raspagem_hora', '02:00')
+    try:
+        h, m = (int(v) for v in hora.split(':', 1))
+    except ValueError:
+        h, m = 2, 0
+    return f'{m} {h} * * *'
+
+
+# name -> (function, default cron (str or fn(db)), enabled by default, lease seconds, description)
+JOBS = {
+    'raspagem': (job_raspagem, _raspagem_cron, lambda db: _setting(db, 'raspagem_ativa') == 'true', 3600,
+                 'Raspagem de preços dos fornecedores'),
+    'limpeza_auditoria': (job_limpeza_auditoria, '30 3 * * 0', True, 3600,
+                          'Remove auditoria mais antiga que auditoria_retencao_dias (padrão 180) e exclusões antigas do calendário'),
+    'treino_catalogo': (job_treino_catalogo, '0 4 * * 0', False, 6 * 3600,
+                        'Treina padrões do catálogo com o acervo Promob (treino_dir)'),
+    'consistencia_kpis': (job_consistencia_kpis, '15 3 * * *', True, 600,
+                          'Confere os KPIs materializados do dashboard e reconstrói se divergirem'),
+}
+
+
+def ensure_jobs(db, now=None):
+    """Registers missing jobs with their defaults and fills next_run_at where it's unset. The caller commits."""
+    now = now or datetime.now()
+    existing = {r['name'] for r in db.execute("SELECT name FROM scheduled_jobs")}
+    for name, (_, cron, enabled, _, description) in JOBS.items():
+        if name in existing:
+            continue
+        cron = cron(db) if callable(cron) else cron
+        enabled = enabled(db) if callable(enabled) else enabled
+        db.execute('''
+            INSERT INTO scheduled_jobs (name, cron, enabled, description, next_run_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, cron, 1 if enabled else 0, description, _fmt(next_run(cron, now)), _fmt(now)))
+    for row in db.execute("SELECT name, cron FROM scheduled_jobs WHERE next_run_at IS NULL").fetchall():
+        db.execute("UPDATE scheduled_jobs SET next_run_at = ? WHERE name = ?", (_fmt(next_run(row['cron'], now)), row['name']))
+
+
+def update_job(db, name, cron=None, enabled=None, run_now=False):
+    """Changes a schedule (validated) and recomputes its next run. The caller commits and wakes the scheduler."""
+    row = db.execute("SELECT cron, enabled FROM scheduled_jobs WHERE name = ?", (name,)).fetchone()
+    if not row:
+        return False
+    cron = cron or row['cron']
+    now = datetime.now()
+    next_at = now if run_now else next_run(cron, now)
+    db.execute('''
+        UPDATE scheduled_jobs SET cron = ?, enabled = ?, next_run_at = ?, updated_at = ? WHERE name = ?
+    ''', (cron, row['enabled'] if enabled is None else (1 if enabled else 0), _fmt(next_at), _fmt(now), name))
+    return True
+
+
+def sync_scraping_settings(db):
+    """settings.raspagem_ativa / raspagem_hora -> schedule of the 'raspagem' job."""
+    return update_job(db, 'raspagem', cron=_raspagem_cron(db), enabled=_setting(db, 'raspagem_ativa') == 'true')
+
+
+def list_jobs(db):
+    rows = db.execute('''
+        SELECT j.*, r.status AS last_status, r.duration_ms AS last_duration_ms, r.error AS last_error
+        FROM scheduled_jobs j
+        LEFT JOIN job_runs r ON r.id = (SELECT MAX(id) FROM job_runs WHERE job_name = j.name)
+        ORDER BY j.name
+    ''').fetchall()
+    return [dict(r) for r in rows]
+
+
+def list_runs(db, job_name=None, limit=50):
+    if job_name:
+        rows = db.execute("SELECT * FROM job_runs WHERE job_name = ? ORDER BY id DESC LIMIT ?", (job_name, limit)).fetchall()
+    else:
+        rows = db.execute("SELECT * FROM job_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _owner_gone(owner, hostname, pid):
+    """
+    True when `owner` ('host:pid') is a process of this host that no longer exists, or a previous
+    process that had our pid (this one has just started and runs nothing yet).
+    """
+    host, _, owner_pid = (owner or '').rpartition(':')
+    if host != hostname:
+        return False  # another machine: its lease expires on its own
+    try:
+        owner_pid = int(owner_pid)
+    except ValueError:
+        return False
+    if owner_pid == pid:
+        return True
+    try:
+        os.kill(owner_pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def reap_stale(db, hostname, pid, now=None):
+    """
+    Frees the leases and closes the 'running' job_runs of dead processes of this host (killed worker,
+    restart in the middle of a job). An interrupted occurrence is due again right away, since its
+    claim already advanced next_run_at. Returns the job names released. The caller commits.
+    """
+    now = _fmt(now or datetime.now())
+    owners = {r[0] for r in db.execute('''
+        SELECT lease_owner FROM scheduled_jobs WHERE lease_owner IS NOT NULL
+        UNION SELECT owner FROM job_runs WHERE status = 'running'
+    ''')}
+    released = []
+    for owner in (o for o in owners if _owner_gone(o, hostname, pid)):
+        released += [r['name'] for r in db.execute("SELECT name FROM scheduled_jobs WHERE lease_owner = ?", (owner,))]
+        db.execute('''
+            UPDATE scheduled_jobs SET lease_owner = NULL, lease_until = NULL, next_run_at = ? WHERE lease_owner = ?
+        ''', (now, owner))
+        db.execute('''
+            UPDATE job_runs SET status = 'error', finished_at = ?, error = 'Processo encerrado durante a execução'
+            WHERE status = 'running' AND owner = ?
+        ''', (now, owner))
+    return released
+
+
+class Scheduler:
+    def __init__(self, pool):
+        self.pool = pool
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._running = set()
+        self._next_wake = None
+        self._stats = {'claimed': 0, 'ok': 0, 'error': 0, 'lost_claims': 0}
+
+    def start(self):
+        # Started per server process (gunicorn worker): the lease decides who runs each occurrence
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            first_start = self._pid != os.getpid()
+            self._pid = os.getpid()
+            self.owner = f'{socket.gethostname()}:{self._pid}'
+            self._running = set()
+            if first_start:
+                self._reap()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='Scheduler')
+            self._thread.start()
+
+    def _reap(self):
+        try:
+            with self.pool.connection() as conn:
+                released = reap_stale(conn, socket.gethostname(), self._pid)
+                conn.commit()
+            if released:
+                print(f"Agendador: leases de processos encerrados liberados: {', '.join(released)}")
+        except Exception as e:
+            # Tables not migrated yet: the leases expire on their own
+            print(f"Agendador: erro liberando leases antigos: {e}")
+
+    def wake(self):
+        """Call after changing schedules in this process: the thread recomputes its sleep."""
+        self._wakeup.set()
+
+    def _claim(self, conn, name, cron, lease_s, now):
+        """Advances next_run_at and takes the lease in one conditional UPDATE: only one process wins."""
+        cur = conn.execute('''
+            UPDATE scheduled_jobs
+            SET next_run_at = ?, lease_owner = ?, lease_until = ?, last_run_at = ?
+            WHERE name = ? AND enabled = 1 AND next_run_at <= ? AND (lease_until IS NULL OR lease_until < ?)
+        ''', (_fmt(next_run(cron, now)), self.owner, _fmt(now + timedelta(seconds=lease_s)), _fmt(now),
+              name, _fmt(now), _fmt(now)))
+        conn.commit()
+        return cur.rowcount == 1
+
+    def _dispatch(self, conn):
+        """Starts every due job this process can claim; returns the seconds until the next due time."""
+        now = datetime.now()
+        ensure_jobs(conn, now)
+        conn.commit()
+        due = conn.execute('''
+            SELECT name, cron FROM scheduled_jobs
+            WHERE enabled = 1 AND next_run_at <= ? AND (lease_until IS NULL OR lease_until < ?)
+        ''', (_fmt(now), _fmt(now))).fetchall()
+        for row in due:
+            spec = JOBS.get(row['name'])
+            if spec is None:
+                continue
+            try:
+                claimed = self._claim(conn, row['name'], row['cron'], spec[3], now)
+            except ValueError as e:
+                print(f"Agendador: job {row['name']} com cron inválido: {e}")
+                continue
+            if not claimed:
+                with self._lock:
+                    self._stats['lost_claims'] += 1
+                continue
+            with self._lock:
+                self._stats['claimed'] += 1
+                self._running.add(row['name'])
+            threading.Thread(target=self._execute, args=(row['name'],), daemon=True, name=f"Job-{row['name']}").start()
+
+        row = conn.execute('''
+            SELECT MIN(MAX(next_run_at, COALESCE(lease_until, next_run_at))) FROM scheduled_jobs WHERE enabled = 1
+        ''').fetchone()
+        if not row or not row[0]:
+            return SCHEDULER_MAX_SLEEP_S
+        seconds = (datetime.strptime(row[0], TS_FORMAT) - datetime.now()).total_seconds()
+        self._next_wake = row[0]
+        return min(max(seconds, 0.5), SCHEDULER_MAX_SLEEP_S)
+
+    def _execute(self, name):
+        func = JOBS[name][0]
+        started = datetime.now()
+        t0 = time.monotonic()
+        with self.pool.connection() as conn:
+            run_id = conn.execute("INSERT INTO job_runs (job_name, owner, status, started_at) VALUES (?, ?, 'running', ?)",
+                                  (name, self.owner, _fmt(started))).lastrowid
+            conn.commit()
+            print(f"[{started}] Agendador: iniciando {name}")
+            status, result, error = 'ok', None, None
+            try:
+                result = func(conn)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                status, error = 'error', str(e)
+                print(f"Agendador: erro no job {name}: {e}")
+            duration_ms = int((time.monotonic() - t0) * 1000)
+            try:
+                conn.execute('''
+                    UPDATE job_runs SET status = ?, finished_at = ?, duration_ms = ?, result_json = ?, error = ? WHERE id = ?
+                ''', (status, _fmt(datetime.now()), duration_ms, json.dumps(result, ensure_ascii=False, default=str), error, run_id))
+                conn.execute("UPDATE scheduled_jobs SET lease_owner = NULL, lease_until = NULL WHERE name = ? AND lease_owner = ?",
+                             (name, self.owner))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Agendador: erro registrando execução de {name}: {e}")
+        self.pool.discard()
+        with self._lock:
+            self._stats[status] += 1
+            self._running.discard(name)
+        # The lease is free again: recompute the sleep
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                with self.pool.connection() as conn:
+                    sleep_s = self._dispatch(conn)
+            except Exception as e:
+                # Tables not migrated yet (create_app runs before init_db) or DB busy
+                print(f"Erro no agendador: {e}")
+                sleep_s = SCHEDULER_ERROR_RETRY_S
+            self._wakeup.wait(sleep_s)
+            self._wakeup.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data['running'] = sorted(self._running)
+        data['owner'] = self.owner
+        data['next_wake'] = self._next_wake
+        data['thread_alive'] = bool(self._thread and self._thread.is_alive())
+        return data
+
+
+scheduler = Scheduler(db_pool)
+
+
+def start_for_server(app=None):
+    """
+    Server entry points only (run.py serving, gunicorn.conf.py post_worker_init), after init_db:
+    CLIs and scripts that build the app never run jobs. SCHEDULER_ENABLED=0 turns it off.
+    """
+    enabled = os.environ.get('SCHEDULER_ENABLED', '1') != '0'
+    if app is not None:
+        enabled = app.config.get('SCHEDULER_ENABLED', enabled)
+    if enabled:
+        scheduler.start()
+    return enabled
@@ -1,10 +1,17 @@
 import os
+import json
+import hashlib
+import threading
 import requests
 from bs4 import BeautifulSoup
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 import time
-import sqlite3
-from datetime import datetime
-from app.database import DATABASE
+from app.database import db_pool
 
 def get_proxies():
     proxy = os.getenv('SCRAPING_PROXY')
@@ -12,91 +19,311 @@ def get_proxies():
         return {'http': proxy, 'https': proxy}
     return None
 
-def fetch_price_leomadeiras(url):
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers, timeout=10, proxies=get_proxies())
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            # Selector: .price-template or .product-price
-            price_elem = soup.select_one('.price-template .best-price') or soup.find(class_='product-price')
-            if price_elem:
-                price_text = price_elem.get_text().strip().replace('R$', '').replace('.', '').replace(',', '.')
-                return float(price_text)
-    except Exception as e:
-        print(f"Erro LeoMadeiras: {e}")
+# --- HTTP engine ---
+# One pooled requests.Session per site (keep-alive), bounded concurrency, a minimum interval
+# between requests to the same site (retries included) and retries with exponential backoff.
+
+SCRAPE_TIMEOUT = (5, 15)          # connect, read (s)
+SCRAPE_MAX_WORKERS = 6
+SCRAPE_RETRIES = 3
+SCRAPE_BACKOFF = 0.5              # 0.5s, 1s, 2s...
+SCRAPE_RETRY_STATUS = (429, 500, 502, 503, 504)
+SCRAPE_MAX_RETRY_AFTER = 30
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+SITES = {
+    'leomadeiras': {'headers': {}, 'min_interval': 1.0, 'max_concurrency': 2},
+    # Madeverde often requires CEP in cookie or session. Tentar forçar CEP via cookie
+    'madeverde': {'headers': {'Cookie': 'cep=01310-100'}, 'min_interval': 1.0, 'max_concurrency': 2},
+    'madeiranit': {'headers': {}, 'min_interval': 1.0, 'max_concurrency': 2},
+}
+
+
+def _parse_price_text(text):
+    return float(text.strip().replace('R$', '').replace('.', '').replace(',', '.'))
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Price selectors per site, tried in order: (CSS for the BeautifulSoup fallback, equivalent XPath for lxml)
+PRICE_SELECTORS = {
+    # Selector: .price-template or .product-price
+    'leomadeiras': [
+        ('.price-template .best-price', f"//*[{_has_class('price-template')}]//*[{_has_class('best-price')}]"),
+        ('.product-price', f"//*[{_has_class('product-price')}]"),
+    ],
+    # Selectors seen: .preco-venda, .preco-promocional
+    'madeverde': [
+        ('.preco-promocional', f"//*[{_has_class('preco-promocional')}]"),
+        ('.preco-venda', f"//*[{_has_class('preco-venda')}]"),
+    ],
+    # Selector: .product-info-main .price
+    'madeiranit': [
+        ('.product-info-main .price', f"//*[{_has_class('product-info-main')}]//*[{_has_class('price')}]"),
+    ],
+}
+
+
+def _find_price(content, selectors):
+    if not content:
+        return 0.0
+    if lxml_html is not None:
+        # lxml (C parser) + XPath: much cheaper than html.parser on full product pages
+        root = lxml_html.fromstring(content)
+        for _, xpath in selectors:
+            found = root.xpath(xpath)
+            if found:
+                return _parse_price_text(found[0].text_content())
+        return 0.0
+    soup = BeautifulSoup(content, 'html.parser')
+    for css, _ in selectors:
+        price_elem = soup.select_one(css)
+        if price_elem:
+            return _parse_price_text(price_elem.get_text())
     return 0.0
 
+
+def parse_price_leomadeiras(content):
+    return _find_price(content, PRICE_SELECTORS['leomadeiras'])
+
+
+def parse_price_madeverde(content):
+    return _find_price(content, PRICE_SELECTORS['madeverde'])
+
+
+def parse_price_madeiranit(content):
+    return _find_price(content, PRICE_SELECTORS['madeiranit'])
+
+
+PRICE_PARSERS = {
+    'leomadeiras': parse_price_leomadeiras,
+    'madeverde': parse_price_madeverde,
+    'madeiranit': parse_price_madeiranit,
+}
+
+
+class RateLimiter:
+    """Spaces requests to one site by at least min_interval seconds (shared by all threads)."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SiteClient:
+    def __init__(self, site, config):
+        self.site = site
+        self.limiter = RateLimiter(config['min_interval'])
+        self.slots = threading.BoundedSemaphore(config['max_concurrency'])
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT, **config['headers']})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['max_concurrency'])
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        proxies = get_proxies()
+        if proxies:
+            self.session.proxies.update(proxies)
+
+    def get(self, url, headers=None):
+        """GET with retries; every attempt goes through the site's rate limit."""
+        response, error = None, None
+        for attempt in range(SCRAPE_RETRIES + 1):
+            if attempt:
+                delay = SCRAPE_BACKOFF * 2 ** (attempt - 1)
+                retry_after = response.headers.get('Retry-After') if response is not None else None
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, min(int(retry_after), SCRAPE_MAX_RETRY_AFTER))
+                time.sleep(delay)
+            with self.slots:
+                self.limiter.wait()
+                try:
+                    response, error = self.session.get(url, headers=headers, timeout=SCRAPE_TIMEOUT), None
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    response, error = None, e
+                    continue
+            if response.status_code not in SCRAPE_RETRY_STATUS:
+                return response
+        if error is not None:
+            raise error
+        return response
+
+
+class ScrapeEngine:
+    def __init__(self, sites=SITES, max_workers=SCRAPE_MAX_WORKERS):
+        self.sites = sites
+        self.max_workers = max_workers
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._stats = {'parsed': 0, 'not_modified': 0, 'unchanged': 0, 'error': 0}
+
+    def client(self, site):
+        with self._lock:
+            if site not in self._clients:
+                self._clients[site] = SiteClient(site, self.sites[site])
+            return self._clients[site]
+
+    def fetch(self, site, url, cached=None):
+        """
+        Fetches one page and returns a scrape_cache entry with the price.
+        With a cached entry the request is conditional (ETag / Last-Modified): a 304 or a body with
+        the same hash reuses the cached price without parsing. outcome: parsed, not_modified, unchanged, error.
+        """
+        entry = {'url': url, 'site': site, 'price': 0.0, 'etag': None, 'last_modified': None,
+                 'content_hash': None, 'status_code': None, 'outcome': 'error'}
+        if cached and cached.get('parser_version') != SCRAPE_PARSER_VERSION:
+            cached = None
+        headers = {}
+        if cached:
+            if cached.get('etag'): headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'): headers['If-Modified-Since'] = cached['last_modified']
+        try:
+            response = self.client(site).get(url, headers=headers or None)
+            entry['status_code'] = response.status_code
+            if response.status_code == 304 and cached:
+                entry.update(price=cached['price'], etag=cached['etag'], last_modified=cached['last_modified'],
+                             content_hash=cached['content_hash'], outcome='not_modified')
+            elif response.status_code == 200:
+                body = response.content
+                entry['etag'] = response.headers.get('ETag')
+                entry['last_modified'] = response.headers.get('Last-Modified')
+                entry['content_hash'] = hashlib.md5(body).hexdigest()
+                if cached and cached.get('content_hash') == entry['content_hash']:
+                    entry.update(price=cached['price'], outcome='unchanged')
+                else:
+                    entry.update(price=PRICE_PARSERS[site](body), outcome='parsed')
+            else:
+                print(f"Erro {site}: HTTP {response.status_code} em {url}")
+        except Exception as e:
+            print(f"Erro {site}: {e}")
+        with self._lock:
+            self._stats[entry['outcome']] += 1
+        return entry
+
+    def fetch_price(self, site, url, cached=None):
+        """Returns the price found on the page, or 0.0 (logged) when the page/selector fails."""
+        return self.fetch(site, url, cached)['price']
+
+    def fetch_many(self, jobs, cache=None):
+        """
+        jobs: iterable of (key, site, url). Yields (key, site, entry) as each page completes,
+        with at most max_workers requests in flight (and the per-site limits above).
+        cache: {url: scrape_cache row} used for conditional requests.
+        """
+        cache = cache or {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scraper') as executor:
+            futures = {executor.submit(self.fetch, site, url, cache.get(url)): (key, site) for key, site, url in jobs}
+            try:
+                for future in as_completed(futures):
+                    key, site = futures[future]
+                    yield key, site, future.result()
+            finally:
+                # Consumer stopped early (cancel): drop what hasn't started yet
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+engine = ScrapeEngine()
+
+
+# --- Scrape cache (per URL validators + content hash + extracted price) ---
+
+# Bump when PRICE_SELECTORS/parsing change: older cache rows are then re-parsed
+SCRAPE_PARSER_VERSION = 1
+
+UPSERT_SCRAPE_CACHE_SQL = '''
+    INSERT INTO scrape_cache (url, site, etag, last_modified, content_hash, price, parser_version, status_code, fetched_at, checked_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'), datetime('now'))
+    ON CONFLICT(url) DO UPDATE SET
+        site = excluded.site, etag = excluded.etag, last_modified = excluded.last_modified,
+        content_hash = excluded.content_hash, price = excluded.price, parser_version = excluded.parser_version,
+        status_code = excluded.status_code,
+        fetched_at = CASE WHEN excluded.status_code = 304 THEN scrape_cache.fetched_at ELSE excluded.fetched_at END,
+        checked_at = excluded.checked_at
+'''
+
+
+def load_scrape_cache(db, urls, chunk_size=500):
+    urls = list(dict.fromkeys(u for u in urls if u))
+    cache = {}
+    for i in range(0, len(urls), chunk_size):
+        chunk = urls[i:i + chunk_size]
+        rows = db.execute(f"SELECT * FROM scrape_cache WHERE url IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        cache.update((row['url'], dict(row)) for row in rows)
+    return cache
+
+
+def save_scrape_cache(db, entries):
+    """Stores successful fetches (failed ones keep their previous cache row). The caller commits."""
+    rows = [(e['url'], e['site'], e['etag'], e['last_modified'], e['content_hash'], e['price'], SCRAPE_PARSER_VERSION, e['status_code'])
+            for e in entries if e['outcome'] != 'error']
+    if rows:
+        db.executemany(UPSERT_SCRAPE_CACHE_SQL, rows)
+
+
+def fetch_price_leomadeiras(url):
+    return engine.fetch_price('leomadeiras', url)
+
 def fetch_price_madeverde(url):
-    try:
-        # Madeverde often requires CEP in cookie or session. 
-        # Trying public page first.
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Cookie': 'cep=01310-100' # Tentar forçar CEP via cookie
-        }
-        response = requests.get(url, headers=headers, timeout=10, proxies=get_proxies())
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            # Selectors seen: .preco-venda, .preco-promocional
-            price_elem = soup.select_one('.preco-promocional') or soup.select_one('.preco-venda')
-            if price_elem:
-                price_text = price_elem.get_text().strip().replace('R$', '').replace('.', '').replace(',', '.')
-                return float(price_text)
-    except Exception as e:
-        print(f"Erro Madeverde: {e}")
-    return 0.0
+    return engine.fetch_price('madeverde', url)
 
 def fetch_price_madeiranit(url):
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers, timeout=10, proxies=get_proxies())
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            # Selector: .product-info-main .price
-            price_elem = soup.select_one('.product-info-main .price')
-            if price_elem:
-                price_text = price_elem.get_text().strip().replace('R$', '').replace('.', '').replace(',', '.')
-                return float(price_text)
-    except Exception as e:
-        print(f"Erro Madeiranit: {e}")
-    return 0.0
+    return engine.fetch_price('madeiranit', url)
+
+# URLs hardcoded (fallback)
+DEFAULT_URLS = {
+    'leomadeiras': 'https://www.leomadeiras.com.br/p/10288987/mdf-branco-texturizado-fsc-15mm-2750x1850mm-2-faces-duratex',
+    'madeverde': 'https://www.madeverde.com.br/mdf-naval-branco-tx-15mm-02-faces-duratex',
+    'madeiranit': 'https://www.madeiranit.com.br/mdf-branco-texturizado-15mm-2-faces-185-x-275cm-duratex'
+}
+
 
 def raspador_site(site_name, url_override=None):
     """
     Raspador REAL que busca preços nos URLs definidos.
     Aceita url_override para raspar itens específicos do banco de dados.
     """
-    items = []
-    
-    # URLs hardcoded (fallback)
-    urls = {
-        'leomadeiras': 'https://www.leomadeiras.com.br/p/10288987/mdf-branco-texturizado-fsc-15mm-2750x1850mm-2-faces-duratex',
-        'madeverde': 'https://www.madeverde.com.br/mdf-naval-branco-tx-15mm-02-faces-duratex',
-        'madeiranit': 'https://www.madeiranit.com.br/mdf-branco-texturizado-15mm-2-faces-185-x-275cm-duratex'
-    }
-
-    url = url_override if url_override else urls.get(site_name)
+    url = url_override if url_override else DEFAULT_URLS.get(site_name)
     
     if not url: return []
 
     price = 0.0
+    try:
+        if site_name in PRICE_PARSERS:
+            with db_pool.connection() as db:
+                cached = load_scrape_cache(db, [url]).get(url)
+            entry = engine.fetch(site_name, url, cached)
+            price = entry['price']
+            with db_pool.connection() as db:
+                save_scrape_cache(db, [entry])
+                db.commit()
+    except Exception as e:
+        print(f"Erro raspando {site_name} ({url}): {e}")
+        return []
+    return _site_items(site_name, price, url_override)
+
+
+def _site_items(site_name, price, url_override=None):
+    items = []
     # Se for override, não temos nome padrão fácil sem passar.
     # Mas o chamador já tem o nome. O raspador retorna items encontrados.
     # Vamos manter nome genérico se for override, o chamador atualiza o DB.
     nome_padrao = 'MDF Branco TX 15mm (Real Time)' if not url_override else 'Item Raspado'
 
-    try:
-        if site_name == 'leomadeiras':
-            price = fetch_price_leomadeiras(url)
-        elif site_name == 'madeverde':
-            price = fetch_price_madeverde(url)
-        elif site_name == 'madeiranit':
-            price = fetch_price_madeiranit(url)
-    except Exception as e:
-        print(f"Erro raspando {site_name} ({url}): {e}")
-        return []
-    
     if price > 0:
         items.append({
             'nome': nome_padrao,
@@ -107,21 +334,37 @@ def raspador_site(site_name, url_override=None):
     return items
 
 
-def run_scraping_job(site_target='all'):
+def run_scraping_job(site_target='all', db=None):
     """
     Executa a raspagem independente de contexto Flask para uso em threads.
+    Com `db` (job do agendador) usa a conexão do chamador, que faz o commit; sem ele usa a
+    conexão da thread e faz commit (rollback + release mesmo se a raspagem falhar).
     """
     sites = ['madeiranit', 'madeverde', 'leomadeiras']
     if site_target != 'all' and site_target in sites:
         sites = [site_target]
-        
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
+
+    if db is not None:
+        return _scrape_sites(db, sites)
+    with db_pool.connection() as db:
+        stats = _scrape_sites(db, sites)
+        db.commit()
+    return stats
+
+
+def _scrape_sites(db, sites):
     stats = {'updated': 0, 'created': 0, 'errors': 0, 'details': {}}
-    
+
+    # All sites fetched concurrently
+    cache = load_scrape_cache(db, [DEFAULT_URLS[s] for s in sites])
+    entries = [e for _, _, e in engine.fetch_many(((s, s, DEFAULT_URLS[s]) for s in sites), cache)]
+    save_scrape_cache(db, entries)
+    prices = {e['site']: e['price'] for e in entries}
+
+    history = []
     for site in sites:
         try:
-            items = raspador_site(site)
+            items = _site_items(site, prices.get(site, 0.0))
             site_stats = {'u': 0, 'c': 0}
             
             for item in items:
@@ -133,9 +376,11 @@ def run_scraping_job(site_target='all'):
                         db.execute('UPDATE estoque SET custo_unitario=?, last_update=CURRENT_TIMESTAMP WHERE id=?',
                                    (item['preco'], existing['id']))
                         site_stats['u'] += 1
+                    history.append((existing['id'], item['site'], item['preco']))
                 else:
-                    db.execute('INSERT INTO estoque (nome, categoria, unidade, quantidade, custo_unitario, site_origem) VALUES (?, ?, ?, ?, ?, ?)',
-                               (item['nome'], 'Material Raspado', 'Unidade', 0, item['preco'], item['site']))
+                    cur = db.execute('INSERT INTO estoque (nome, categoria, unidade, quantidade, custo_unitario, site_origem) VALUES (?, ?, ?, ?, ?, ?)',
+                                     (item['nome'], 'Material Raspado', 'Unidade', 0, item['preco'], item['site']))
+                    history.append((cur.lastrowid, item['site'], item['preco']))
                     site_stats['c'] += 1
             
             stats['details'][site] = site_stats
@@ -145,36 +390,213 @@ def run_scraping_job(site_target='all'):
         except Exception as e:
             print(f"Erro raspando {site}: {e}")
             stats['errors'] += 1
-            
-    db.commit()
-    db.close()
+
+    record_prices(db, history)
     return stats
 
-def scraper_worker():
+# --- Item price refresh (individual + bulk) ---
+
+SCRAPE_SOURCES = ('madeiranit', 'leomadeiras', 'madeverde')
+BULK_COMMIT_EVERY = 20
+BULK_PROGRESS_EVERY_S = 1.0
+# A running bulk job without heartbeat for this long is considered dead
+BULK_STALE_AFTER_S = 600
+
+ITEMS_TO_SCRAPE_SQL = '''
+    SELECT id, nome, custo_unitario, site_origem, price_strategy, url_madeiranit, url_leomadeiras, url_madeverde
+    FROM estoque
+    WHERE (url_madeiranit IS NOT NULL AND url_madeiranit != '')
+       OR (url_leomadeiras IS NOT NULL AND url_leomadeiras != '')
+       OR (url_madeverde IS NOT NULL AND url_madeverde != '')
+'''
+
+
+LATEST_PRICES_SQL = '''
+    SELECT estoque_id, site, preco FROM (
+        SELECT estoque_id, site, preco,
+               ROW_NUMBER() OVER (PARTITION BY estoque_id, site ORDER BY coletado_em DESC, id DESC) AS rn
+        FROM estoque_precos WHERE estoque_id IN ({placeholders})
+    ) WHERE rn = 1
+'''
+
+
+def record_prices(db, observations, chunk_size=500):
+    """
+    Appends scraped prices to estoque_precos, only where the price changed since the last
+    recorded one for that (item, site). observations: [(estoque_id, site, preco), ...]. The caller commits.
+    """
+    latest = {}
+    observations = [(i, site, round(p, 2)) for i, site, p in observations if p and p > 0]
+    ids = list({i for i, _, _ in observations})
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        for row in db.execute(LATEST_PRICES_SQL.format(placeholders=','.join('?' * len(chunk))), chunk):
+            latest[(row['estoque_id'], row['site'])] = row['preco']
+
+    changed = []
+    for estoque_id, site, preco in observations:
+        if latest.get((estoque_id, site)) != preco:
+            latest[(estoque_id, site)] = preco
+            changed.append((estoque_id, site, preco))
+    if changed:
+        db.executemany("INSERT INTO estoque_precos (estoque_id, site, preco, coletado_em) VALUES (?, ?, ?, datetime('now'))", changed)
+    return len(changed)
+
+
+def item_urls(item):
+    return {source: item[f'url_{source}'] for source in SCRAPE_SOURCES if item[f'url_{source}']}
+
+
+def apply_item_prices(db, item, precos_encontrados):
     """
-    Verifica o horário para raspagem automática em background.
+    Writes the scraped prices of one estoque item and picks its cost by price_strategy
+    ('auto_max' = most expensive source, or a fixed source). The caller commits.
     """
-    print("Scraper Worker iniciado.")
-    while True:
+    strategy = item['price_strategy'] or 'auto_max'
+    novo_custo = item['custo_unitario']
+    site_escolhido = item['site_origem']
+
+    if strategy == 'auto_max':
+        if precos_encontrados:
+            max_source = max(precos_encontrados, key=precos_encontrados.get)
+            novo_custo = precos_encontrados[max_source]
+            site_escolhido = max_source
+    elif strategy in precos_encontrados:
+        novo_custo = precos_encontrados[strategy]
+        site_escolhido = strategy
+
+    updates = [f"preco_{source} = ?" for source in precos_encontrados]
+    params = list(precos_encontrados.values())
+    updates += ["custo_unitario = ?", "site_origem = ?", "last_update = datetime('now')"]
+    params += [novo_custo, site_escolhido, item['id']]
+    db.execute(f"UPDATE estoque SET {', '.join(updates)} WHERE id = ?", params)
+    return novo_custo, site_escolhido, strategy
+
+
+def scrape_item(db, item):
+    """Fetches every configured source of one item concurrently and applies the result."""
+    urls = item_urls(item)
+    cache = load_scrape_cache(db, urls.values())
+    entries = [e for _, _, e in engine.fetch_many(((site, site, url) for site, url in urls.items()), cache)]
+    save_scrape_cache(db, entries)
+    precos = {e['site']: e['price'] for e in entries if e['price'] > 0}
+    if not precos:
+        return None
+    record_prices(db, [(item['id'], site, preco) for site, preco in precos.items()])
+    novo_custo, site, strategy = apply_item_prices(db, item, precos)
+    return {'preco': novo_custo, 'site': site, 'detalhes': precos, 'strategy': strategy}
+
+
+def _bulk_update(db, job_id, **fields):
+    fields['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    assignments = ', '.join(f'{k} = ?' for k in fields)
+    db.execute(f"UPDATE scrape_jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+
+def start_bulk_refresh(db, user_id=None):
+    """Queues a refresh of every item with URLs (or returns the one already running). Returns (job_id, started)."""
+    row = db.execute('''
+        SELECT id FROM scrape_jobs
+        WHERE status IN ('queued', 'running') AND updated_at >= datetime('now', ?)
+        ORDER BY id DESC LIMIT 1
+    ''', (f'-{BULK_STALE_AFTER_S} seconds',)).fetchone()
+    if row:
+        return row['id'], False
+
+    cur = db.execute("INSERT INTO scrape_jobs (user_id, status, updated_at) VALUES (?, 'queued', datetime('now'))", (user_id,))
+    db.commit()
+    job_id = cur.lastrowid
+    threading.Thread(target=run_bulk_refresh, args=(job_id,), daemon=True, name=f'ScrapeJob-{job_id}').start()
+    return job_id, True
+
+
+def run_bulk_refresh(job_id):
+    """
+    Bulk refresh job: all (item, source) pages go through the engine at once; this thread is
+    the only writer and commits every BULK_COMMIT_EVERY items together with the progress.
+    """
+    with db_pool.connection() as db:
         try:
-            # Nova conexão por ciclo para evitar problemas de thread
-            db = sqlite3.connect(DATABASE)
-            db.row_factory = sqlite3.Row
-            rows = db.execute('SELECT * FROM settings').fetchall()
-            db.close()
-            settings = {r['key']: r['value'] for r in rows}
-            
-            ativa = settings.get('raspagem_ativa') == 'true'
-            hora = settings.get('raspagem_hora', '02:00')
-            
-            if ativa:
-                agora = datetime.now().strftime('%H:%M')
-                if agora == hora:
-                    print(f"[{datetime.now()}] Iniciando raspagem agendada...")
-                    run_scraping_job('all')
-                    time.sleep(61) # Evita rodar no mesmo minuto
+            items = {row['id']: row for row in db.execute(ITEMS_TO_SCRAPE_SQL).fetchall()}
+            pending = {item_id: set(item_urls(item)) for item_id, item in items.items()}
+            found = {item_id: {} for item_id in items}
+            stats = {'total': len(items), 'done': 0, 'updated': 0, 'errors': 0}
+            results = []
+            _bulk_update(db, job_id, status='running', total=len(items), started_at=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+            db.commit()
+
+            jobs = [(item_id, site, url) for item_id, item in items.items() for site, url in item_urls(item).items()]
+            cache = load_scrape_cache(db, [url for _, _, url in jobs])
+            fetched, history = [], []
+            last_flush = time.monotonic()
+            since_commit = 0
+            cancelled = False
+            for item_id, site, entry in engine.fetch_many(jobs, cache):
+                fetched.append(entry)
+                if entry['price'] > 0:
+                    found[item_id][site] = entry['price']
+                pending[item_id].discard(site)
+                if pending[item_id]:
                     continue
+
+                # Every source of this item answered
+                item = items[item_id]
+                stats['done'] += 1
+                if found[item_id]:
+                    history.extend((item_id, s, p) for s, p in found[item_id].items())
+                    novo_custo, site_escolhido, _ = apply_item_prices(db, item, found[item_id])
+                    stats['updated'] += 1
+                    results.append({'id': item_id, 'nome': item['nome'], 'success': True, 'preco': novo_custo, 'site': site_escolhido})
+                else:
+                    stats['errors'] += 1
+                    results.append({'id': item_id, 'nome': item['nome'], 'success': False, 'error': 'Falha na raspagem de todas as fontes'})
+                since_commit += 1
+
+                if since_commit >= BULK_COMMIT_EVERY or time.monotonic() - last_flush >= BULK_PROGRESS_EVERY_S:
+                    save_scrape_cache(db, fetched)
+                    record_prices(db, history)
+                    fetched, history = [], []
+                    _bulk_update(db, job_id, done=stats['done'], updated=stats['updated'], errors=stats['errors'],
+                                 results_json=json.dumps(results, ensure_ascii=False))
+                    db.commit()
+                    since_commit, last_flush = 0, time.monotonic()
+                    status = db.execute("SELECT status FROM scrape_jobs WHERE id = ?", (job_id,)).fetchone()
+                    if status and status['status'] == 'cancel_requested':
+                        cancelled = True
+                        break
+
+            save_scrape_cache(db, fetched)
+            record_prices(db, history)
+            _bulk_update(db, job_id, status='cancelled' if cancelled else 'done', done=stats['done'], updated=stats['updated'],
+                         errors=stats['errors'], results_json=json.dumps(results, ensure_ascii=False),
+                         finished_at=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+            db.commit()
+            print(f"Raspagem em lote #{job_id}: {stats['updated']}/{stats['total']} itens atualizados, {stats['errors']} erros")
         except Exception as e:
-            print(f"Erro no Scraper Worker: {e}")
-            
-        time.sleep(30)
+            db.rollback()
+            print(f"Erro na raspagem em lote #{job_id}: {e}")
+            _bulk_update(db, job_id, status='error', error=str(e), finished_at=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+            db.commit()
+
+
+def get_bulk_job(db, job_id, since=0):
+    """Job status; results are returned from index `since` so pollers only get the new lines."""
+    row = db.execute("SELECT * FROM scrape_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    results = json.loads(row['results_json'] or '[]')
+    total = row['total'] or 0
+    return {
+        'id': row['id'],
+        'status': row['status'],
+        'total': total,
+        'done': row['done'] or 0,
+        'updated': row['updated'] or 0,
+        'errors': row['errors'] or 0,
+        'progress': round(100.0 * (row['done'] or 0) / total) if total else (100 if row['status'] == 'done' else 0),
+        'error': row['error'],
+        'results': results[since:],
+        'next': len(results),
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+    }
@@ -1,5 +1,148 @@
 from app.database import get_db
 
+# SQLite host parameter limit is 999 on older builds; keep IN-lists below it
+IN_CHUNK_SIZE = 500
+DEFAULT_LABOR_RATE = 70.0
+
+
+def _id_key(value):
+    # Ids arrive from the frontend as int, float or str; SQLite compares them as integers
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _fetch_in(db, sql, ids):
+    """Runs sql (with a single {ids} placeholder) in chunks; returns all rows."""
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[i:i + IN_CHUNK_SIZE]
+        rows.extend(db.execute(sql.format(ids=','.join('?' * len(chunk))), chunk).fetchall())
+    return rows
+
+
+class PricingContext:
+    """
+    Everything calculate_item_tier_cost needs for one request, bulk-loaded up front:
+    catalog items, their insumos, tier rules, replacement/accessory estoque rows and the labor rate.
+    Pricing afterwards runs purely from these dicts (no queries per item x tier).
+    """
+
+    def __init__(self, db, items, tier_ids):
+        cat_ids = {_id_key(it.get('catalogo_id')) for it in items if it.get('catalogo_id') is not None}
+
+        self.catalog = {row['id']: row for row in
+                        _fetch_in(db, "SELECT * FROM itens_catalogo WHERE id IN ({ids})", cat_ids)}
+
+        self.insumos = {}
+        for row in _fetch_in(db, '''
+            SELECT ci.*, e.custo_unitario, e.categoria, e.nome, e.id as original_estoque_id
+            FROM catalogo_insumos ci
+            JOIN estoque e ON ci.estoque_id = e.id
+            WHERE ci.catalogo_id IN ({ids})
+            ORDER BY ci.id
+        ''', cat_ids):
+            self.insumos.setdefault(row['catalogo_id'], []).append(row)
+
+        self.rules = {_id_key(t): {} for t in tier_ids}
+        for row in _fetch_in(db, "SELECT tier_id, category, item_id, price_modifier FROM tier_rules WHERE tier_id IN ({ids}) ORDER BY id",
+                             self.rules.keys()):
+            self.rules[row['tier_id']][row['category']] = {
+                'item_id': row['item_id'],
+                'price_modifier': row['price_modifier']
+            }
+
+        estoque_ids = {_id_key(acc.get('id')) for it in items for acc in (it.get('acessorios') or [])
+                       if acc.get('id') is not None}
+        for rules in self.rules.values():
+            estoque_ids.update(r['item_id'] for r in rules.values() if r['item_id'])
+        self.estoque = {row['id']: row for row in
+                        _fetch_in(db, "SELECT id, nome, categoria, custo_unitario FROM estoque WHERE id IN ({ids})", estoque_ids)}
+
+        labor_rate_row = db.execute("SELECT value FROM settings WHERE key='valor_hora_fabrica'").fetchone()
+        self.labor_rate = float(labor_rate_row['value']) if labor_rate_row else DEFAULT_LABOR_RATE
+
+    def tier_rules(self, tier_id):
+        return self.rules.get(_id_key(tier_id), {})
+
+    def _apply_rule(self, rule, cost_unit, name):
+        if rule:
+            # Apply replacement if item_id is defined
+            if rule['item_id']:
+                replacement = self.estoque.get(_id_key(rule['item_id']))
+                if replacement:
+                    cost_unit = float(replacement['custo_unitario'])
+                    name = replacement['nome']
+            # Apply modifier
+            if rule['price_modifier'] != 1.0:
+                cost_unit *= rule['price_modifier']
+        return cost_unit, name
+
+    def item_tier_cost(self, item_data, tier_id):
+        """Same result and breakdown strings as calculate_item_tier_cost, without touching the database."""
+        cat_id = _id_key(item_data.get('catalogo_id'))
+        L = float(item_data.get('L', 0)) / 1000.0 # mm to m
+        A = float(item_data.get('A', 0)) / 1000.0 # mm to m
+        P = float(item_data.get('P', 0)) / 1000.0 # mm to m
+        complex_factor = float(item_data.get('complex', 1.0))
+
+        cat_item = self.catalog.get(cat_id)
+        if not cat_item:
+            return 0.0, ["Item não encontrado"]
+
+        insumos = self.insumos.get(cat_id, [])
+        rules = self.tier_rules(tier_id)
+
+        total_mat_cost = 0.0
+        breakdown = []
+
+        if insumos:
+            for ins in insumos:
+                qty = 0.0
+                type_calc = ins['tipo_calculo']
+                base_qty = float(ins['quantidade'])
+
+                if type_calc == 'fixo':
+                    qty = base_qty
+                elif type_calc == 'area':
+                    qty = (L * A) * base_qty
+                elif type_calc == 'volume':
+                    depth = P if P > 0 else 0.001
+                    qty = (L * A * depth) * base_qty
+                elif type_calc == 'perimetro':
+                    qty = 2 * (L + A) * base_qty
+
+                cost_unit, used_name = self._apply_rule(rules.get(ins['categoria']), float(ins['custo_unitario']), ins['nome'])
+
+                item_cost = qty * cost_unit
+                total_mat_cost += item_cost
+                breakdown.append(f"{used_name}: {qty:.2f} x {cost_unit:.2f} = {item_cost:.2f}")
+        else:
+            # Fallback for simple items without insumos
+            vol = L * A * (P if P > 0 else 0.001)
+            base_price = float(cat_item['preco_base'] or 0)
+            total_mat_cost = vol * base_price
+            breakdown.append(f"Volume Fallback: {vol:.3f}m³ * {base_price}")
+
+        labor_rate = self.labor_rate
+        labor_cost = float(cat_item['horas_mo'] or 0) * labor_rate * complex_factor
+        breakdown.append(f"Mão de Obra: {float(cat_item['horas_mo'] or 0):.1f}h x {labor_rate} x {complex_factor} = {labor_cost:.2f}")
+
+        acc_cost = 0.0
+        for acc in (item_data.get('acessorios') or []):
+            acc_qty = float(acc.get('qtd', 0))
+            acc_db = self.estoque.get(_id_key(acc.get('id')))
+            if acc_db:
+                a_cost, a_name = self._apply_rule(rules.get(acc_db['categoria']), float(acc_db['custo_unitario']), acc_db['nome'])
+                item_acc_cost = acc_qty * a_cost
+                acc_cost += item_acc_cost
+                breakdown.append(f"Acessório {a_name}: {acc_qty} x {a_cost:.2f}")
+
+        return total_mat_cost + labor_cost + acc_cost, breakdown
+
+
 def get_tier_rules(db, tier_id):
     """
     Returns a dict: { category: { 'item_id': id, 'price_modifier': float } }
@@ -13,115 +156,157 @@ def get_tier_rules(db, tier_id):
         }
     return rules
 
-def calculate_item_tier_cost(db, item_data, tier_id):
+def calculate_item_tier_cost(db, item_data, tier_id, ctx=None):
     """
     Calculates cost for a single item usage under a specific tier.
     item_data: { 'catalogo_id': int, 'L': float, 'A': float, 'P': float, 'complex': float, 'acessorios': [] }
+    Pass a PricingContext built for the whole request to avoid per-call queries.
     """
-    cat_id = item_data.get('catalogo_id')
-    L = float(item_data.get('L', 0)) / 1000.0 # mm to m
-    A = float(item_data.get('A', 0)) / 1000.0 # mm to m
-    P = float(item_data.get('P', 0)) / 1000.0 # mm to m
-    complex_factor = float(item_data.get('complex', 1.0))
-    
-    # 1. Fetch Catalog Item & Insumos
     # We fetch fresh from DB to avoid frontend tampering with internal logic
-    cat_item = db.execute("SELECT * FROM itens_catalogo WHERE id = ?", (cat_id,)).fetchone()
-    if not cat_item:
-        return 0.0, ["Item não encontrado"]
+    if ctx is None:
+        ctx = PricingContext(db, [item_data], [tier_id])
+    return ctx.item_tier_cost(item_data, tier_id)
 
-    insumos = db.execute('''
-        SELECT ci.*, e.custo_unitario, e.categoria, e.nome, e.id as original_estoque_id
-        FROM catalogo_insumos ci
-        JOIN estoque e ON ci.estoque_id = e.id
-        WHERE ci.catalogo_id = ?
-    ''', (cat_id,)).fetchall()
+# --- Batch engine (all tiers at once) ---
 
-    rules = get_tier_rules(db, tier_id)
+CALC_TYPES = ('fixo', 'area', 'volume', 'perimetro')
 
-    total_mat_cost = 0.0
+
+def price_tiers(db, items, tier_ids, ctx=None):
+    """
+    Prices a whole budget for every tier. Returns { tier_id: (custo_total, breakdown) }.
+    Uses numpy when available: the budget becomes one consumption matrix (items x estoque)
+    and every tier is a column of a cost matrix, so all tiers are a single matrix multiply.
+    Falls back to the per-item loop otherwise.
+    """
+    if ctx is None:
+        ctx = PricingContext(db, items, tier_ids)
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is None or not items or not tier_ids:
+        return {t: _price_tier_loop(ctx, items, t) for t in tier_ids}
+    return _price_tiers_matrix(np, ctx, items, tier_ids)
+
+
+def _price_tier_loop(ctx, items, tier_id):
+    total = 0.0
     breakdown = []
+    for item in items:
+        cost, details = ctx.item_tier_cost(item, tier_id)
+        total += cost
+        breakdown.extend(details)
+    return total, breakdown
+
 
-    # 3. Calculate Material Cost
-    if insumos:
+def _price_tiers_matrix(np, ctx, items, tier_ids):
+    n = len(items)
+    dims = np.array([[float(it.get('L', 0)), float(it.get('A', 0)), float(it.get('P', 0))] for it in items]) / 1000.0
+    L, A, P = dims[:, 0], dims[:, 1], dims[:, 2]
+    complex_f = np.array([float(it.get('complex', 1.0)) for it in items])
+    cat_items = [ctx.catalog.get(_id_key(it.get('catalogo_id'))) for it in items]
+
+    # Columns of the consumption matrix: every estoque row used by an insumo or accessory
+    columns = {}   # estoque id -> column
+    col_info = []  # (categoria, custo_unitario, nome)
+
+    def col_for(est_id, categoria, custo, nome):
+        if est_id not in columns:
+            columns[est_id] = len(col_info)
+            col_info.append((categoria, float(custo), nome))
+        return columns[est_id]
+
+    # Insumo lines (COO form): item index, column, base quantity, calc type
+    ins_item, ins_col, ins_base, ins_type = [], [], [], []
+    fallback = np.zeros(n)
+    labor_hours = np.zeros(n)
+    acc_lines = {}  # item index -> [(column, qty)]
+    for i, (it, cat_item) in enumerate(zip(items, cat_items)):
+        if not cat_item:
+            continue
+        labor_hours[i] = float(cat_item['horas_mo'] or 0)
+        insumos = ctx.insumos.get(_id_key(it.get('catalogo_id')), [])
         for ins in insumos:
-            # Consumption Calculation
-            qty = 0.0
-            type_calc = ins['tipo_calculo']
-            base_qty = float(ins['quantidade'])
-            
-            if type_calc == 'fixo':
-                qty = base_qty
-            elif type_calc == 'area':
-                qty = (L * A) * base_qty
-            elif type_calc == 'volume':
-                depth = P if P > 0 else 0.001
-                qty = (L * A * depth) * base_qty
-            elif type_calc == 'perimetro':
-                qty = 2 * (L + A) * base_qty
-                
-            # Tier Substitution Logic
-            category = ins['categoria']
-            cost_unit = float(ins['custo_unitario'])
-            used_name = ins['nome']
-            rule = rules.get(category)
-            
-            if rule:
-                # Apply replacement if item_id is defined
-                if rule['item_id']:
-                    replacement = db.execute("SELECT nome, custo_unitario FROM estoque WHERE id = ?", (rule['item_id'],)).fetchone()
-                    if replacement:
-                        cost_unit = float(replacement['custo_unitario'])
-                        used_name = replacement['nome'] # + " (Subst.)"
-                
-                # Apply modifier
-                if rule['price_modifier'] != 1.0:
-                    cost_unit *= rule['price_modifier']
-
-            item_cost = qty * cost_unit
-            total_mat_cost += item_cost
-            breakdown.append(f"{used_name}: {qty:.2f} x {cost_unit:.2f} = {item_cost:.2f}")
-
-    else:
-        # Fallback for simple items without insumos
-        vol = L * A * (P if P > 0 else 0.001)
-        base_price = float(cat_item['preco_base'] or 0)
-        total_mat_cost = vol * base_price
-        breakdown.append(f"Volume Fallback: {vol:.3f}m³ * {base_price}")
-
-    # 4. Labor Cost
-    labor_rate_row = db.execute("SELECT value FROM settings WHERE key='valor_hora_fabrica'").fetchone()
-    labor_rate = float(labor_rate_row['value']) if labor_rate_row else 70.0
-    
-    labor_cost = float(cat_item['horas_mo'] or 0) * labor_rate * complex_factor
-    breakdown.append(f"Mão de Obra: {float(cat_item['horas_mo'] or 0):.1f}h x {labor_rate} x {complex_factor} = {labor_cost:.2f}")
-    
-    # 5. Accessories
-    acc_cost = 0.0
-    if item_data.get('acessorios'):
-        for acc in item_data.get('acessorios'):
-            acc_id = acc.get('id')
-            acc_qty = float(acc.get('qtd', 0))
-            
-            acc_db = db.execute("SELECT categoria, custo_unitario, nome FROM estoque WHERE id = ?", (acc_id,)).fetchone()
+            ins_item.append(i)
+            ins_col.append(col_for(ins['original_estoque_id'], ins['categoria'], ins['custo_unitario'], ins['nome']))
+            ins_base.append(float(ins['quantidade']))
+            t = ins['tipo_calculo']
+            ins_type.append(CALC_TYPES.index(t) if t in CALC_TYPES else -1)
+        if not insumos:
+            fallback[i] = L[i] * A[i] * (P[i] if P[i] > 0 else 0.001) * float(cat_item['preco_base'] or 0)
+        for acc in (it.get('acessorios') or []):
+            acc_db = ctx.estoque.get(_id_key(acc.get('id')))
             if acc_db:
-                a_cost = float(acc_db['custo_unitario'])
-                a_name = acc_db['nome']
-                a_cat = acc_db['categoria']
-                
-                # Check rule
-                rule = rules.get(a_cat)
-                if rule:
-                     if rule['item_id']:
-                        rep = db.execute("SELECT nome, custo_unitario FROM estoque WHERE id = ?", (rule['item_id'],)).fetchone()
-                        if rep:
-                            a_cost = float(rep['custo_unitario'])
-                            a_name = rep['nome']
-                     if rule.get('price_modifier', 1.0) != 1.0:
-                            a_cost *= rule['price_modifier']
-                
-                item_acc_cost = acc_qty * a_cost
-                acc_cost += item_acc_cost
-                breakdown.append(f"Acessório {a_name}: {acc_qty} x {a_cost:.2f}")
+                col = col_for(acc_db['id'], acc_db['categoria'], acc_db['custo_unitario'], acc_db['nome'])
+                acc_lines.setdefault(i, []).append((col, float(acc.get('qtd', 0))))
+
+    # Consumption per insumo line from L/A/P, by tipo_calculo
+    li = np.array(ins_item, dtype=int)
+    base = np.array(ins_base, dtype=float)
+    kind = np.array(ins_type, dtype=int)
+    Li, Ai, Pi = L[li], A[li], P[li]
+    depth = np.where(Pi > 0, Pi, 0.001)
+    qty = np.select(
+        [kind == 0, kind == 1, kind == 2, kind == 3],
+        [base, (Li * Ai) * base, (Li * Ai * depth) * base, 2 * (Li + Ai) * base],
+        default=0.0)
+
+    n_cols = len(col_info)
+    Q = np.zeros((n, n_cols))
+    if len(li):
+        np.add.at(Q, (li, np.array(ins_col, dtype=int)), qty)
+    for i, lines in acc_lines.items():
+        for col, acc_qty in lines:
+            Q[i, col] += acc_qty
+
+    # Cost matrix: one column per tier with substitutions and price modifiers applied
+    C = np.zeros((n_cols, len(tier_ids)))
+    names = [[None] * len(tier_ids) for _ in range(n_cols)]
+    for k, tier_id in enumerate(tier_ids):
+        rules = ctx.tier_rules(tier_id)
+        for col, (categoria, custo, nome) in enumerate(col_info):
+            C[col, k], names[col][k] = ctx._apply_rule(rules.get(categoria), custo, nome)
+
+    labor = labor_hours * ctx.labor_rate * complex_f
+    totals = (Q @ C).sum(axis=0) + labor.sum() + fallback.sum()
+
+    # Breakdown strings (same text as calculate_item_tier_cost).
+    # Tier-independent parts are formatted once; plain lists avoid numpy scalar access in the loops.
+    qty_l, C_l, labor_l = qty.tolist(), C.tolist(), labor.tolist()
+    lines_by_item = {}
+    for pos, i in enumerate(ins_item):
+        q = qty_l[pos]
+        lines_by_item.setdefault(i, []).append((ins_col[pos], q, f"{q:.2f}"))
+
+    fixed = {}
+    for i, cat_item in enumerate(cat_items):
+        if not cat_item:
+            continue
+        head = None
+        if i not in lines_by_item:
+            l, a, p = dims[i].tolist()
+            vol = l * a * (p if p > 0 else 0.001)
+            head = f"Volume Fallback: {vol:.3f}m³ * {float(cat_item['preco_base'] or 0)}"
+        labor_line = f"Mão de Obra: {labor_hours[i]:.1f}h x {ctx.labor_rate} x {complex_f[i]} = {labor_l[i]:.2f}"
+        fixed[i] = (head, labor_line)
 
-    return total_mat_cost + labor_cost + acc_cost, breakdown
+    results = {}
+    for k, tier_id in enumerate(tier_ids):
+        cost_str = [f"{row[k]:.2f}" for row in C_l]
+        breakdown = []
+        for i, cat_item in enumerate(cat_items):
+            if not cat_item:
+                breakdown.append("Item não encontrado")
+                continue
+            head, labor_line = fixed[i]
+            if head is None:
+                for col, q, q_str in lines_by_item[i]:
+                    breakdown.append(f"{names[col][k]}: {q_str} x {cost_str[col]} = {q * C_l[col][k]:.2f}")
+            else:
+                breakdown.append(head)
+            breakdown.append(labor_line)
+            for col, acc_qty in acc_lines.get(i, []):
+                breakdown.append(f"Acessório {names[col][k]}: {acc_qty} x {cost_str[col]}")
+        results[tier_id] = (float(totals[k]), breakdown)
+    return results
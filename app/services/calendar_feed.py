@@ -0,0 +1,176 @@
+import heapq
+from datetime import date, datetime, timedelta
+
+# Calendar feed for /api/calendar/events. Each event source is one query with a range
+# predicate on an indexed date column, ORDER BY that column, so every source is already
+# sorted and the feed is a k-way merge of the streams (heapq.merge) instead of a full sort.
+# Incremental sync: orcamentos / contas / crm_activities carry updated_at (set by triggers,
+# created by migration 27) and deletions leave a row in calendar_deletions; a delta returns the current
+# events of every row changed since the cursor plus the ids of events that disappeared.
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%f'
+# The cursor goes back this much: a write stamped just before the cursor but committed after
+# the read is picked up by the next sync (events are idempotent upserts on the client)
+SYNC_OVERLAP_S = 5
+# calendar_deletions kept this long; an older cursor gets reset=True (client reloads the window)
+DELETIONS_RETENTION_DAYS = 30
+
+ACTIVITY_DATE = 'COALESCE(scheduled_at, created_at)'
+
+
+def _orcamento_events(rows, kind):
+    for orc in rows:
+        if kind == 'project':
+            yield {
+                'id': f"orc_{orc['id']}",
+                'title': f"Prazo: {orc['client']}",
+                'start': orc['prazo_entrega'],
+                'type': 'project',
+                'description': f"Orçamento #{orc['id']} - {orc['status']}",
+                'cli_id': orc['client_id']
+            }
+        elif kind == 'install':
+            yield {
+                'id': f"inst_{orc['id']}",
+                'title': f"Instalação: {orc['client']}",
+                'start': orc['data_instalacao'],
+                'type': 'install',
+                'description': f"Instalação confirmada - {orc['client']}",
+                'cli_id': orc['client_id']
+            }
+        else:
+            # "Visita/Contato" marker on the day the budget was created
+            yield {
+                'id': f"visit_{orc['id']}",
+                'title': f"Visita/Contato: {orc['client']}",
+                'start': orc['created_at'].split(' ')[0],
+                'type': 'visit',
+                'description': "Primeiro contato/Visita técnica",
+                'cli_id': orc['client_id']
+            }
+
+
+def _conta_events(rows):
+    for conta in rows:
+        receber = conta['tipo'] == 'receber'
+        yield {
+            'id': f"fin_{conta['id']}",
+            'title': f"{'Receber' if receber else 'Pagar'}: {conta['descricao']}",
+            'start': conta['vencimento'],
+            'type': 'receber' if receber else 'payable',
+            'description': f"R$ {(conta['valor'] or 0):.2f} - {conta['status']}"
+        }
+
+
+def _activity_events(rows):
+    for act in rows:
+        # types: note, visit, meeting (shown as visit), call; unknown -> visit (purple)
+        etype = 'note' if act['activity_type'] == 'note' else 'visit'
+        yield {
+            'id': f"act_{act['id']}",
+            'title': act['title'],
+            'start': act['data'],  # full DATETIME when scheduled
+            'type': etype,
+            'description': act['description'],
+            'cli_id': act['client_id']
+        }
+
+
+ORCAMENTO_COLS = 'id, client, client_id, prazo_entrega, data_instalacao, created_at, status'
+# orcamentos produce up to three events: (event id prefix, date column, event type)
+ORCAMENTO_STREAMS = (
+    ('orc', 'prazo_entrega', 'project'),
+    ('inst', 'data_instalacao', 'install'),
+    ('visit', 'created_at', 'visit'),
+)
+
+
+def _streams(db, start, end, changed_where='', changed_params=()):
+    """One sorted event stream per (source, date column), restricted to [start, end)."""
+    streams = []
+    for _, column, kind in ORCAMENTO_STREAMS:
+        cur = db.execute(f'''
+            SELECT {ORCAMENTO_COLS} FROM orcamentos
+            WHERE {column} >= ? AND {column} < ? {changed_where}
+            ORDER BY {column}
+        ''', (start, end, *changed_params))
+        streams.append(_orcamento_events(cur, kind))
+    cur = db.execute(f'''
+        SELECT id, descricao, valor, tipo, vencimento, status FROM contas
+        WHERE vencimento >= ? AND vencimento < ? AND status = 'pendente' {changed_where}
+        ORDER BY vencimento
+    ''', (start, end, *changed_params))
+    streams.append(_conta_events(cur))
+    cur = db.execute(f'''
+        SELECT id, client_id, title, description, activity_type, {ACTIVITY_DATE} AS data FROM crm_activities
+        WHERE {ACTIVITY_DATE} >= ? AND {ACTIVITY_DATE} < ? {changed_where}
+        ORDER BY {ACTIVITY_DATE}
+    ''', (start, end, *changed_params))
+    streams.append(_activity_events(cur))
+    return streams
+
+
+def default_window(today=None):
+    """What the kanban calendar shows: previous, current and next month."""
+    today = today or date.today()
+    first = today.replace(day=1)
+    start = (first - timedelta(days=1)).replace(day=1)
+    end = (first + timedelta(days=62)).replace(day=1)
+    return start.isoformat(), end.isoformat()
+
+
+def parse_window(args):
+    """start/end (YYYY-MM-DD or ISO datetime, end exclusive) -> ('YYYY-MM-DD', 'YYYY-MM-DD')."""
+    if not args.get('start') and not args.get('end'):
+        return default_window()
+    try:
+        start = datetime.strptime(args['start'][:10], '%Y-%m-%d').date()
+        end = datetime.strptime(args['end'][:10], '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('start e end devem ser datas YYYY-MM-DD')
+    if start >= end:
+        raise ValueError('start deve ser anterior a end')
+    return start.isoformat(), end.isoformat()
+
+
+def sync_cursor(db):
+    row = db.execute("SELECT strftime(?, 'now', ?)", (TS_FORMAT, f'-{SYNC_OVERLAP_S} seconds')).fetchone()
+    return row[0]
+
+
+def window_events(db, start, end):
+    """All events in [start, end), merged in start order."""
+    return list(heapq.merge(*_streams(db, start, end), key=lambda e: e['start']))
+
+
+def changed_events(db, start, end, since):
+    """
+    Delta since the cursor: {'events': current events (in window) of every changed row,
+    'removed': ids of events that no longer exist / left the window, 'reset': cursor too old}.
+    """
+    oldest = db.execute("SELECT datetime('now', ?)", (f'-{DELETIONS_RETENTION_DAYS} days',)).fetchone()[0]
+    if since < oldest:
+        return {'events': [], 'removed': [], 'reset': True}
+
+    events = list(heapq.merge(*_streams(db, start, end, 'AND updated_at >= ?', (since,)), key=lambda e: e['start']))
+    current = {e['id'] for e in events}
+
+    # Every event a changed row could have produced: the ones not in `current` are gone
+    candidates = []
+    for r in db.execute("SELECT id FROM orcamentos WHERE updated_at >= ?", (since,)):
+        candidates += [f"{prefix}_{r['id']}" for prefix, _, _ in ORCAMENTO_STREAMS]
+    candidates += [f"fin_{r['id']}" for r in db.execute("SELECT id FROM contas WHERE updated_at >= ?", (since,))]
+    candidates += [f"act_{r['id']}" for r in db.execute("SELECT id FROM crm_activities WHERE updated_at >= ?", (since,))]
+    for r in db.execute("SELECT source, source_id FROM calendar_deletions WHERE deleted_at >= ?", (since,)):
+        if r['source'] == 'orcamentos':
+            candidates += [f"{prefix}_{r['source_id']}" for prefix, _, _ in ORCAMENTO_STREAMS]
+        else:
+            candidates.append(f"{'fin' if r['source'] == 'contas' else 'act'}_{r['source_id']}")
+    removed = sorted({c for c in candidates if c not in current})
+    return {'events': events, 'removed': removed, 'reset': False}
+
+
+def purge_deletions(db, retention_days=DELETIONS_RETENTION_DAYS):
+    cur = db.execute("DELETE FROM calendar_deletions WHERE deleted_at < datetime('now', ?)", (f'-{int(retention_days)} days',))
+    return cur.rowcount
+
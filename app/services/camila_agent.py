@@ -1,5 +1,6 @@
 from app.database import get_db
 from app.services import waha
+from app.services.search import search_ids
 import json
 import re
 from agno.agent import Agent
@@ -61,8 +62,12 @@ def identify_user(whatsapp_number):
 def consultar_estoque(termo: str) -> str:
     """Consulta o estoque por nome do item."""
     db = get_db()
-    items = db.execute("SELECT id, nome, preco_venda, quantidade FROM estoque WHERE nome LIKE ? LIMIT 5", 
-                       (f'%{termo}%',)).fetchall()
+    ids = search_ids(db, 'estoque', termo, limit=5)
+    items = []
+    if ids:
+        rows = db.execute(f"SELECT id, nome, preco_venda, quantidade FROM estoque WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        by_id = {r['id']: r for r in rows}
+        items = [by_id[i] for i in ids if i in by_id]
     if not items:
         return "Nenhum item encontrado."
     
@@ -75,7 +80,8 @@ def ver_status_orcamento(cliente_nome: str) -> str:
     """Verifica o status do orçamento de um cliente."""
     db = get_db()
     # Find client first
-    cliente = db.execute("SELECT id, nome FROM clientes WHERE nome LIKE ? LIMIT 1", (f'%{cliente_nome}%',)).fetchone()
+    ids = search_ids(db, 'clientes', cliente_nome, limit=1)
+    cliente = db.execute("SELECT id, nome FROM clientes WHERE id = ?", (ids[0],)).fetchone() if ids else None
     if not cliente:
         return "Cliente não encontrado."
         
@@ -1,9 +1,101 @@
 import os
+import json
+import math
 import zipfile
 import re
 import xml.etree.ElementTree as ET
 from app.database import get_db
 
+# discovered_patterns keeps mergeable sufficient statistics per dimension
+# (sum, sum of squares, min, max and a 10 mm histogram for the median), so training
+# batches can be merged in any order and re-runs don't drift the suggestions.
+DIMS = ('L', 'A', 'P')
+HIST_BUCKET_MM = 10
+
+PATTERN_STATS_COLUMNS = ['occurrences'] + [f'{c}_{d}' for d in DIMS for c in ('avg', 'sum', 'sumsq', 'min', 'max', 'hist')]
+
+
+def empty_pattern():
+    return {'n': 0, 'dims': {d: {'sum': 0.0, 'sumsq': 0.0, 'min': None, 'max': None, 'hist': {}} for d in DIMS}}
+
+
+def add_observation(stats, dims):
+    """Adds one module occurrence ({'L': .., 'A': .., 'P': ..}) to the pattern stats."""
+    stats['n'] += 1
+    for d in DIMS:
+        v = float(dims[d])
+        s = stats['dims'][d]
+        s['sum'] += v
+        s['sumsq'] += v * v
+        s['min'] = v if s['min'] is None else min(s['min'], v)
+        s['max'] = v if s['max'] is None else max(s['max'], v)
+        key = int(round(v / HIST_BUCKET_MM))
+        s['hist'][key] = s['hist'].get(key, 0) + 1
+    return stats
+
+
+def merge_patterns(a, b):
+    """Combines two pattern stats (associative and commutative)."""
+    out = empty_pattern()
+    out['n'] = a['n'] + b['n']
+    for d in DIMS:
+        sa, sb, so = a['dims'][d], b['dims'][d], out['dims'][d]
+        so['sum'] = sa['sum'] + sb['sum']
+        so['sumsq'] = sa['sumsq'] + sb['sumsq']
+        mins = [v for v in (sa['min'], sb['min']) if v is not None]
+        maxs = [v for v in (sa['max'], sb['max']) if v is not None]
+        so['min'] = min(mins) if mins else None
+        so['max'] = max(maxs) if maxs else None
+        hist = dict(sa['hist'])
+        for k, c in sb['hist'].items():
+            hist[k] = hist.get(k, 0) + c
+        so['hist'] = hist
+    return out
+
+
+def pattern_from_row(row):
+    stats = empty_pattern()
+    stats['n'] = row['occurrences'] or 0
+    for d in DIMS:
+        s = stats['dims'][d]
+        s['sum'] = row[f'sum_{d}'] or 0.0
+        s['sumsq'] = row[f'sumsq_{d}'] or 0.0
+        s['min'] = row[f'min_{d}']
+        s['max'] = row[f'max_{d}']
+        s['hist'] = {int(k): c for k, c in json.loads(row[f'hist_{d}'] or '{}').items()}
+    return stats
+
+
+def pattern_to_row(stats):
+    """Values for PATTERN_STATS_COLUMNS (avg_* kept for older readers)."""
+    n = stats['n']
+    values = [n]
+    for d in DIMS:
+        s = stats['dims'][d]
+        values += [round(s['sum'] / n, 0) if n else None, s['sum'], s['sumsq'], s['min'], s['max'],
+                   json.dumps({str(k): c for k, c in sorted(s['hist'].items())})]
+    return values
+
+
+def summarize_dim(dim_stats, n):
+    """mean / std / median / min / max of one dimension."""
+    if not n or not dim_stats['hist']:
+        return {'mean': None, 'std': None, 'median': None, 'min': None, 'max': None}
+    mean = dim_stats['sum'] / n
+    var = max(0.0, dim_stats['sumsq'] / n - mean * mean)
+    median = None
+    hist = dim_stats['hist']
+    if hist:
+        half, acc = sum(hist.values()) / 2.0, 0
+        for k in sorted(hist):
+            acc += hist[k]
+            if acc >= half:
+                # Bucket resolution: never report outside the observed range
+                median = min(max(k * HIST_BUCKET_MM, dim_stats['min']), dim_stats['max'])
+                break
+    return {'mean': round(mean, 0), 'std': round(math.sqrt(var), 1), 'median': median,
+            'min': dim_stats['min'], 'max': dim_stats['max']}
+
 class DiscoveryService:
     @staticmethod
     def get_suggested_items(db, train_dir=None, limit=50):
@@ -15,8 +107,8 @@ class DiscoveryService:
         mapped_names = {row['promob_name'] for row in db.execute("SELECT promob_name FROM promob_mappings WHERE target_id IS NOT NULL").fetchall()}
 
         # Fetch from discovered_patterns
-        rows = db.execute('''
-            SELECT name, avg_L, avg_A, avg_P, occurrences 
+        rows = db.execute(f'''
+            SELECT name, {', '.join(PATTERN_STATS_COLUMNS)}
             FROM discovered_patterns 
             WHERE is_reviewed = 0 
             ORDER BY occurrences DESC 
@@ -27,13 +119,16 @@ class DiscoveryService:
         for row in rows:
             if row['name'] in mapped_names:
                 continue
-            results.append({
-                'name': row['name'],
-                'occurrences': row['occurrences'],
-                'avg_L': row['avg_L'],
-                'avg_A': row['avg_A'],
-                'avg_P': row['avg_P']
-            })
+            stats = pattern_from_row(row)
+            item = {'name': row['name'], 'occurrences': row['occurrences']}
+            for d in DIMS:
+                summary = summarize_dim(stats['dims'][d], stats['n'])
+                item[f'avg_{d}'] = row[f'avg_{d}']
+                item[f'median_{d}'] = summary['median'] if summary['median'] is not None else row[f'avg_{d}']
+                item[f'std_{d}'] = summary['std']
+                item[f'min_{d}'] = summary['min']
+                item[f'max_{d}'] = summary['max']
+            results.append(item)
         
         return results
 
@@ -0,0 +1,121 @@
+import base64
+import json
+
+from app.services.search import fts_query, match_clause
+
+# Server-side listing for /api/estoque: column projection, filters, keyset pagination.
+# Every sort is a tuple of SQL expressions ending in id (unique), matching an index from
+# migration 23, so a page is an index range scan: (sort values) > (cursor values) LIMIT n.
+
+ESTOQUE_FIELDS = (
+    'id', 'nome', 'categoria', 'unidade', 'quantidade', 'custo_unitario', 'site_origem', 'is_acessorio',
+    'area_unidade', 'url_madeiranit', 'url_leomadeiras', 'url_madeverde', 'preco_madeiranit',
+    'preco_leomadeiras', 'preco_madeverde', 'price_strategy', 'price_group_id', 'margem_lucro',
+    'preco_venda', 'minimo', 'localizacao', 'last_update',
+)
+
+SORTS = {
+    'nome': ('nome', 'id'),
+    'categoria': ("COALESCE(categoria, '')", 'nome', 'id'),
+    'custo': ('COALESCE(custo_unitario, 0)', 'id'),
+    'quantidade': ('COALESCE(quantidade, 0)', 'id'),
+    'last_update': ("COALESCE(last_update, '')", 'id'),
+}
+
+MAX_LIMIT = 500
+# Same default as the create route / grid highlight
+DEFAULT_MINIMO = 5
+
+
+def parse_fields(raw):
+    if not raw:
+        return list(ESTOQUE_FIELDS)
+    fields = [f.strip() for f in raw.split(',') if f.strip() in ESTOQUE_FIELDS]
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Cursor inválido')
+    return values
+
+
+def _filters(args):
+    where, params = [], []
+    if args.get('categoria'):
+        where.append("COALESCE(categoria, '') = ?")
+        params.append(args['categoria'])
+    if args.get('price_group_id'):
+        where.append('price_group_id = ?')
+        params.append(int(args['price_group_id']))
+    if args.get('is_acessorio') in ('0', '1'):
+        where.append('COALESCE(is_acessorio, 0) = ?')
+        params.append(int(args['is_acessorio']))
+    if args.get('baixo_estoque') == '1':
+        where.append(f'COALESCE(quantidade, 0) < COALESCE(minimo, {DEFAULT_MINIMO})')
+    if args.get('q') and fts_query(args['q']):
+        where.append(match_clause('estoque'))
+        params.append(fts_query(args['q']))
+    return where, params
+
+
+def list_estoque(db, args):
+    """
+    args: request.args-like. Returns the list of rows (legacy, no `limit`) or a page
+    {'items', 'next_cursor', 'total' (first page only)} when `limit` is given.
+    Raises ValueError on bad parameters.
+    """
+    fields = parse_fields(args.get('fields'))
+    sort = args.get('sort') or 'nome'
+    if sort not in SORTS:
+        raise ValueError(f'Ordenação inválida: {sort}')
+    desc = args.get('dir') == 'desc'
+    keys = SORTS[sort]
+    where, params = _filters(args)
+    order = ', '.join(f"{k} {'DESC' if desc else 'ASC'}" for k in keys)
+
+    if not args.get('limit'):
+        sql = f"SELECT {', '.join(fields)} FROM estoque"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return [dict(r) for r in db.execute(f'{sql} ORDER BY {order}', params).fetchall()]
+
+    limit = max(1, min(int(args['limit']), MAX_LIMIT))
+    total = None
+    if not args.get('cursor'):
+        total = db.execute('SELECT COUNT(*) FROM estoque' + (' WHERE ' + ' AND '.join(where) if where else ''), params).fetchone()[0]
+
+    page_where, page_params = list(where), list(params)
+    if args.get('cursor'):
+        values = decode_cursor(args['cursor'], len(keys))
+        # The bound on the leading key alone is what lets SQLite seek the (expression) index;
+        # the row-value comparison then skips the ties already returned
+        page_where.append(f"{keys[0]} {'<=' if desc else '>='} ?")
+        page_where.append(f"({', '.join(keys)}) {'<' if desc else '>'} ({', '.join('?' * len(keys))})")
+        page_params += [values[0]] + values
+
+    # Sort keys come along as extra columns so the next cursor can be built from the last row
+    key_cols = ', '.join(f'{k} AS _k{i}' for i, k in enumerate(keys))
+    sql = f"SELECT {', '.join(fields)}, {key_cols} FROM estoque"
+    if page_where:
+        sql += ' WHERE ' + ' AND '.join(page_where)
+    rows = db.execute(f'{sql} ORDER BY {order} LIMIT ?', page_params + [limit + 1]).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [{f: r[f] for f in fields} for r in rows]
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor([last[f'_k{i}'] for i in range(len(keys))])
+    return {'items': items, 'next_cursor': next_cursor, 'total': total}
@@ -0,0 +1,99 @@
+import math
+
+# Materialized dashboard KPIs. kpi_rollup holds small pre-aggregated counters that SQLite
+# triggers (created by migration 25) keep up to date on every write to contas / orcamentos /
+# estoque (same transaction), so /dashboard and /api/kpis read a handful of rows instead of
+# aggregating the base tables.
+#
+#   metric                      bucket              valor        qtd
+#   contas:<tipo>:<status>      date(vencimento)    SUM(valor)   rows
+#   orcamentos                  ''                  -            rows
+#   orcamentos_cliente          client_id           -            rows (qtd > 0 = distinct clients)
+#   orcamentos_cliente_mes      'YYYY-MM|client_id' -            rows
+#   estoque_critico             ''                  -            rows with 0 < quantidade < 10
+#
+# rebuild() recomputes everything from the base tables (backfill / repair); check() compares
+# the rollup with the raw aggregate queries.
+
+ESTOQUE_CRITICO_MAX = 10
+
+
+def _estoque_critico(row):
+    return f"(COALESCE({row}.quantidade, 0) > 0 AND COALESCE({row}.quantidade, 0) < {ESTOQUE_CRITICO_MAX})"
+
+
+def rebuild(db):
+    """Recomputes every counter from the base tables in one transaction step. The caller commits."""
+    db.execute("DELETE FROM kpi_rollup")
+    db.execute('''
+        INSERT INTO kpi_rollup (metric, bucket, valor, qtd)
+        SELECT 'contas:' || COALESCE(tipo, '') || ':' || COALESCE(status, ''), COALESCE(date(vencimento), ''), SUM(COALESCE(valor, 0)), COUNT(*)
+        FROM contas GROUP BY 1, 2
+    ''')
+    db.execute("INSERT INTO kpi_rollup (metric, bucket, qtd) SELECT 'orcamentos', '', COUNT(*) FROM orcamentos")
+    db.execute('''
+        INSERT INTO kpi_rollup (metric, bucket, qtd)
+        SELECT 'orcamentos_cliente', COALESCE(client_id, ''), COUNT(*) FROM orcamentos GROUP BY 2
+    ''')
+    db.execute('''
+        INSERT INTO kpi_rollup (metric, bucket, qtd)
+        SELECT 'orcamentos_cliente_mes', COALESCE(strftime('%Y-%m', created_at), '') || '|' || COALESCE(client_id, ''), COUNT(*)
+        FROM orcamentos GROUP BY 2
+    ''')
+    db.execute(f'''
+        INSERT INTO kpi_rollup (metric, bucket, qtd)
+        SELECT 'estoque_critico', '', COUNT(*) FROM estoque WHERE {_estoque_critico('estoque')}
+    ''')
+
+
+def _sum(db, sql, params=()):
+    row = db.execute(sql, params).fetchone()
+    return row[0] or 0
+
+
+def read_kpis(db):
+    """Dashboard counters from kpi_rollup (each one is a primary-key lookup or a short range)."""
+    mes = db.execute("SELECT strftime('%Y-%m', 'now')").fetchone()[0]
+    return {
+        # receber with vencimento in the current month (any status)
+        'faturamento_mes': round(_sum(db, '''
+            SELECT SUM(valor) FROM kpi_rollup
+            WHERE metric >= 'contas:receber:' AND metric < 'contas:receber;'
+              AND bucket >= date('now', 'start of month') AND bucket < date('now', 'start of month', '+1 month')
+        '''), 2),
+        'contas_vencidas': round(_sum(db, '''
+            SELECT SUM(valor) FROM kpi_rollup WHERE metric = 'contas:pagar:pendente' AND bucket != '' AND bucket < date('now')
+        '''), 2),
+        'contas_pendentes': round(_sum(db, "SELECT SUM(valor) FROM kpi_rollup WHERE metric = 'contas:pagar:pendente'"), 2),
+        'orcamentos_total': _sum(db, "SELECT qtd FROM kpi_rollup WHERE metric = 'orcamentos' AND bucket = ''"),
+        'clientes_total': _sum(db, "SELECT COUNT(*) FROM kpi_rollup WHERE metric = 'orcamentos_cliente' AND bucket != '' AND qtd > 0"),
+        'clientes_novos': _sum(db, '''
+            SELECT COUNT(*) FROM kpi_rollup
+            WHERE metric = 'orcamentos_cliente_mes' AND bucket > ? AND bucket < ? AND qtd > 0
+        ''', (f'{mes}|', f'{mes}}}')),
+        'estoque_critico': _sum(db, "SELECT qtd FROM kpi_rollup WHERE metric = 'estoque_critico' AND bucket = ''"),
+    }
+
+
+def raw_kpis(db):
+    """The same counters straight from the base tables (consistency check / reference)."""
+    return {
+        'faturamento_mes': round(_sum(db, '''
+            SELECT SUM(valor) FROM contas WHERE tipo = 'receber'
+              AND date(vencimento) >= date('now', 'start of month') AND date(vencimento) < date('now', 'start of month', '+1 month')
+        '''), 2),
+        'contas_vencidas': round(_sum(db, '''
+            SELECT SUM(valor) FROM contas WHERE tipo = 'pagar' AND status = 'pendente' AND date(vencimento) < date('now')
+        '''), 2),
+        'contas_pendentes': round(_sum(db, "SELECT SUM(valor) FROM contas WHERE tipo = 'pagar' AND status = 'pendente'"), 2),
+        'orcamentos_total': _sum(db, "SELECT COUNT(*) FROM orcamentos"),
+        'clientes_total': _sum(db, "SELECT COUNT(DISTINCT client_id) FROM orcamentos"),
+        'clientes_novos': _sum(db, "SELECT COUNT(DISTINCT client_id) FROM orcamentos WHERE strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now')"),
+        'estoque_critico': _sum(db, f"SELECT COUNT(*) FROM estoque WHERE {_estoque_critico('estoque')}"),
+    }
+
+
+def check(db, tolerance=0.01):
+    """{kpi: (rollup, raw)} for every counter that drifted from the base tables (empty = consistent)."""
+    rollup, raw = read_kpis(db), raw_kpis(db)
+    return {k: (rollup[k], raw[k]) for k in raw if not math.isclose(rollup[k], raw[k], abs_tol=tolerance)}
@@ -0,0 +1,74 @@
+import calendar
+from datetime import date
+
+# Contas (ledger) writes for a billed orçamento. Installment due dates step by calendar month
+# from the billing date (day clamped to the month's last day: 31/01 -> 28/02 -> 31/03), the
+# amounts are split in cents so they add up exactly to the balance, and the down payment plus
+# every installment go to contas in one executemany.
+
+CATEGORIAS_VENDA = ('venda_entrada', 'venda_parcela')
+
+INSERT_CONTA_SQL = '''
+    INSERT INTO contas (tipo, descricao, valor, vencimento, status, categoria, orcamento_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def step_months(d, months, day=None):
+    """Same day `months` calendar months from d (clamped to the month's last day)."""
+    total = d.year * 12 + d.month - 1 + months
+    year, month = total // 12, total % 12 + 1
+    return date(year, month, min(day or d.day, calendar.monthrange(year, month)[1]))
+
+
+def split_amount(total, parcelas):
+    """total split in `parcelas` values rounded to cents; the last one takes the remainder."""
+    cents = round(total * 100)
+    base = cents // parcelas
+    return [base / 100] * (parcelas - 1) + [(cents - base * (parcelas - 1)) / 100]
+
+
+def installment_schedule(saldo, parcelas, inicio):
+    """[(numero, vencimento, valor), ...]: first installment one month after inicio."""
+    valores = split_amount(saldo, parcelas)
+    return [(i + 1, step_months(inicio, i + 1), valor) for i, valor in enumerate(valores)]
+
+
+def is_billed(db, orcamento_id):
+    row = db.execute(f'''
+        SELECT 1 FROM contas
+        WHERE orcamento_id = ? AND categoria IN ({', '.join('?' * len(CATEGORIAS_VENDA))})
+        LIMIT 1
+    ''', (orcamento_id, *CATEGORIAS_VENDA)).fetchone()
+    return row is not None
+
+
+def bill_orcamento(db, orc, metodo, entrada, parcelas, hoje=None):
+    """
+    Writes the down payment (paid today) and the installment schedule of an orçamento.
+    Returns the payment info stored in orcamentos.pagamento_json. The caller commits.
+    """
+    if parcelas < 1:
+        raise ValueError('Número de parcelas inválido')
+    if entrada < 0 or entrada > (orc['total'] or 0):
+        raise ValueError('Valor de entrada inválido')
+    hoje = hoje or date.today()
+    saldo = round((orc['total'] or 0) - entrada, 2)
+
+    rows = []
+    if entrada > 0:
+        rows.append(('receber', f"Entrada Orç. #{orc['id']} - {orc['client']}", entrada, hoje.isoformat(),
+                     'pago', 'venda_entrada', orc['id']))
+    schedule = installment_schedule(saldo, parcelas, hoje) if saldo > 0 else []
+    rows += [('receber', f"Parc. {n}/{parcelas} Orç. #{orc['id']} ({metodo})", valor, venc.isoformat(),
+              'pendente', 'venda_parcela', orc['id']) for n, venc, valor in schedule]
+    if rows:
+        db.executemany(INSERT_CONTA_SQL, rows)
+
+    return {
+        'metodo': metodo,
+        'entrada': entrada,
+        'parcelas': parcelas,
+        'valor_parcela': schedule[0][2] if schedule else 0,
+        'vencimentos': [venc.isoformat() for _, venc, _ in schedule],
+    }
@@ -0,0 +1,149 @@
+import json
+
+# Normalized storage for the budget items (orcamento_ambientes / orcamento_itens).
+# orcamentos.itens_json stays as the editor document (the frontend reloads it as-is);
+# server-side readers and reports use these tables and the stored counters instead.
+
+INSERT_AMBIENTE_SQL = '''
+    INSERT INTO orcamento_ambientes (orcamento_id, posicao, codigo, nome, ambiente, material, quantidade, imagem_url)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_ITEM_SQL = '''
+    INSERT INTO orcamento_itens (orcamento_id, ambiente_id, posicao, catalogo_id, nome, descricao,
+                                 largura, altura, profundidade, complexidade, horas_mo, subtotal, preco_final)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _num(value, default=None):
+    try:
+        return float(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _first(item, *keys):
+    for key in keys:
+        if item.get(key) not in (None, ''):
+            return item[key]
+    return None
+
+
+def normalize_itens(raw):
+    """
+    Accepts both legacy formats and returns a list of groups:
+      - list of groups: [{'name': 'Sala', 'qty': 1, 'items': [...]}, ...]
+      - flat list of items: [{...}, {...}]  -> single 'Geral' group
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw) if raw else []
+        except ValueError:
+            return []
+    if not isinstance(raw, list) or not raw:
+        return []
+
+    if isinstance(raw[0], dict) and 'items' in raw[0]:
+        groups = [g for g in raw if isinstance(g, dict)]
+    else:
+        groups = [{'name': 'Geral', 'items': raw}]
+
+    result = []
+    for g in groups:
+        result.append({
+            'code': g.get('code'),
+            'name': g.get('name'),
+            'ambient': g.get('ambient'),
+            'material': g.get('material'),
+            'qty': _num(g.get('qty'), 1) or 1,
+            'imagem_url': g.get('imagem_url'),
+            'items': [it for it in (g.get('items') or []) if isinstance(it, dict)],
+        })
+    return result
+
+
+def sync_orcamento_itens(db, orcamento_id, raw):
+    """
+    Rewrites the normalized rows of one budget and its stored counters.
+    Runs on the caller's connection: the caller commits together with the orcamentos write.
+    """
+    groups = normalize_itens(raw)
+
+    db.execute('DELETE FROM orcamento_itens WHERE orcamento_id = ?', (orcamento_id,))
+    db.execute('DELETE FROM orcamento_ambientes WHERE orcamento_id = ?', (orcamento_id,))
+
+    itens_count = 0
+    valor_itens = 0.0
+    for g_pos, g in enumerate(groups):
+        cur = db.execute(INSERT_AMBIENTE_SQL, (
+            orcamento_id, g_pos, g['code'], g['name'], g['ambient'], g['material'], g['qty'], g['imagem_url']))
+        ambiente_id = cur.lastrowid
+
+        rows = []
+        for i_pos, it in enumerate(g['items']):
+            subtotal = _num(_first(it, 'subtotal', 'preco_final', 'custo'), 0.0)
+            rows.append((
+                orcamento_id, ambiente_id, i_pos,
+                _first(it, 'catalogo_id'),
+                _first(it, 'nome'),
+                _first(it, 'descricao'),
+                _num(_first(it, 'L', 'largura')),
+                _num(_first(it, 'A', 'altura')),
+                _num(_first(it, 'P', 'profundidade')),
+                _num(_first(it, 'complex'), 1.0),
+                _num(_first(it, 'horas_mo'), 0.0),
+                subtotal,
+                _num(_first(it, 'preco_final')),
+            ))
+            valor_itens += subtotal * g['qty']
+        db.executemany(INSERT_ITEM_SQL, rows)
+        itens_count += len(rows)
+
+    db.execute('UPDATE orcamentos SET itens_count = ?, ambientes_count = ?, valor_itens = ? WHERE id = ?',
+               (itens_count, len(groups), round(valor_itens, 2), orcamento_id))
+    return itens_count
+
+
+def delete_orcamento_itens(db, orcamento_id):
+    db.execute('DELETE FROM orcamento_itens WHERE orcamento_id = ?', (orcamento_id,))
+    db.execute('DELETE FROM orcamento_ambientes WHERE orcamento_id = ?', (orcamento_id,))
+
+
+def load_groups(db, orcamento_id):
+    """
+    Rebuilds the groups of a budget from the normalized tables (two indexed queries, no JSON parsing).
+    Items carry both the editor keys (L/A/P, subtotal) and the legacy ones (largura/altura/profundidade).
+    """
+    ambientes = db.execute('''
+        SELECT id, codigo, nome, ambiente, material, quantidade, imagem_url
+        FROM orcamento_ambientes WHERE orcamento_id = ? ORDER BY posicao
+    ''', (orcamento_id,)).fetchall()
+    itens = db.execute('''
+        SELECT ambiente_id, catalogo_id, nome, descricao, largura, altura, profundidade,
+               complexidade, horas_mo, subtotal, preco_final
+        FROM orcamento_itens WHERE orcamento_id = ? ORDER BY ambiente_id, posicao
+    ''', (orcamento_id,)).fetchall()
+
+    by_ambiente = {}
+    for row in itens:
+        item = {k: row[k] for k in row.keys() if k != 'ambiente_id' and row[k] is not None}
+        item['L'] = row['largura']
+        item['A'] = row['altura']
+        item['P'] = row['profundidade']
+        by_ambiente.setdefault(row['ambiente_id'], []).append(item)
+
+    groups = []
+    for a in ambientes:
+        items = by_ambiente.get(a['id'], [])
+        groups.append({
+            'code': a['codigo'],
+            'name': a['nome'],
+            'ambient': a['ambiente'],
+            'material': a['material'],
+            'qty': a['quantidade'],
+            'imagem_url': a['imagem_url'],
+            'subtotal': sum(it.get('subtotal') or 0 for it in items),
+            'items': items,
+        })
+    return groups
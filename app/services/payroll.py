@@ -0,0 +1,185 @@
+import json
+from datetime import date, datetime
+
+# Payroll (holerite) engine. One month's inputs are loaded with a few set-based queries
+# (active employees, vales, pending balances, payslips already paid), every payslip is
+# computed in memory and finalizing writes holerites_pagos / contas / funcionario_saldos
+# for the whole batch in a single transaction. The single-employee endpoints use the same
+# path with ids=[id].
+
+DEFAULT_INSS = 0.11
+DEFAULT_FGTS = 0.08
+
+
+def month_bounds(month):
+    """'YYYY-MM' -> ('YYYY-MM-01', first day of the next month), for range predicates."""
+    try:
+        first = datetime.strptime(month, '%Y-%m').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'Mês inválido: {month}')
+    nxt = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return first.isoformat(), nxt.isoformat()
+
+
+def _in_clause(column, ids):
+    if ids is None:
+        return '', []
+    return f" AND {column} IN ({', '.join('?' * len(ids))})", list(ids)
+
+
+def load_month(db, month, ids=None):
+    """
+    Inputs for every employee active in `month` (optionally restricted to ids):
+    {funcionario_id: {'func': row, 'vales': float, 'saldo_devedor': float, 'pago': row | None, 'ponto': dict | None}}.
+    """
+    inicio, fim = month_bounds(month)
+    where, params = _in_clause('f.id', ids)
+    # Active in the month: hired before it ends and not dismissed before it starts
+    funcs = db.execute(f'''
+        SELECT f.* FROM funcionarios f
+        WHERE EXISTS (
+            SELECT 1 FROM funcionario_periodos p
+            WHERE p.funcionario_id = f.id AND p.data_contratacao < ?
+              AND (p.data_demissao IS NULL OR p.data_demissao = '' OR p.data_demissao >= ?)
+        ){where}
+        ORDER BY f.nome
+    ''', [fim, inicio] + params).fetchall()
+    if not funcs:
+        return {}
+    func_ids = [f['id'] for f in funcs]
+    where, params = _in_clause('funcionario_id', func_ids)
+
+    vales = dict(db.execute(f'''
+        SELECT funcionario_id, SUM(valor) FROM contas
+        WHERE vencimento >= ? AND vencimento < ? AND categoria = 'vale_funcionario'{where}
+        GROUP BY funcionario_id
+    ''', [inicio, fim] + params).fetchall())
+    saldos = dict(db.execute(f'''
+        SELECT funcionario_id, SUM(valor) FROM funcionario_saldos
+        WHERE status = 'pendente' AND mes_origem < ?{where}
+        GROUP BY funcionario_id
+    ''', [month] + params).fetchall())
+    pagos = {r['funcionario_id']: r for r in db.execute(f'''
+        SELECT funcionario_id, valor_pago, data_pagamento FROM holerites_pagos
+        WHERE mes_referencia = ?{where}
+    ''', [month] + params).fetchall()}
+    # Minutes stored per day at ponto import (range scan on idx_ponto_data)
+    ponto = {r['funcionario_id']: dict(r) for r in db.execute(f'''
+        SELECT funcionario_id,
+               SUM(trabalhado_minutos) AS trabalhado_minutos,
+               SUM(extras_minutos) AS extras_minutos,
+               SUM(atrasos_minutos) AS atrasos_minutos,
+               SUM(status = 'Falta') AS faltas
+        FROM ponto_registros
+        WHERE data >= ? AND data < ?{where}
+        GROUP BY funcionario_id
+    ''', [inicio, fim] + params).fetchall()}
+
+    return {f['id']: {'func': f, 'vales': vales.get(f['id']) or 0.0, 'saldo_devedor': saldos.get(f['id']) or 0.0,
+                      'pago': pagos.get(f['id']), 'ponto': ponto.get(f['id'])} for f in funcs}
+
+
+def compute_payslip(func, vales, saldo_devedor, month, pago=None, ponto=None):
+    """
+    Payslip for one employee (same fields /api/holerite/<id> has always returned, plus the
+    month's ponto totals for reference; they don't change the amounts).
+    """
+    salario_base = func['salario_base'] or 0.0
+    inss_percent = func['inss_percent'] if func['inss_percent'] else DEFAULT_INSS
+    inss_val = salario_base * inss_percent
+    fgts_val = salario_base * (func['fgts_percent'] if func['fgts_percent'] else DEFAULT_FGTS)
+
+    descontos_list = json.loads(func['descontos_json']) if func['descontos_json'] else []
+    total_descontos = inss_val + vales + saldo_devedor + sum(d.get('valor', 0) for d in descontos_list)
+
+    return {
+        'funcionario_id': func['id'],
+        'funcionario': func['nome'],
+        'referencia': month,
+        'salario_base': salario_base,
+        'inss_percent': inss_percent,
+        'inss_val': inss_val,
+        'fgts_val': fgts_val,
+        'vales_val': vales,
+        'saldo_devedor_anterior': saldo_devedor,
+        'outros_descontos': descontos_list,
+        'liquido': max(0, salario_base - total_descontos),
+        'status_pagamento': 'Pago' if pago else 'Pendente',
+        'pago_em': pago['data_pagamento'] if pago else None,
+        # Discounts above the salary become a pending balance for the next month when finalized
+        'excedente_para_proximo': max(0, total_descontos - salario_base),
+        'ponto': {
+            'trabalhado_minutos': (ponto or {}).get('trabalhado_minutos') or 0,
+            'extras_minutos': (ponto or {}).get('extras_minutos') or 0,
+            'atrasos_minutos': (ponto or {}).get('atrasos_minutos') or 0,
+            'faltas': (ponto or {}).get('faltas') or 0,
+        },
+    }
+
+
+def calculate(db, month, ids=None):
+    """{funcionario_id: payslip} for the month."""
+    return {fid: compute_payslip(d['func'], d['vales'], d['saldo_devedor'], month, d['pago'], d['ponto'])
+            for fid, d in load_month(db, month, ids).items()}
+
+
+def run_payroll(db, month, ids=None, dry_run=True, pay_date=None):
+    """
+    Computes every payslip of the month and, unless dry_run, finalizes the pending ones in one
+    transaction: holerites_pagos row, a paid 'pagamento_salario' conta for the net amount,
+    previous balances marked compensado and a new balance for any excess discount.
+    Returns {'month', 'dry_run', 'resultados': [per employee], 'totais': {...}}.
+    """
+    pay_date = pay_date or date.today().isoformat()
+    if not dry_run and not db.in_transaction:
+        # Read and write under the same write lock: a concurrent run can't pay the same slip twice
+        db.execute("BEGIN IMMEDIATE")
+    try:
+        slips = calculate(db, month, ids)
+        pending = [s for s in slips.values() if s['status_pagamento'] == 'Pendente']
+
+        if not dry_run and pending:
+            db.executemany('INSERT INTO holerites_pagos (funcionario_id, mes_referencia, valor_pago, data_pagamento) VALUES (?, ?, ?, ?)',
+                           [(s['funcionario_id'], month, s['liquido'], pay_date) for s in pending])
+            db.executemany('''
+                INSERT INTO contas (tipo, descricao, valor, vencimento, status, categoria, funcionario_id)
+                VALUES ('pagar', ?, ?, ?, 'pago', 'pagamento_salario', ?)
+            ''', [(f"Salário {month} - {s['funcionario']}", s['liquido'], pay_date, s['funcionario_id'])
+                  for s in pending if s['liquido'] > 0])
+            db.executemany("UPDATE funcionario_saldos SET status = 'compensado' WHERE funcionario_id = ? AND mes_origem < ?",
+                           [(s['funcionario_id'], month) for s in pending])
+            db.executemany('INSERT INTO funcionario_saldos (funcionario_id, valor, mes_origem) VALUES (?, ?, ?)',
+                           [(s['funcionario_id'], s['excedente_para_proximo'], month)
+                            for s in pending if s['excedente_para_proximo'] > 0])
+        if not dry_run:
+            db.commit()
+    except Exception:
+        if not dry_run:
+            db.rollback()
+        raise
+
+    resultados = []
+    for s in slips.values():
+        ja_pago = s['status_pagamento'] == 'Pago'
+        resultados.append({
+            'funcionario_id': s['funcionario_id'],
+            'funcionario': s['funcionario'],
+            'status': 'ja_pago' if ja_pago else ('previa' if dry_run else 'finalizado'),
+            'liquido': round(s['liquido'], 2),
+            'descontos': round(s['inss_val'] + s['vales_val'] + s['saldo_devedor_anterior']
+                               + sum(d.get('valor', 0) for d in s['outros_descontos']), 2),
+            'excedente_para_proximo': round(s['excedente_para_proximo'], 2),
+            'pago_em': s['pago_em'] if ja_pago else (None if dry_run else pay_date),
+        })
+    return {
+        'month': month,
+        'dry_run': dry_run,
+        'resultados': resultados,
+        'totais': {
+            'funcionarios': len(slips),
+            'pendentes': len(pending),
+            'ja_pagos': len(slips) - len(pending),
+            'liquido': round(sum(s['liquido'] for s in pending), 2),
+            'excedentes': round(sum(s['excedente_para_proximo'] for s in pending), 2),
+        },
+    }
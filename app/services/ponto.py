@@ -0,0 +1,303 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+# Time-clock (ponto) spreadsheet import. The clock exports one sheet where every employee is a
+# 15-column block: name at row 2 / block col 9, period at row 3 / block col 3, one row per day
+# from row 10 on ("01 QUA" in block col 0) with the punches in block cols 1, 3, 6 and 8.
+# The workbook is read once, converted to a string matrix once and each block is sliced with
+# array operations; all days go to ponto_registros in one executemany upsert.
+# Worked / overtime / late minutes are computed once per day at import (compute_day) and stored
+# as integers next to the raw punches, so summaries and payroll never re-parse the strings.
+
+BLOCK_SIZE = 15
+NAME_CELL = (2, 9)
+PERIOD_CELL = (3, 3)
+FIRST_DAY_ROW, LAST_DAY_ROW = 10, 50
+PUNCH_COLS = (1, 3, 6, 8)  # entrada_1, saida_1, entrada_2, saida_2
+PREFERRED_SHEET = '1.2.3'
+
+UPSERT_PONTO_SQL = '''
+    INSERT INTO ponto_registros (funcionario_id, data, entrada_1, saida_1, entrada_2, saida_2,
+                                 trabalhado_minutos, extras_minutos, atrasos_minutos, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(funcionario_id, data) DO UPDATE SET
+        entrada_1 = excluded.entrada_1, saida_1 = excluded.saida_1,
+        entrada_2 = excluded.entrada_2, saida_2 = excluded.saida_2,
+        trabalhado_minutos = excluded.trabalhado_minutos, extras_minutos = excluded.extras_minutos,
+        atrasos_minutos = excluded.atrasos_minutos, status = excluded.status
+'''
+
+# Expected schedule (settings ponto_jornada / ponto_jornada_sabado, 'HH:MM-HH:MM,HH:MM-HH:MM');
+# Sunday, a Saturday without schedule and holidays (setting ponto_feriados, 'YYYY-MM-DD' or
+# yearly 'MM-DD', comma separated) are days off: every minute worked is overtime
+DEFAULT_JORNADA = '07:00-12:00,14:00-18:00'
+# Deviations up to this many minutes a day are not counted (CLT art. 58 §1)
+DEFAULT_TOLERANCIA = 10
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_hhmm(value):
+    """'07:12' (or '07:12:00') -> minutes since midnight; None when it isn't a time."""
+    if not value:
+        return None
+    try:
+        h, m = value.strip().split(':')[:2]
+        h, m = int(h), int(m)
+    except ValueError:
+        return None
+    return h * 60 + m if 0 <= h < 24 and 0 <= m < 60 else None
+
+
+def _parse_periods(text):
+    periods = []
+    for part in (text or '').split(','):
+        if '-' not in part:
+            continue
+        start, end = (parse_hhmm(v) for v in part.split('-', 1))
+        if start is not None and end is not None:
+            periods.append((start, end))
+    return periods
+
+
+class Jornada:
+    """Expected work periods per weekday (minutes), holidays and the daily tolerance."""
+
+    def __init__(self, semana=DEFAULT_JORNADA, sabado='', tolerancia=DEFAULT_TOLERANCIA, feriados=''):
+        weekday = _parse_periods(semana)
+        self.by_weekday = [weekday] * 5 + [_parse_periods(sabado), []]
+        self.tolerancia = int(tolerancia)
+        self.feriados = {f.strip() for f in (feriados or '').split(',') if f.strip()}
+
+    @classmethod
+    def from_settings(cls, db):
+        rows = db.execute("SELECT key, value FROM settings WHERE key LIKE 'ponto_%'").fetchall()
+        conf = {r['key']: r['value'] for r in rows if r['value'] not in (None, '')}
+        return cls(conf.get('ponto_jornada', DEFAULT_JORNADA), conf.get('ponto_jornada_sabado', ''),
+                   conf.get('ponto_tolerancia_minutos', DEFAULT_TOLERANCIA), conf.get('ponto_feriados', ''))
+
+    def periods(self, day):
+        if day in self.feriados or (day or '')[5:] in self.feriados:
+            return []
+        try:
+            weekday = datetime.strptime(day, '%Y-%m-%d').weekday()
+        except (TypeError, ValueError):
+            weekday = 0
+        return self.by_weekday[weekday]
+
+
+def compute_day(day, punches, jornada, employed=True):
+    """
+    (trabalhado, extras, atrasos, status) for one day from its four punch strings.
+    A day without punches is a Falta only on a scheduled day inside an employment period
+    (employed); outside one it is 'Sem registro', on a day off 'Folga'.
+    The clock sometimes shifts punches to the wrong column, so the times present are paired in
+    order (entrada, saida, entrada, saida); a saida before its entrada crossed midnight. Late
+    minutes are each entrada after the start of the matching scheduled period (and before its end).
+    """
+    times = [t for t in (parse_hhmm(p) for p in punches) if t is not None]
+    periods = jornada.periods(day)
+    expected = sum(end - start for start, end in periods)
+    if not times:
+        if not employed:
+            return 0, 0, 0, 'Sem registro'
+        return 0, 0, 0, 'Falta' if expected else 'Folga'
+
+    trabalhado, atrasos = 0, 0
+    for i in range(0, len(times), 2):
+        entrada = times[i]
+        if i + 1 < len(times):
+            trabalhado += (times[i + 1] - entrada) % MINUTES_PER_DAY
+        if i // 2 < len(periods):
+            start, end = periods[i // 2]
+            if start < entrada < end:
+                atrasos += entrada - start
+
+    extras = trabalhado - expected if trabalhado - expected > jornada.tolerancia else 0
+    if atrasos <= jornada.tolerancia:
+        atrasos = 0
+    return trabalhado, extras, atrasos, 'Presente'
+
+
+def read_sheet(filepath):
+    """The attendance sheet as a DataFrame (the file is opened once)."""
+    import pandas as pd
+    with pd.ExcelFile(filepath) as xls:
+        sheet = PREFERRED_SHEET if PREFERRED_SHEET in xls.sheet_names else xls.sheet_names[0]
+        return xls.parse(sheet, header=None)
+
+
+def _cell_matrix(df):
+    """str() of every cell, stripped, padded with 'nan' to whole blocks."""
+    cells = np.char.strip(df.astype(str).to_numpy(dtype=str))
+    pad = (-cells.shape[1]) % BLOCK_SIZE
+    if pad:
+        cells = np.pad(cells, ((0, 0), (0, pad)), constant_values='nan')
+    return cells
+
+
+def _month_prefix(cells, start_col, filename):
+    # Period cell 'YYYY/MM...' of the block, else the export's file name (001_2025_1_MON.XLS), else now
+    try:
+        period_str = cells[PERIOD_CELL[0], start_col + PERIOD_CELL[1]]
+        return f"{int(period_str[0:4])}-{int(period_str[5:7]):02d}"
+    except (IndexError, ValueError):
+        try:
+            parts = filename.split('_')
+            return f"{parts[1]}-{int(parts[2]):02d}"
+        except (IndexError, ValueError):
+            return datetime.now().strftime('%Y-%m')
+
+
+def parse_blocks(df, filename):
+    """[(employee name, [(data, entrada_1, saida_1, entrada_2, saida_2), ...]), ...] in sheet order."""
+    cells = _cell_matrix(df)
+    n_rows, n_cols = df.shape
+    rows = slice(FIRST_DAY_ROW, min(LAST_DAY_ROW, n_rows))
+    blocks = []
+    for start_col in range(0, n_cols, BLOCK_SIZE):
+        if start_col + NAME_CELL[1] >= n_cols:
+            break
+        emp_name = str(cells[NAME_CELL[0], start_col + NAME_CELL[1]])
+        if emp_name == 'nan':
+            continue
+
+        days = cells[rows, start_col]
+        # Day rows start with a digit and carry the weekday after a space ("01 QUA")
+        is_day = np.char.isdigit(days.astype('U1')) & (np.char.find(days, ' ') >= 0)
+        day_strs = np.char.partition(days[is_day], ' ')[:, 0]
+        punches = cells[rows][is_day][:, [start_col + c for c in PUNCH_COLS]]
+        punches = np.where(np.char.find(punches, ':') >= 0, punches, None)
+
+        prefix = _month_prefix(cells, start_col, filename)
+        blocks.append((emp_name, [(f"{prefix}-{day}", *row) for day, row in zip(day_strs.tolist(), punches.tolist())]))
+    return blocks
+
+
+def _ascii_lower(text):
+    # SQLite LIKE folds ASCII letters only
+    return ''.join(c.lower() if c.isascii() else c for c in text)
+
+
+class EmployeeResolver:
+    """
+    Clock name -> funcionario id from one query: first employee (by id) whose nome_ponto is the
+    name or whose nome contains it (same rule the importer always used with nome LIKE %name%).
+    """
+
+    def __init__(self, db):
+        self.funcs = [dict(r) for r in db.execute("SELECT id, nome, nome_ponto FROM funcionarios ORDER BY id")]
+        self._cache = {}
+
+    def resolve(self, name):
+        if name not in self._cache:
+            needle = _ascii_lower(name)
+            self._cache[name] = next((f['id'] for f in self.funcs
+                                      if f['nome_ponto'] == name or needle in _ascii_lower(f['nome'] or '')), None)
+        return self._cache[name]
+
+    def learn(self, func_id, name):
+        """Stores the clock name on employees that don't have one yet; returns True if it changed."""
+        for f in self.funcs:
+            if f['id'] == func_id and not f['nome_ponto']:
+                f['nome_ponto'] = name
+                self._cache.clear()
+                return True
+        return False
+
+
+def load_periods(db, funcionario_id=None):
+    """{funcionario_id: [(data_contratacao, data_demissao or None), ...]} from funcionario_periodos."""
+    sql = "SELECT funcionario_id, data_contratacao, data_demissao FROM funcionario_periodos"
+    params = ()
+    if funcionario_id:
+        sql += " WHERE funcionario_id = ?"
+        params = (funcionario_id,)
+    periods = {}
+    for r in db.execute(sql, params):
+        periods.setdefault(r['funcionario_id'], []).append((r['data_contratacao'], r['data_demissao'] or None))
+    return periods
+
+
+def is_employed(periods, day):
+    """Same rule as payroll: hired on or before the day and not dismissed before it."""
+    return any(inicio and inicio[:10] <= day and (not fim or fim[:10] >= day) for inicio, fim in periods)
+
+
+def import_ponto(db, filepath, filename=None):
+    """Parses one export and upserts every day. Returns the log lines. The caller commits."""
+    blocks = parse_blocks(read_sheet(filepath), filename or os.path.basename(filepath))
+    resolver = EmployeeResolver(db)
+    jornada = Jornada.from_settings(db)
+    periods = load_periods(db)
+    logs, records, learned = [], [], []
+    for emp_name, days in blocks:
+        func_id = resolver.resolve(emp_name)
+        if func_id is None:
+            logs.append(f"Funcionario não encontrado: {emp_name}")
+            continue
+        if resolver.learn(func_id, emp_name):
+            learned.append((emp_name, func_id))
+        emp = periods.get(func_id, [])
+        records += [(func_id, *day, *compute_day(day[0], day[1:], jornada, is_employed(emp, day[0]))) for day in days]
+        logs.append(f"Processado: {emp_name}")
+
+    if learned:
+        db.executemany("UPDATE funcionarios SET nome_ponto = ? WHERE id = ? AND (nome_ponto IS NULL OR nome_ponto = '')", learned)
+    if records:
+        db.executemany(UPSERT_PONTO_SQL, records)
+    return logs
+
+
+def recompute(db, inicio=None, fim=None, funcionario_id=None):
+    """Recomputes the stored minutes (after a schedule change / for old rows). Returns rows updated."""
+    where, params = [], []
+    if inicio:
+        where.append('data >= ?')
+        params.append(inicio)
+    if fim:
+        where.append('data < ?')
+        params.append(fim)
+    if funcionario_id:
+        where.append('funcionario_id = ?')
+        params.append(funcionario_id)
+    sql = "SELECT id, funcionario_id, data, entrada_1, saida_1, entrada_2, saida_2 FROM ponto_registros"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    jornada = Jornada.from_settings(db)
+    periods = load_periods(db, funcionario_id)
+    updates = [(*compute_day(r['data'], (r['entrada_1'], r['saida_1'], r['entrada_2'], r['saida_2']), jornada,
+                             is_employed(periods.get(r['funcionario_id'], []), r['data'])), r['id'])
+               for r in db.execute(sql, params).fetchall()]
+    db.executemany('''
+        UPDATE ponto_registros SET trabalhado_minutos = ?, extras_minutos = ?, atrasos_minutos = ?, status = ? WHERE id = ?
+    ''', updates)
+    return len(updates)
+
+
+def monthly_summary(db, inicio, fim, funcionario_id=None):
+    """Per employee totals for [inicio, fim), from the stored minutes (range scan on data)."""
+    where, params = ['p.data >= ?', 'p.data < ?'], [inicio, fim]
+    if funcionario_id:
+        where.append('p.funcionario_id = ?')
+        params.append(funcionario_id)
+    rows = db.execute(f'''
+        SELECT p.funcionario_id, f.nome,
+               SUM(p.status = 'Presente') AS dias_trabalhados,
+               SUM(p.status = 'Falta') AS faltas,
+               SUM(p.trabalhado_minutos) AS trabalhado_minutos,
+               SUM(p.extras_minutos) AS extras_minutos,
+               SUM(p.atrasos_minutos) AS atrasos_minutos
+        FROM ponto_registros p
+        JOIN funcionarios f ON f.id = p.funcionario_id
+        WHERE {' AND '.join(where)}
+        GROUP BY p.funcionario_id
+        ORDER BY f.nome
+    ''', params).fetchall()
+    return [dict(r) for r in rows]
+
+
+def format_minutes(minutes):
+    minutes = int(minutes or 0)
+    return f"{minutes // 60}:{minutes % 60:02d}"
@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import time
+
+from app.database import db_pool
+from app.services.promob_parser import file_hash, get_cached_parse
+from app.services.promob_service import PromobService
+
+# Background Promob imports: the upload request only saves the file and enqueues a row in
+# promob_import_jobs; a worker thread per gunicorn process claims queued jobs (atomic UPDATE,
+# so any process can run any job), parses with progress updates and stores the mapped result.
+# Clients poll /api/orcamentos/import-promob/<id>.
+
+JOB_POLL_INTERVAL_S = 2.0
+JOB_PROGRESS_EVERY_S = 0.5
+# A running job whose heartbeat is older than this was lost (worker restarted): requeue it
+JOB_STALE_AFTER_S = 300
+
+# Progress split: ambient3d scan is the bulk of the work
+PROGRESS_PARSE_START = 5
+PROGRESS_PARSE_END = 90
+
+CLAIMABLE_WHERE = "(status = 'queued' OR (status = 'running' AND updated_at < datetime('now', ?)))"
+
+
+def _partial_summary(result, preview=50):
+    return {
+        'client': result.get('client'),
+        'modules': [m['raw_name'] for m in (result.get('modules') or [])[:preview]],
+        'modules_found': len(result.get('modules') or []),
+        'vip_found': len(result.get('vip') or []),
+        'materials_found': len(result.get('materials') or []),
+    }
+
+
+class PromobImportQueue:
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {'submitted': 0, 'cache_hits': 0, 'completed': 0, 'failed': 0}
+
+    def _ensure_thread(self):
+        # Started lazily so each gunicorn worker (post-fork) gets its own runner
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='PromobImportWorker')
+            self._thread.start()
+
+    def submit(self, db, user_id, filepath, original_name):
+        """
+        Called from the upload request. Returns (job_id, mapped_data):
+        mapped_data is ready immediately when the same file content was parsed before.
+        """
+        digest = file_hash(filepath)
+        with self._lock:
+            self._stats['submitted'] += 1
+
+        if get_cached_parse(db, digest) is not None:
+            raw_data = PromobService.extract_data(filepath, db, file_hash=digest)
+            mapped = PromobService.map_data(db, raw_data)
+            cur = db.execute('''
+                INSERT INTO promob_import_jobs (user_id, filename, filepath, file_hash, status, progress, result_json,
+                                                started_at, finished_at, updated_at)
+                VALUES (?, ?, ?, ?, 'done', 100, ?, datetime('now'), datetime('now'), datetime('now'))
+            ''', (user_id, original_name, filepath, digest, json.dumps(mapped, ensure_ascii=False)))
+            db.commit()
+            with self._lock:
+                self._stats['cache_hits'] += 1
+            return cur.lastrowid, mapped
+
+        # Same content already on its way: share the job
+        row = db.execute("SELECT id FROM promob_import_jobs WHERE file_hash = ? AND status IN ('queued', 'running') ORDER BY id LIMIT 1",
+                         (digest,)).fetchone()
+        if row:
+            return row['id'], None
+
+        cur = db.execute('''
+            INSERT INTO promob_import_jobs (user_id, filename, filepath, file_hash, status, progress, updated_at)
+            VALUES (?, ?, ?, ?, 'queued', 0, datetime('now'))
+        ''', (user_id, original_name, filepath, digest))
+        db.commit()
+        self._ensure_thread()
+        self._wakeup.set()
+        return cur.lastrowid, None
+
+    def get(self, db, job_id):
+        row = db.execute('''
+            SELECT id, user_id, filename, status, progress, stage, partial_json, result_json, error, created_at, finished_at
+            FROM promob_import_jobs WHERE id = ?
+        ''', (job_id,)).fetchone()
+        if not row:
+            return None
+        if row['status'] == 'queued':
+            self._ensure_thread()
+        job = {
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'filename': row['filename'],
+            'status': row['status'],
+            'progress': row['progress'],
+            'stage': row['stage'],
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'finished_at': row['finished_at'],
+        }
+        if row['status'] == 'done' and row['result_json']:
+            job['data'] = json.loads(row['result_json'])
+        elif row['partial_json']:
+            job['partial'] = json.loads(row['partial_json'])
+        return job
+
+    # --- Worker side ---
+
+    def _claim(self, conn):
+        """Takes the oldest queued (or abandoned) job; the conditional UPDATE makes it safe across processes."""
+        stale = f'-{JOB_STALE_AFTER_S} seconds'
+        try:
+            while True:
+                row = conn.execute(f"SELECT id, filepath, file_hash FROM promob_import_jobs WHERE {CLAIMABLE_WHERE} ORDER BY id LIMIT 1",
+                                   (stale,)).fetchone()
+                if not row:
+                    return None
+                cur = conn.execute(f'''
+                    UPDATE promob_import_jobs
+                    SET status = 'running', progress = ?, started_at = datetime('now'), updated_at = datetime('now')
+                    WHERE id = ? AND {CLAIMABLE_WHERE}
+                ''', (PROGRESS_PARSE_START, row['id'], stale))
+                conn.commit()
+                if cur.rowcount == 1:
+                    return row
+                # Another process got it first
+        except Exception as e:
+            conn.rollback()
+            print(f"Erro ao buscar job de importação Promob: {e}")
+            return None
+
+    def _update(self, conn, job_id, **fields):
+        fields['updated_at'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        conn.execute(f"UPDATE promob_import_jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+        conn.commit()
+
+    def _process(self, conn, job):
+        job_id = job['id']
+        last = [0.0]
+
+        def on_progress(fraction, partial):
+            now = time.monotonic()
+            if now - last[0] < JOB_PROGRESS_EVERY_S:
+                return
+            last[0] = now
+            pct = PROGRESS_PARSE_START + int((PROGRESS_PARSE_END - PROGRESS_PARSE_START) * fraction)
+            self._update(conn, job_id, progress=pct, stage='parse',
+                         partial_json=json.dumps(_partial_summary(partial), ensure_ascii=False))
+
+        try:
+            self._update(conn, job_id, stage='parse')
+            raw_data = PromobService.extract_data(job['filepath'], conn, file_hash=job['file_hash'], progress=on_progress)
+            conn.commit()  # parse cache entry
+            if not raw_data:
+                raise ValueError('Falha ao processar arquivo Promob')
+
+            self._update(conn, job_id, progress=PROGRESS_PARSE_END, stage='mapping')
+            mapped = PromobService.map_data(conn, raw_data)
+            self._update(conn, job_id, status='done', progress=100, stage='done', finished_at=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                         result_json=json.dumps(mapped, ensure_ascii=False))
+            with self._lock:
+                self._stats['completed'] += 1
+        except Exception as e:
+            conn.rollback()
+            print(f"Erro na importação Promob (job {job_id}): {e}")
+            self._update(conn, job_id, status='error', error=str(e), finished_at=time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+            with self._lock:
+                self._stats['failed'] += 1
+
+    def _run(self):
+        while True:
+            try:
+                with self.pool.connection() as conn:
+                    job = self._claim(conn)
+                    while job:
+                        self._process(conn, job)
+                        job = self._claim(conn)
+            except Exception as e:
+                print(f"Erro no worker de importação Promob: {e}")
+            self._wakeup.wait(JOB_POLL_INTERVAL_S)
+            self._wakeup.clear()
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data['worker_alive'] = bool(self._thread and self._thread.is_alive())
+        return data
+
+
+import_queue = PromobImportQueue(db_pool)
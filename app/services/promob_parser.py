@@ -0,0 +1,428 @@
+import codecs
+import hashlib
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+
+# Single Promob extraction core shared by the import (PromobService), the miner and
+# scripts/train_catalog.py. A file is parsed once into client, materials, modules (A/B)
+# and VIP sub-components (C); results are cached by content hash in promob_parse_cache.
+#
+# The ambient3d member is read in chunks, decoded incrementally and scanned with a rolling
+# buffer, so memory stays bounded by the largest module block instead of the whole file.
+
+# Bump when the extraction rules change: cached results of older versions are ignored
+PARSER_VERSION = 1
+
+CHUNK_SIZE = 256 * 1024
+
+# Strategy A keeps 3000 chars before / 500 after each BUDGETINFORMATION match
+BUDGET_WINDOW_BEFORE = 3000
+BUDGET_WINDOW_AFTER = 500
+
+# Strategy C looks for INSERTDIMENSION up to 3000 chars after each VIP description
+VIP_WINDOW_AFTER = 3000
+
+# Common Furniture Whitelist
+FURNITURE_KEYWORDS = [
+    'balcão', 'armário', 'torre', 'nicho', 'paneleiro', 'aéreo',
+    'gaveteiro', 'criado', 'cama', 'mesa', 'painel', 'adega',
+    'banheiro', 'dormitório', 'guarda-roupa', 'modulo', 'módulo',
+    'roupeiro', 'closet', 'escrivaninha', 'estante', 'cristaleira'
+]
+PARTS_BLACKLIST = [
+    'lateral', 'base', 'sarrafo', 'fundo', 'travessa', 'prateleira',
+    'porta reta', 'frente reta', 'dobradiça', 'corrediça', 'puxador',
+    'trilho', 'perfil', 'ponteira', 'suporte', 'batedor'
+]
+# Generic BUDGETINFORMATION descriptions: fall back to the ATTRIBUTE description
+DEFAULT_NAMES = ['padrão', 'default', 'config felipe']
+# Strategy C: sub-components worth suggesting even inside a bigger module
+VIP_KEYWORDS = [
+    'gaveta interna', 'gaveteiro', 'porta de correr', 'porta deslizante',
+    'corpo de gaveta', 'moldura engros', 'rodapé', 'rodape', 'engrosso'
+]
+VIP_SKIP = ['fundo de gaveta', 'lateral de gaveta', 'frente gaveta', 'posterior de gaveta']
+
+BUDGET_TAG = '<BUDGETINFORMATION'
+BUDGET_RE = re.compile(r'<BUDGETINFORMATION\s+([^>]+)BUDGET="Y"')
+BLOCK_SEP_RE = re.compile(r'<(?:ENTITY|ITEM|INFORMACOES)\b')
+BLOCK_SEP_MAXLEN = len('<INFORMACOES')
+DESC_ATTR_RE = re.compile(r'DESCRIPTION="([^"]+)"')
+DESC_ATTR_EMPTY_RE = re.compile(r'DESCRIPTION="([^"]*)"')
+DESC_VALUE_RE = re.compile(r'ID="DESCRIPTION"\s+VALUE="([^"]+)"')
+VIP_TAG = '<ATTRIBUTE ID="DESCRIPTION" VALUE="'
+VIP_RE = re.compile(r'<ATTRIBUTE ID="DESCRIPTION" VALUE="([^"]+)"')
+INSERT_DIM_RE = re.compile(r'<INSERTDIMENSION WIDTH="([\d.]+)" HEIGHT="([\d.]+)" DEPTH="([\d.]+)"')
+DIM_RES = [(d, re.compile(rf'\b(?:{d}|{alt})="([\d.]+)"')) for d, alt in [('L', 'WIDTH'), ('A', 'HEIGHT'), ('P', 'DEPTH')]]
+
+
+def clean_name(name):
+    if not name: return None
+    name = re.sub(r'\$[\w]+\$', '', name)
+    name = re.sub(r'#[\w]+#', '', name)
+    return name.replace('  ', ' ').strip()
+
+
+def sniff_encoding(head):
+    """Picks the codec from the BOM / first bytes (instead of trial-decoding the whole member)."""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    if len(head) >= 2 and head[0] != 0 and head[1] == 0:
+        return 'utf-16-le'
+    if len(head) >= 2 and head[0] == 0 and head[1] != 0:
+        return 'utf-16-be'
+    return 'utf-8'
+
+
+def iter_decoded(fileobj, chunk_size=CHUNK_SIZE):
+    """Yields text chunks from a binary stream through an incremental decoder."""
+    head = fileobj.read(chunk_size)
+    if not head:
+        return
+    decoder = codecs.getincrementaldecoder(sniff_encoding(head))(errors='replace')
+    chunk = head
+    while chunk:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+        chunk = fileobj.read(chunk_size)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class AmbientScanner:
+    """
+    Incremental version of the two text strategies used on ambient3d:
+      A) budget-centric: each <BUDGETINFORMATION ... BUDGET="Y"> plus its surrounding window
+      B) tag-centric fallback: <ENTITY|ITEM|INFORMACOES> blocks with TYPE="MODULO"/"WARDROBE"
+      C) VIP sub-components (optional): <ATTRIBUTE ID="DESCRIPTION"> + the next INSERTDIMENSION
+    Strategy A/C records are emitted as soon as their window is complete. Strategy B records are
+    only used when A found nothing, so they are held until close().
+    """
+
+    def __init__(self, furniture_keywords=None, parts_blacklist=None, default_names=None, vip=False):
+        self.furniture_keywords = furniture_keywords or FURNITURE_KEYWORDS
+        self.parts_blacklist = parts_blacklist or PARTS_BLACKLIST
+        self.default_names = default_names or DEFAULT_NAMES
+        self.vip = vip
+        self.c_pos = 0      # next absolute position to look for a VIP description
+        self.buf = ''
+        self.base = 0       # absolute offset of buf[0]
+        self.a_pos = 0      # next absolute position to look for a BUDGETINFORMATION tag
+        self.b_start = 0    # absolute start of the current B block
+        self.b_scan = 0     # next absolute position to look for a block separator
+        self.a_count = 0
+        self.b_records = []
+
+    def _accept(self, name):
+        if not name or len(name) < 3: return False
+        lower = name.lower()
+        if not any(k in lower for k in self.furniture_keywords): return False
+        if any(p in lower for p in self.parts_blacklist): return False
+        return True
+
+    def _scan_budget(self, final):
+        buf, base = self.buf, self.base
+        while True:
+            s = buf.find(BUDGET_TAG, self.a_pos - base)
+            if s == -1:
+                self.a_pos = max(self.a_pos, base + len(buf) - len(BUDGET_TAG) + 1)
+                return
+            if not final and buf.find('>', s) == -1:
+                self.a_pos = base + s  # tag not closed yet
+                return
+            m = BUDGET_RE.match(buf, s)
+            if not m:
+                self.a_pos = base + s + 1
+                continue
+            if not final and m.end() + BUDGET_WINDOW_AFTER > len(buf):
+                self.a_pos = base + s  # trailing window not read yet
+                return
+            self.a_pos = base + m.end()
+
+            window = buf[max(0, base + s - BUDGET_WINDOW_BEFORE) - base: m.end() + BUDGET_WINDOW_AFTER]
+            name = None
+            dn = DESC_ATTR_RE.search(m.group(1))
+            if dn: name = dn.group(1).strip()
+            if not name or name.lower() in self.default_names:
+                an = DESC_VALUE_RE.search(window)
+                if an: name = an.group(1).strip()
+
+            name = clean_name(name)
+            if not self._accept(name): continue
+
+            dims = {}
+            for d, rx in DIM_RES:
+                val_matches = rx.findall(window)
+                if val_matches: dims[d] = float(val_matches[-1])
+            if len(dims) == 3:
+                self.a_count += 1
+                yield {'raw_name': name, 'L': dims['L'], 'A': dims['A'], 'P': dims['P'], 'type': 'BUDGET', 'strategy': 'A'}
+
+    def _scan_vip(self, final):
+        buf, base = self.buf, self.base
+        while True:
+            s = buf.find(VIP_TAG, self.c_pos - base)
+            if s == -1:
+                self.c_pos = max(self.c_pos, base + len(buf) - len(VIP_TAG) + 1)
+                return
+            m = VIP_RE.match(buf, s)
+            if not m:
+                if not final and buf.find('"', s + len(VIP_TAG)) == -1:
+                    self.c_pos = base + s  # value not closed yet
+                    return
+                self.c_pos = base + s + 1
+                continue
+            if not final and m.end() + VIP_WINDOW_AFTER > len(buf):
+                self.c_pos = base + s
+                return
+            self.c_pos = base + m.end()
+
+            desc = m.group(1).strip()
+            lower_desc = desc.lower()
+            if not any(k in lower_desc for k in VIP_KEYWORDS): continue
+            # Pular sub-partes muito granulares
+            if any(k in lower_desc for k in VIP_SKIP): continue
+
+            dim_match = INSERT_DIM_RE.search(buf, m.end(), m.end() + VIP_WINDOW_AFTER)
+            if dim_match:
+                # Filtro de sanidade: ignorar se tamanho for 1x1x1 (placeholder Promob)
+                l, a, p = float(dim_match.group(1)), float(dim_match.group(2)), float(dim_match.group(3))
+                if l > 5 and a > 5 and p > 5:
+                    yield {'raw_name': clean_name(desc), 'L': l, 'A': a, 'P': p, 'type': 'VIP', 'strategy': 'C'}
+
+    def _block(self, block):
+        if 'TYPE="MODULO"' in block:
+            kind = 'MODULO'
+        elif 'TYPE="WARDROBE"' in block:
+            kind = 'WARDROBE'
+        else:
+            return
+        desc = None
+        ad = DESC_VALUE_RE.search(block)
+        if ad: desc = ad.group(1).strip()
+        else:
+            dm = DESC_ATTR_EMPTY_RE.search(block)
+            if dm: desc = dm.group(1).strip()
+
+        desc = clean_name(desc)
+        if not self._accept(desc): return
+
+        dims = {}
+        for d, rx in DIM_RES:
+            v = rx.search(block)
+            if v: dims[d] = float(v.group(1))
+        if len(dims) == 3:
+            self.b_records.append({'raw_name': desc, 'L': dims['L'], 'A': dims['A'], 'P': dims['P'], 'type': kind, 'strategy': 'B'})
+
+    def _scan_blocks(self, final):
+        buf, base = self.buf, self.base
+        while True:
+            m = BLOCK_SEP_RE.search(buf, self.b_scan - base)
+            # \b needs the following char: a separator touching the buffer end may still grow ('<ITEMS')
+            if not m or (not final and m.end() >= len(buf)):
+                self.b_scan = max(self.b_start, base + len(buf) - BLOCK_SEP_MAXLEN)
+                return
+            self._block(buf[self.b_start - base:m.start()])
+            self.b_start = self.b_scan = base + m.end()
+
+    def _trim(self):
+        keep = min(self.b_start, max(0, self.a_pos - BUDGET_WINDOW_BEFORE))
+        if self.vip:
+            keep = min(keep, self.c_pos)
+        if keep - self.base > CHUNK_SIZE:
+            self.buf = self.buf[keep - self.base:]
+            self.base = keep
+
+    def feed(self, text):
+        self.buf += text
+        yield from self._scan_budget(final=False)
+        if self.vip:
+            yield from self._scan_vip(final=False)
+        self._scan_blocks(final=False)
+        self._trim()
+
+    def close(self):
+        yield from self._scan_budget(final=True)
+        if self.vip:
+            yield from self._scan_vip(final=True)
+        self._scan_blocks(final=True)
+        self._block(self.buf[self.b_start - self.base:])
+        if not self.a_count:
+            yield from self.b_records
+        self.buf = ''
+
+
+def iter_ambient_modules(fileobj, chunk_size=CHUNK_SIZE, **filters):
+    """
+    Streams an ambient3d member (binary file object, e.g. ZipFile.open()) and yields module
+    records {'raw_name', 'L', 'A', 'P', 'type', 'strategy'} as they are found.
+    Pass vip=True to also get strategy C sub-components.
+    """
+    scanner = AmbientScanner(**filters)
+    for text in iter_decoded(fileobj, chunk_size):
+        yield from scanner.feed(text)
+    yield from scanner.close()
+
+
+# --- Whole-file extraction ---
+
+def file_hash(filepath):
+    """MD5 of the file contents (same key as processed_files)."""
+    hasher = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for buf in iter(lambda: f.read(65536), b''):
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+
+def _read_xml(z, path):
+    data = z.read(path)
+    content = data.decode(sniff_encoding(data[:4]), errors='replace').lstrip('\ufeff').strip()
+    # Clean up content (sometimes there's junk at the start)
+    if not content.startswith('<'):
+        idx = content.find('<')
+        content = content[idx:] if idx != -1 else ''
+    return content
+
+
+def _parse_client(content):
+    root = ET.fromstring(content)
+    client_node = root.find('.//CLIENT')
+    if client_node is not None:
+        return {
+            'nome': client_node.get('NAME'),
+            'email': client_node.get('EMAIL'),
+            'fone': client_node.get('PHONE')
+        }
+    # DATACLIENT layout: <FIELD NAME="nomecliente" VALUE="..."/> (empty template when not filled)
+    fields = {f.get('NAME'): f.get('VALUE') for f in root.iter('FIELD')}
+    if fields.get('nomecliente'):
+        return {'nome': fields['nomecliente'], 'email': fields.get('email'), 'fone': fields.get('fone') or fields.get('celular')}
+    return None
+
+
+def _parse_materials(content):
+    materials = []
+    root = ET.fromstring(content)
+    for mat in root.findall('.//MATERIAL'):
+        name = mat.get('NAME')
+        finish = mat.get('FINISH')
+        model = mat.get('MODEL')
+        if name:
+            # Unique key for mapping
+            materials_key = name
+            if finish: materials_key += f" | {finish}"
+            if model: materials_key += f" | {model}"
+            materials.append({'raw_name': materials_key, 'name': name, 'finish': finish, 'model': model})
+    return materials
+
+
+class _ProgressReader:
+    """Wraps the ambient3d stream and reports the fraction read after each chunk."""
+
+    def __init__(self, fh, total, callback, result):
+        self.fh = fh
+        self.total = total or 1
+        self.done = 0
+        self.callback = callback
+        self.result = result
+
+    def read(self, n=-1):
+        data = self.fh.read(n)
+        self.done += len(data)
+        self.callback(min(1.0, self.done / self.total), self.result)
+        return data
+
+
+def parse_promob_file(filepath, progress=None):
+    """
+    Opens a .promob/.bak once and returns
+      {'client': dict|None, 'materials': [...], 'modules': [...], 'vip': [...]}
+    modules are strategy A (or B when A found nothing); vip are strategy C sub-components.
+    progress(fraction, partial_result) is called while the ambient3d member is scanned.
+    Returns None when the file is not a readable Promob archive.
+    """
+    result = {'client': None, 'materials': [], 'modules': [], 'vip': []}
+    try:
+        with zipfile.ZipFile(filepath, 'r') as z:
+            names = z.namelist()
+
+            client_path = next((n for n in names if 'dataclient' in n.lower()), None)
+            if client_path:
+                try:
+                    result['client'] = _parse_client(_read_xml(z, client_path))
+                except Exception as e:
+                    print(f"Error parsing client in {filepath}: {e}")
+
+            mat_path = next((n for n in names if 'materials.material' in n.lower()), None)
+            if mat_path:
+                try:
+                    result['materials'] = _parse_materials(_read_xml(z, mat_path))
+                except Exception as e:
+                    print(f"Error parsing materials in {filepath}: {e}")
+
+            amb_path = next((n for n in names if 'ambient3d' in n.lower()), None)
+            if amb_path:
+                try:
+                    with z.open(amb_path) as fh:
+                        if progress:
+                            fh = _ProgressReader(fh, z.getinfo(amb_path).file_size, progress, result)
+                        for rec in iter_ambient_modules(fh, vip=True):
+                            result['vip' if rec['strategy'] == 'C' else 'modules'].append(rec)
+                except Exception as e:
+                    print(f"Error extracting modules from {amb_path}: {e}")
+    except Exception as e:
+        print(f"Error parsing Promob file {filepath}: {e}")
+        return None
+    return result
+
+
+def get_cached_parse(db, digest):
+    row = db.execute("SELECT result_json FROM promob_parse_cache WHERE file_hash = ? AND parser_version = ?",
+                     (digest, PARSER_VERSION)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def get_cached_parses(db, digests, chunk_size=500):
+    """Bulk version of get_cached_parse: {file_hash: result} for the digests already cached."""
+    digests = list(digests)
+    found = {}
+    for i in range(0, len(digests), chunk_size):
+        chunk = digests[i:i + chunk_size]
+        placeholders = ','.join('?' * len(chunk))
+        rows = db.execute(f"SELECT file_hash, result_json FROM promob_parse_cache WHERE parser_version = ? AND file_hash IN ({placeholders})",
+                          [PARSER_VERSION] + chunk).fetchall()
+        for row in rows:
+            found[row[0]] = json.loads(row[1])
+    return found
+
+
+def store_parse(db, digest, filename, result):
+    db.execute('''
+        INSERT INTO promob_parse_cache (file_hash, parser_version, filename, result_json, parsed_at)
+        VALUES (?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(file_hash) DO UPDATE SET parser_version=excluded.parser_version, filename=excluded.filename,
+            result_json=excluded.result_json, parsed_at=excluded.parsed_at
+    ''', (digest, PARSER_VERSION, filename, json.dumps(result, ensure_ascii=False)))
+
+
+def parse_promob_cached(db, filepath, digest=None, progress=None):
+    """
+    parse_promob_file() behind the content-hash cache. Unchanged files are never re-parsed.
+    The cache row is written on the caller's connection (the caller commits).
+    """
+    digest = digest or file_hash(filepath)
+    cached = get_cached_parse(db, digest)
+    if cached is not None:
+        return cached
+    result = parse_promob_file(filepath, progress)
+    if result is not None:
+        store_parse(db, digest, os.path.basename(filepath), result)
+    return result
@@ -0,0 +1,180 @@
+import os
+import time
+import multiprocessing
+
+from app.services.promob_parser import file_hash, parse_promob_file, get_cached_parses, store_parse
+
+# Parallel pipeline shared by the miner (promob_miner.run_miner) and scripts/train_catalog.py.
+# Worker processes only hash and parse files; the calling process is the single writer and
+# commits every BATCH_FILES files (stage output + parse cache + processed_files checkpoints),
+# so an interrupted run resumes from the last committed batch.
+
+BATCH_FILES = 200
+PROGRESS_EVERY_S = 5.0
+PROMOB_EXTENSIONS = ('.promob', '.bak')
+
+# processed_files checkpoint column per stage
+STAGE_COLUMNS = {'mine': 'mined_at', 'train': 'trained_at'}
+
+UPSERT_CHECKPOINT_SQL = '''
+    INSERT INTO processed_files (file_hash, filename, {col}) VALUES (?, ?, datetime('now'))
+    ON CONFLICT(file_hash) DO UPDATE SET {col} = excluded.{col}
+'''
+
+
+def find_promob_files(train_dir):
+    """All .promob/.bak files under train_dir (recursive), sorted for a stable order."""
+    files = []
+    for root, _, names in os.walk(train_dir):
+        for f in names:
+            if f.endswith(PROMOB_EXTENSIONS):
+                files.append(os.path.join(root, f))
+    files.sort()
+    return files
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1))
+
+
+# --- Worker side (must stay picklable: no DB access here) ---
+
+def _hash_job(path):
+    try:
+        return path, file_hash(path)
+    except OSError as e:
+        print(f"Error hashing {path}: {e}")
+        return path, None
+
+
+def _parse_job(job):
+    path, digest = job
+    return path, digest, parse_promob_file(path)
+
+
+def _imap(pool, fn, jobs):
+    if pool is None:
+        return map(fn, jobs)
+    # Small chunks keep the progress output flowing while amortizing IPC
+    return pool.imap_unordered(fn, jobs, chunksize=4)
+
+
+class PipelineProgress:
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.start = time.monotonic()
+        self._last = self.start
+
+    def tick(self, n=1):
+        self.done += n
+        now = time.monotonic()
+        if now - self._last < PROGRESS_EVERY_S and self.done < self.total:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        print(f"[{self.label}] {self.done}/{self.total} arquivos ({rate:.1f}/s, ETA {eta:.0f}s)")
+
+
+# --- Writer side ---
+
+def _pending(conn, stage, hashed):
+    """Drops files whose content was already checkpointed for this stage (and duplicate contents)."""
+    col = STAGE_COLUMNS[stage]
+    done = set()
+    digests = list({d for _, d in hashed})
+    for i in range(0, len(digests), 500):
+        chunk = digests[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f"SELECT file_hash FROM processed_files WHERE {col} IS NOT NULL AND file_hash IN ({placeholders})",
+                            chunk).fetchall()
+        done.update(r[0] for r in rows)
+
+    pending, seen = [], set()
+    for path, digest in sorted(hashed):
+        if digest in done or digest in seen:
+            continue
+        seen.add(digest)
+        pending.append((path, digest))
+    return pending, len(hashed) - len(pending)
+
+
+def _flush(conn, stage, consume, batch, stats):
+    """One transaction: stage output, new cache entries and checkpoints."""
+    if not batch:
+        return
+    try:
+        consume(conn, [(path, digest, parsed) for path, digest, parsed, _ in batch if parsed], stats)
+        for path, digest, parsed, fresh in batch:
+            if parsed and fresh:
+                store_parse(conn, digest, os.path.basename(path), parsed)
+        conn.executemany(UPSERT_CHECKPOINT_SQL.format(col=STAGE_COLUMNS[stage]),
+                         [(digest, os.path.basename(path)) for path, digest, _, _ in batch])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def run_pipeline(conn, train_dir, stage, consume, workers=None, limit=None, batch_size=BATCH_FILES):
+    """
+    Hashes and parses every Promob file under train_dir in a process pool and hands the
+    parsed results to consume(conn, [(path, digest, parsed), ...], stats) in batches.
+    Returns the stats dict (consume may add its own counters).
+    """
+    stats = {'found': 0, 'skipped': 0, 'processed': 0, 'cached': 0, 'failed': 0}
+    if not os.path.exists(train_dir):
+        print(f"Directory {train_dir} not found.")
+        return stats
+
+    files = find_promob_files(train_dir)
+    stats['found'] = len(files)
+    workers = workers or default_workers()
+    print(f"Found {len(files)} files in {train_dir} (including subdirs), {workers} worker(s)")
+
+    pool = multiprocessing.Pool(workers) if workers > 1 and len(files) > 1 else None
+    try:
+        # 1. Hash everything in parallel, then drop what this stage already checkpointed
+        progress = PipelineProgress('hash', len(files))
+        hashed = []
+        for path, digest in _imap(pool, _hash_job, files):
+            if digest:
+                hashed.append((path, digest))
+            progress.tick()
+        pending, stats['skipped'] = _pending(conn, stage, hashed)
+        if limit is not None:
+            pending = pending[:limit]
+
+        # 2. Reuse cached parses, parse the rest in parallel
+        cached = get_cached_parses(conn, [d for _, d in pending])
+        to_parse = [(p, d) for p, d in pending if d not in cached]
+        stats['cached'] = len(pending) - len(to_parse)
+
+        progress = PipelineProgress(stage, len(pending))
+        batch = []
+
+        def emit(path, digest, parsed, fresh):
+            batch.append((path, digest, parsed, fresh))
+            if parsed is None:
+                stats['failed'] += 1
+            stats['processed'] += 1
+            progress.tick()
+            if len(batch) >= batch_size:
+                _flush(conn, stage, consume, batch, stats)
+                batch.clear()
+
+        for path, digest in pending:
+            if digest in cached:
+                emit(path, digest, cached[digest], False)
+        for path, digest, parsed in _imap(pool, _parse_job, to_parse):
+            emit(path, digest, parsed, True)
+        _flush(conn, stage, consume, batch, stats)
+    finally:
+        if pool is not None:
+            # Every result was consumed on success; on error/Ctrl+C don't wait for the queue
+            pool.terminate()
+            pool.join()
+    return stats
@@ -1,163 +1,88 @@
-import zipfile
-import xml.etree.ElementTree as ET
 import re
-import os
-from app.database import get_db
+import unicodedata
+from app.services.promob_parser import parse_promob_file, parse_promob_cached
+
+IN_CHUNK_SIZE = 500
+
+UPSERT_MAPPING_SQL = '''
+    INSERT INTO promob_mappings (promob_name, promob_key, target_type, target_id)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(promob_name) DO UPDATE SET promob_key=excluded.promob_key, target_type=excluded.target_type, target_id=excluded.target_id
+'''
+
+
+def mapping_key(name):
+    """
+    Normalized lookup key for promob_mappings.promob_key:
+    $VAR$/#VAR# tokens removed, accents stripped, case-folded, whitespace collapsed.
+    """
+    if not name: return ''
+    name = re.sub(r'\$[\w]+\$', ' ', name)
+    name = re.sub(r'#[\w]+#', ' ', name)
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.casefold().split())
+
+
+def save_mapping(db, promob_name, target_type, target_id):
+    """Creates/updates one mapping (the caller commits)."""
+    db.execute(UPSERT_MAPPING_SQL, (promob_name, mapping_key(promob_name), target_type, target_id))
+
+
+def resolve_mappings(db, names, target_type):
+    """
+    Resolves many Promob names at once: {name: (target_id, 'exact'|'normalized')}.
+    One IN query on promob_name, then one on the indexed promob_key for the names still missing.
+    """
+    names = list(dict.fromkeys(n for n in names if n))
+    resolved = {}
+    for i in range(0, len(names), IN_CHUNK_SIZE):
+        chunk = names[i:i + IN_CHUNK_SIZE]
+        rows = db.execute(f"SELECT promob_name, target_id FROM promob_mappings WHERE target_id IS NOT NULL AND promob_name IN ({','.join('?' * len(chunk))})",
+                          chunk).fetchall()
+        for row in rows:
+            resolved[row['promob_name']] = (row['target_id'], 'exact')
+
+    by_key = {}
+    for n in names:
+        if n not in resolved:
+            key = mapping_key(n)
+            if key: by_key.setdefault(key, []).append(n)
+    keys = list(by_key)
+    for i in range(0, len(keys), IN_CHUNK_SIZE):
+        chunk = keys[i:i + IN_CHUNK_SIZE]
+        # Latest mapping wins when several spellings share a key
+        rows = db.execute(f'''
+            SELECT promob_key, target_id FROM promob_mappings
+            WHERE target_id IS NOT NULL AND target_type = ? AND promob_key IN ({','.join('?' * len(chunk))})
+            ORDER BY id
+        ''', [target_type] + chunk).fetchall()
+        for row in rows:
+            for n in by_key[row['promob_key']]:
+                resolved[n] = (row['target_id'], 'normalized')
+    return resolved
+
 
 class PromobService:
     @staticmethod
-    def extract_data(filepath):
+    def extract_data(filepath, db=None, file_hash=None, progress=None):
         """
         Parses a Promob file and returns structured data for budgeting.
+        With a db connection the parse goes through promob_parse_cache (the caller commits).
         """
-        results = {
-            'client': None,
-            'items': [],
-            'materials': [],
-            'unknowns': [] # Items/Materials that need manual mapping
-        }
-
-        try:
-            with zipfile.ZipFile(filepath, 'r') as z:
-                names = z.namelist()
-
-                # 1. Client Info
-                client_path = next((n for n in names if 'dataclient' in n.lower()), None)
-                if client_path:
-                    try:
-                        data = z.read(client_path).decode('utf-16-sig', errors='ignore')
-                        root = ET.fromstring(data)
-                        client_node = root.find('.//CLIENT')
-                        if client_node is not None:
-                            results['client'] = {
-                                'nome': client_node.get('NAME'),
-                                'email': client_node.get('EMAIL'),
-                                'fone': client_node.get('PHONE')
-                            }
-                        else:
-                            # Fallback if XML structure is slightly different
-                            name_match = re.search(r'NAME="([^"]+)"', data)
-                            if name_match:
-                                results['client'] = {'nome': name_match.group(1)}
-                    except:
-                        pass
-
-                # 2. Materials (MDFs, Hardwares, etc)
-                mat_path = next((n for n in names if 'materials.material' in n.lower()), None)
-                if mat_path:
-                    try:
-                        data = z.read(mat_path).decode('utf-16-sig', errors='ignore')
-                        # Extraction of materials and their finishes
-                        root = ET.fromstring(data)
-                        for mat in root.findall('.//MATERIAL'):
-                            name = mat.get('NAME')
-                            finish = mat.get('FINISH')
-                            model = mat.get('MODEL')
-                            if name:
-                                materials_key = name
-                                if finish: materials_key += f" | {finish}"
-                                if model: materials_key += f" | {model}"
-                                results['materials'].append({
-                                    'raw_name': materials_key,
-                                    'name': name,
-                                    'finish': finish,
-                                    'model': model
-                                })
-                    except:
-                        pass
-
-                # 3. Modules (Robust Extraction)
-                amb_path = next((n for n in names if 'ambient3d' in n.lower()), None)
-                if amb_path:
-                    try:
-                        raw_data = z.read(amb_path)
-                        data = None
-                        # Try multiple encodings
-                        for enc in ['utf-8-sig', 'utf-16-sig', 'utf-8', 'utf-16']:
-                            try:
-                                data = raw_data.decode(enc)
-                                break
-                            except:
-                                continue
-                        
-                        if data:
-                            # HEURISTIC: Is this a budgeted file or legacy?
-                            is_budget_file = '<BUDGETINFORMATION' in data
-                            found_items = []
-                            
-                            # Whitelist and Blacklist for consistency
-                            furniture_keywords = ['balcão', 'armário', 'torre', 'nicho', 'paneleiro', 'aéreo', 'gaveteiro', 'criado', 'cama', 'mesa', 'painel', 'adega', 'banheiro', 'dormitório', 'guarda-roupa', 'modulo', 'módulo']
-                            parts_blacklist = ['lateral', 'base', 'sarrafo', 'fundo', 'travessa', 'prateleira', 'porta reta', 'frente reta', 'dobradiça', 'corrediça', 'puxador']
-
-                            def clean_name(name):
-                                if not name: return None
-                                name = re.sub(r'\$[\w]+\$', '', name)
-                                name = re.sub(r'#[\w]+#', '', name)
-                                return name.replace('  ', ' ').strip()
-
-                            if is_budget_file:
-                                # A: Budget-centric
-                                budget_matches = re.finditer(r'<BUDGETINFORMATION\s+([^>]+)BUDGET="Y"', data)
-                                for m in budget_matches:
-                                    info_attr = m.group(1)
-                                    window = data[max(0, m.start()-3000) : min(len(data), m.end()+500)]
-                                    
-                                    name = None
-                                    dn = re.search(r'DESCRIPTION="([^"]+)"', info_attr)
-                                    if dn: name = dn.group(1).strip()
-                                    if not name or name.lower() in ['padrão', 'default']:
-                                        an = re.search(r'ID="DESCRIPTION"\s+VALUE="([^"]+)"', window)
-                                        if an: name = an.group(1).strip()
-                                    
-                                    name = clean_name(name)
-                                    if not name or len(name) < 3: continue
-                                    lower_name = name.lower()
-                                    if not any(k in lower_name for k in furniture_keywords): continue
-                                    if any(p in lower_name for p in parts_blacklist): continue
-                                    
-                                    dims = {}
-                                    for d, alt in [('L', 'WIDTH'), ('A', 'HEIGHT'), ('P', 'DEPTH')]:
-                                        val_matches = re.findall(rf'\b(?:{d}|{alt})="([\d.]+)"', window)
-                                        if val_matches: dims[d] = float(val_matches[-1])
-                                    
-                                    if len(dims) == 3:
-                                        found_items.append({'raw_name': name, 'L': dims['L'], 'A': dims['A'], 'P': dims['P']})
-                            
-                            if not found_items:
-                                # B: Tag-centric fallback
-                                blocks = re.split(r'<(?:ENTITY|ITEM|INFORMACOES)\b', data)
-                                for block in blocks:
-                                    if 'TYPE="MODULO"' in block or 'TYPE="WARDROBE"' in block:
-                                        desc = None
-                                        ad = re.search(r'ID="DESCRIPTION"\s+VALUE="([^"]+)"', block)
-                                        if ad: desc = ad.group(1).strip()
-                                        else:
-                                            dm = re.search(r'DESCRIPTION="([^"]*)"', block)
-                                            if dm: desc = dm.group(1).strip()
-                                        
-                                        desc = clean_name(desc)
-                                        if not desc or len(desc) < 3: continue
-                                        lower_desc = desc.lower()
-                                        if not any(k in lower_desc for k in furniture_keywords): continue
-                                        if any(p in lower_desc for p in parts_blacklist): continue
-                                        
-                                        dims = {}
-                                        for d, alt in [('L', 'WIDTH'), ('A', 'HEIGHT'), ('P', 'DEPTH')]:
-                                            v = re.search(rf'\b(?:{d}|{alt})="([\d.]+)"', block)
-                                            if v: dims[d] = float(v.group(1))
-                                        
-                                        if len(dims) == 3:
-                                            found_items.append({'raw_name': desc, 'L': dims['L'], 'A': dims['A'], 'P': dims['P']})
-                            
-                            results['items'].extend(found_items)
-                    except Exception as e:
-                        print(f"Error extracting modules from {amb_path}: {e}")
-
-        except Exception as e:
-            print(f"Error parsing Promob file {filepath}: {e}")
+        if db is not None:
+            parsed = parse_promob_cached(db, filepath, file_hash, progress)
+        else:
+            parsed = parse_promob_file(filepath, progress)
+        if parsed is None:
             return None
 
-        return results
+        return {
+            'client': parsed['client'],
+            'items': [{'raw_name': m['raw_name'], 'L': m['L'], 'A': m['A'], 'P': m['P']} for m in parsed['modules']],
+            'materials': [dict(m) for m in parsed['materials']],
+            'unknowns': [] # Items/Materials that need manual mapping
+        }
 
     @staticmethod
     def map_data(db, raw_data):
@@ -171,30 +96,29 @@ class PromobService:
             'unknowns': []
         }
 
+        # One batched lookup per kind instead of one query per row
+        item_maps = resolve_mappings(db, [it['raw_name'] for it in raw_data['items']], 'item')
+        mat_maps = resolve_mappings(db, [m['raw_name'] for m in raw_data['materials']], 'material')
+        unknown_names = set()
+
         # Handle Items (Modules)
         for item in raw_data['items']:
-            mapping = db.execute("SELECT target_type, target_id FROM promob_mappings WHERE promob_name = ?", 
-                                 (item['raw_name'],)).fetchone()
-            
-            if mapping and mapping['target_id']:
-                item['catalogo_id'] = mapping['target_id']
-                mapped_results['items'].append(item)
-            else:
-                if item['raw_name'] not in [u['name'] for u in mapped_results['unknowns']]:
-                    mapped_results['unknowns'].append({'type': 'item', 'name': item['raw_name']})
-                mapped_results['items'].append(item) # Still include but it will be flagged
+            mapping = item_maps.get(item['raw_name'])
+            if mapping:
+                item['catalogo_id'], item['mapping_match'] = mapping
+            elif item['raw_name'] not in unknown_names:
+                unknown_names.add(item['raw_name'])
+                mapped_results['unknowns'].append({'type': 'item', 'name': item['raw_name']})
+            mapped_results['items'].append(item) # Unmapped ones are still included but flagged
 
         # Handle Materials
         for mat in raw_data['materials']:
-            mapping = db.execute("SELECT target_type, target_id FROM promob_mappings WHERE promob_name = ?", 
-                                 (mat['raw_name'],)).fetchone()
-            
-            if mapping and mapping['target_id']:
-                mat['estoque_id'] = mapping['target_id']
-                mapped_results['materials'].append(mat)
-            else:
-                if mat['raw_name'] not in [u['name'] for u in mapped_results['unknowns']]:
-                    mapped_results['unknowns'].append({'type': 'material', 'name': mat['raw_name']})
-                mapped_results['materials'].append(mat)
+            mapping = mat_maps.get(mat['raw_name'])
+            if mapping:
+                mat['estoque_id'], mat['mapping_match'] = mapping
+            elif mat['raw_name'] not in unknown_names:
+                unknown_names.add(mat['raw_name'])
+                mapped_results['unknowns'].append({'type': 'material', 'name': mat['raw_name']})
+            mapped_results['materials'].append(mat)
 
         return mapped_results
@@ -0,0 +1,215 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+# Reporting queries over contas / orcamentos. Every report is one GROUP BY pass over a
+# half-open range (col >= inicio AND col < fim) so SQLite can use the date indexes from
+# migration 26; periods are calendar-aligned (real months/quarters, Monday weeks) and the
+# bucket key of each row is the first day of its period.
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter')
+MESES = ('Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez')
+# orcamentos.status values that count as a closed sale
+STATUS_VENDA = ('aprovado', 'producao', 'concluido', 'entregue')
+EXPORT_CHUNK = 500
+
+CONTAS_EXPORT_FIELDS = ('id', 'vencimento', 'tipo', 'status', 'categoria', 'descricao', 'valor', 'orcamento_id', 'funcionario_id')
+
+
+def _bucket_sql(col, granularity):
+    # 'YYYY-MM-DD' of the period start, computed from the stored text date
+    if granularity == 'day':
+        return f"substr({col}, 1, 10)"
+    if granularity == 'week':
+        return f"date({col}, 'weekday 0', '-6 days')"
+    if granularity == 'month':
+        return f"substr({col}, 1, 7) || '-01'"
+    if granularity == 'quarter':
+        return f"substr({col}, 1, 5) || printf('%02d', (CAST(substr({col}, 6, 2) AS INTEGER) - 1) / 3 * 3 + 1) || '-01'"
+    raise ValueError(f'Granularidade inválida: {granularity}')
+
+
+def add_months(d, months):
+    """First day of the month `months` away from d's month (calendar stepping, never skips a month)."""
+    total = d.year * 12 + d.month - 1 + months
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def period_start(d, granularity):
+    if granularity == 'day':
+        return d
+    if granularity == 'week':
+        return d - timedelta(days=d.weekday())
+    if granularity == 'month':
+        return d.replace(day=1)
+    if granularity == 'quarter':
+        return date(d.year, (d.month - 1) // 3 * 3 + 1, 1)
+    raise ValueError(f'Granularidade inválida: {granularity}')
+
+
+def next_period(d, granularity):
+    if granularity == 'day':
+        return d + timedelta(days=1)
+    if granularity == 'week':
+        return d + timedelta(days=7)
+    return add_months(d, 3 if granularity == 'quarter' else 1)
+
+
+def period_label(d, granularity):
+    if granularity in ('day', 'week'):
+        return d.strftime('%d/%m')
+    if granularity == 'quarter':
+        return f"T{(d.month - 1) // 3 + 1}/{d.year}"
+    return f"{MESES[d.month - 1]}/{d.year}"
+
+
+def periods(inicio, fim, granularity):
+    """Period starts covering [inicio, fim)."""
+    d = period_start(inicio, granularity)
+    while d < fim:
+        yield d
+        d = next_period(d, granularity)
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError(f'Data inválida: {value}')
+
+
+def parse_range(args, granularity='month', default_periods=6, today=None):
+    """
+    inicio/fim (YYYY-MM-DD, fim inclusive) from request args -> half-open [inicio, fim).
+    Default: the last `default_periods` periods including the current one.
+    """
+    today = today or date.today()
+    fim = parse_date(args['fim']) + timedelta(days=1) if args.get('fim') else next_period(period_start(today, granularity), granularity)
+    if args.get('inicio'):
+        inicio = parse_date(args['inicio'])
+    else:
+        inicio = period_start(today, granularity)
+        for _ in range(default_periods - 1):
+            inicio = period_start(inicio - timedelta(days=1), granularity)
+    if inicio >= fim:
+        raise ValueError('inicio deve ser anterior a fim')
+    return inicio, fim
+
+
+def _range_where(col, inicio, fim):
+    where, params = [], []
+    if inicio:
+        where.append(f'{col} >= ?')
+        params.append(inicio.isoformat())
+    if fim:
+        where.append(f'{col} < ?')
+        params.append(fim.isoformat())
+    return where, params
+
+
+def cash_flow(db, inicio, fim=None, granularity='month', fill=True):
+    """
+    Receitas/despesas por período (contas by vencimento), one pass. fim=None leaves the range
+    open-ended (then only periods with data are returned). Rows: periodo, label, receita, despesa,
+    receita_paga, despesa_paga, saldo.
+    """
+    bucket = _bucket_sql('vencimento', granularity)
+    where, params = _range_where('vencimento', inicio, fim)
+    rows = db.execute(f'''
+        SELECT {bucket} AS periodo,
+               SUM(CASE WHEN tipo = 'receber' THEN valor ELSE 0 END) AS receita,
+               SUM(CASE WHEN tipo = 'pagar' THEN valor ELSE 0 END) AS despesa,
+               SUM(CASE WHEN tipo = 'receber' AND status = 'pago' THEN valor ELSE 0 END) AS receita_paga,
+               SUM(CASE WHEN tipo = 'pagar' AND status = 'pago' THEN valor ELSE 0 END) AS despesa_paga
+        FROM contas
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        GROUP BY periodo
+        ORDER BY periodo
+    ''', params).fetchall()
+    by_period = {r['periodo']: r for r in rows}
+    keys = [p.isoformat() for p in periods(inicio, fim, granularity)] if fill and fim else [r['periodo'] for r in rows]
+
+    result = []
+    for key in keys:
+        r = by_period.get(key)
+        values = {c: round((r[c] if r else 0) or 0, 2) for c in ('receita', 'despesa', 'receita_paga', 'despesa_paga')}
+        result.append({
+            'periodo': key,
+            'label': period_label(parse_date(key), granularity) if key else '',
+            **values,
+            'saldo': round(values['receita'] - values['despesa'], 2),
+        })
+    return result
+
+
+def vendas(db, inicio, fim):
+    """Total and count of orçamentos closed as sales created in [inicio, fim)."""
+    where, params = _range_where('created_at', inicio, fim)
+    where.append(f"status IN ({', '.join('?' * len(STATUS_VENDA))})")
+    row = db.execute(f'''
+        SELECT COALESCE(SUM(total), 0) AS total, COUNT(*) AS qtd
+        FROM orcamentos
+        WHERE {' AND '.join(where)}
+    ''', params + list(STATUS_VENDA)).fetchone()
+    return {'total': row['total'], 'qtd': row['qtd']}
+
+
+def top_clientes(db, inicio=None, fim=None, limit=5):
+    where, params = _range_where('o.created_at', inicio, fim)
+    where.append(f"o.status IN ({', '.join('?' * len(STATUS_VENDA))})")
+    rows = db.execute(f'''
+        SELECT c.nome, COUNT(o.id) AS qtd_orcamentos, SUM(o.total) AS valor_total
+        FROM orcamentos o
+        JOIN clientes c ON c.id = o.client_id
+        WHERE {' AND '.join(where)}
+        GROUP BY c.id
+        ORDER BY valor_total DESC
+        LIMIT ?
+    ''', params + list(STATUS_VENDA) + [limit]).fetchall()
+    return [dict(r) for r in rows]
+
+
+def contas_query(inicio=None, fim=None, tipo=None, newest_first=True):
+    """(sql, params) for contas lines in a vencimento range, for listings and exports."""
+    where, params = _range_where('vencimento', inicio, fim)
+    if tipo:
+        where.append('tipo = ?')
+        params.append(tipo)
+    sql = f"SELECT {', '.join(CONTAS_EXPORT_FIELDS)} FROM contas"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    # Only the indexed column: an id tiebreaker isn't in idx_contas_vencimento and costs a sort
+    sql += f" ORDER BY vencimento {'DESC' if newest_first else 'ASC'}"
+    return sql, params
+
+
+def iter_rows(db, sql, params, chunk=EXPORT_CHUNK):
+    """Rows as dicts, fetched `chunk` at a time (constant memory for large ranges)."""
+    cur = db.execute(sql, params)
+    while True:
+        batch = cur.fetchmany(chunk)
+        if not batch:
+            break
+        for r in batch:
+            yield dict(r)
+
+
+def stream_csv(rows, fields):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction='ignore', delimiter=';')
+    writer.writeheader()
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def stream_json(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row, ensure_ascii=False, default=str)
+    yield ']'
@@ -0,0 +1,94 @@
+import re
+import unicodedata
+
+# Full-text search over estoque, catálogo, clientes and CRM contacts.
+# Each source has an external-content FTS5 table (created by migration 24) kept in sync by triggers;
+# the unicode61 tokenizer with remove_diacritics lowercases and strips accents, so
+# "armario" finds "Armário". Queries are prefix matches on every typed word.
+
+# source -> base table, fts table, indexed columns, title/subtitle SQL for results (base table alias t)
+SEARCH_SOURCES = {
+    'estoque': {
+        'table': 'estoque',
+        'fts': 'estoque_fts',
+        'columns': ('nome', 'categoria'),
+        'title': 't.nome',
+        'subtitle': "COALESCE(t.categoria, '')",
+    },
+    'catalogo': {
+        'table': 'itens_catalogo',
+        'fts': 'catalogo_fts',
+        'columns': ('nome', 'categoria'),
+        'title': 't.nome',
+        'subtitle': "COALESCE(t.categoria, '')",
+    },
+    'clientes': {
+        'table': 'clientes',
+        'fts': 'clientes_fts',
+        'columns': ('nome', 'cpf_cnpj', 'email', 'telefone', 'whatsapp', 'cidade'),
+        'title': 't.nome',
+        'subtitle': "COALESCE(t.cidade, t.telefone, t.whatsapp, '')",
+    },
+    'contatos': {
+        'table': 'crm_contatos',
+        'fts': 'contatos_fts',
+        'columns': ('nome', 'telefone', 'email'),
+        'title': 't.nome',
+        'subtitle': "COALESCE(t.tipo, '')",
+    },
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_text(text):
+    """Lowercase without accents (same folding as the FTS tokenizer), for Python-side comparisons."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+def fts_query(text):
+    """User text -> FTS5 query: every word must match as a prefix. None when there is nothing to search."""
+    tokens = _TOKEN_RE.findall(normalize_text(text))
+    if not tokens:
+        return None
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+
+def search_ids(db, source, text, limit=20):
+    """Row ids of `source` matching text, best first (bm25)."""
+    match = fts_query(text)
+    if match is None:
+        return []
+    fts = SEARCH_SOURCES[source]['fts']
+    rows = db.execute(f"SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY rank LIMIT ?", (match, limit)).fetchall()
+    return [r[0] for r in rows]
+
+
+def match_clause(source, column='id'):
+    """SQL fragment restricting `column` to the FTS matches; bind fts_query(text)."""
+    fts = SEARCH_SOURCES[source]['fts']
+    return f"{column} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)"
+
+
+def search(db, text, sources=None, limit=10):
+    """Unified search: {source: [{'id', 'title', 'subtitle', 'score'}, ...]} ranked per source."""
+    match = fts_query(text)
+    results = {}
+    for source in sources or SEARCH_SOURCES:
+        conf = SEARCH_SOURCES.get(source)
+        if conf is None:
+            continue
+        if match is None:
+            results[source] = []
+            continue
+        rows = db.execute(f'''
+            SELECT t.id, {conf['title']} AS title, {conf['subtitle']} AS subtitle, f.rank AS score
+            FROM {conf['fts']} f JOIN {conf['table']} t ON t.id = f.rowid
+            WHERE {conf['fts']} MATCH ?
+            ORDER BY f.rank
+            LIMIT ?
+        ''', (match, limit)).fetchall()
+        results[source] = [{'id': r['id'], 'title': r['title'], 'subtitle': r['subtitle'], 'score': round(r['score'], 4)}
+                           for r in rows]
+    return results
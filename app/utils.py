@@ -63,3 +63,17 @@ def format_currency(value):
         return f"{value:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
     except:
         return "0,00"
+
+def conditional_json(etag, build):
+    """
+    JSON response with a weak ETag. When the client already has it (If-None-Match) returns 304
+    without calling build(); clients must revalidate (Cache-Control: no-cache).
+    """
+    from flask import request, jsonify, make_response
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
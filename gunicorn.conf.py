@@ -0,0 +1,8 @@
+# gunicorn -c gunicorn.conf.py run:app (see deploy/orcamento.service)
+
+
+def post_worker_init(worker):
+    # Each worker runs its own scheduler thread once run:app is loaded (migrations applied);
+    # the DB lease makes every job occurrence run in one worker only
+    from app.scheduler import start_for_server
+    start_for_server(worker.wsgi)
@@ -1,15 +1,45 @@
+import os
+import sys
+
 from app import create_app
 from app.database import init_db
 
 app = create_app()
 
-# Initialize Database (Create tables if needed)
+# Initialize Database (apply pending migrations)
 init_db(app)
 
 if __name__ == '__main__':
-    # Use the new Scraper logic if needed, or let it run via separate worker
-    # app/scraper.py has scraper_worker but it is not started by default in create_app
-    # If we want to run it, we should start it here or in create_app
-    
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        # python run.py migrate -> migrations already applied by init_db above, just report
+        from app.database import get_db
+        from app.migrations import status
+        with app.app_context():
+            for m in status(get_db()):
+                print(f"{m['version']:03d}  {m['applied_at'] or 'pending':<20}  {m['name']}")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'kpis':
+        # python run.py kpis [check|rebuild] -> dashboard rollup vs raw queries / backfill
+        from app.database import get_db
+        from app.services.kpis import check, rebuild
+        with app.app_context():
+            db = get_db()
+            if len(sys.argv) > 2 and sys.argv[2] == 'rebuild':
+                rebuild(db)
+                db.commit()
+                print("KPIs reconstruídos")
+            diffs = check(db)
+            for name, (rollup, raw) in diffs.items():
+                print(f"{name:<20} rollup={rollup}  bruto={raw}")
+            print("KPIs consistentes" if not diffs else f"{len(diffs)} KPI(s) divergentes")
+        sys.exit(1 if diffs else 0)
+
+    # Scheduled jobs (raspagem etc.), see app/scheduler.py. With the reloader only the child
+    # process serves; under gunicorn the workers start it (gunicorn.conf.py)
+    from app.scheduler import start_for_server
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_for_server(app)
+
     # Check for debug mode from env or default to True for now (dev)
     app.run(debug=True, port=5000)
@@ -1,234 +1,76 @@
 import os
-import zipfile
-import re
 import sqlite3
-import xml.etree.ElementTree as ET
 
 import sys
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from app.services.promob_pipeline import run_pipeline
+from app.services.discovery_service import (PATTERN_STATS_COLUMNS, add_observation, empty_pattern,
+                                            merge_patterns, pattern_from_row, pattern_to_row)
+
 DATABASE = os.path.join(BASE_DIR, 'app', 'app.db')
 
 # Default training dir, but can be overridden via command line
 TRAIN_DIR = os.path.join(BASE_DIR, 'treino')
-if len(sys.argv) > 1:
-    TRAIN_DIR = os.path.abspath(sys.argv[1])
 
-def train():
-    if not os.path.exists(TRAIN_DIR):
-        print(f"Directory {TRAIN_DIR} not found.")
-        return
+UPSERT_PATTERN_SQL = f'''
+    INSERT INTO discovered_patterns (name, {', '.join(PATTERN_STATS_COLUMNS)})
+    VALUES (?, {', '.join('?' * len(PATTERN_STATS_COLUMNS))})
+    ON CONFLICT(name) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in PATTERN_STATS_COLUMNS)},
+        is_reviewed = 0
+'''
 
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    print(f"Starting Training from: {TRAIN_DIR}")
-    
-    # 1. Get already mapped items to exclude them
-    mapped_names = {row['promob_name'] for row in cursor.execute("SELECT promob_name FROM promob_mappings WHERE target_id IS NOT NULL").fetchall()}
-    
+def save_patterns(conn, results, stats):
+    """Pipeline writer: folds one batch of files into the stored pattern statistics."""
     discovery = {}
+    # Strategy A (or B fallback) modules + Strategy C VIP sub-components
+    for _, _, parsed in results:
+        for rec in parsed['modules'] + parsed['vip']:
+            add_observation(discovery.setdefault(rec['raw_name'], empty_pattern()), rec)
+    if not discovery:
+        return
 
-    # 2. Walk through files
-    matched_files = []
-    for root, _, files in os.walk(TRAIN_DIR):
-        for f in files:
-            if f.endswith(('.promob', '.bak')):
-                matched_files.append(os.path.join(root, f))
-    
-    print(f"Found {len(matched_files)} potential files.")
-
-    for i, filepath in enumerate(matched_files):
-        if i % 10 == 0:
-            print(f"Processing file {i+1}/{len(matched_files)}...")
-            
-        try:
-            file_entities = 0
-            with zipfile.ZipFile(filepath, 'r') as z:
-                amb_path = next((n for n in z.namelist() if 'ambient3d' in n.lower()), None)
-                if not amb_path:
-                    continue
-                # Try different encodings
-                raw_data = z.read(amb_path)
-                data = None
-                for enc in ['utf-8-sig', 'utf-16-sig', 'utf-8', 'utf-16']:
-                    try:
-                        data = raw_data.decode(enc)
-                        break
-                    except:
-                        continue
-                
-                if data:
-                    # HEURISTIC: Is this a budgeted file or legacy?
-                    is_budget_file = '<BUDGETINFORMATION' in data
-                    found_items = []
-                    
-                    # Common Furniture Whitelist
-                    furniture_keywords = [
-                        'balcão', 'armário', 'torre', 'nicho', 'paneleiro', 'aéreo', 
-                        'gaveteiro', 'criado', 'cama', 'mesa', 'painel', 'adega',
-                        'banheiro', 'dormitório', 'guarda-roupa', 'modulo', 'módulo',
-                        'roupeiro', 'closet', 'escrivaninha', 'estante', 'cristaleira'
-                    ]
-                    parts_blacklist = [
-                        'lateral', 'base', 'sarrafo', 'fundo', 'travessa', 'prateleira', 
-                        'porta reta', 'frente reta', 'dobradiça', 'corrediça', 'puxador',
-                        'trilho', 'perfil', 'ponteira', 'suporte', 'batedor'
-                    ]
-
-                    def clean_furniture_name(name):
-                        if not name: return None
-                        name = re.sub(r'\$[\w]+\$', '', name)
-                        name = re.sub(r'#[\w]+#', '', name)
-                        return name.replace('  ', ' ').strip()
-
-                    if is_budget_file:
-                        # Strategy A: Budget-centric
-                        budget_matches = re.finditer(r'<BUDGETINFORMATION\s+([^>]+)BUDGET="Y"', data)
-                        for m in budget_matches:
-                            info_attr = m.group(1)
-                            start_win = max(0, m.start() - 3000)
-                            end_win = min(len(data), m.end() + 500)
-                            window = data[start_win:end_win]
-                            
-                            name = None
-                            dn = re.search(r'DESCRIPTION="([^"]+)"', info_attr)
-                            if dn: name = dn.group(1).strip()
-                            
-                            if not name or name.lower() in ['padrão', 'default', 'config felipe']:
-                                an = re.search(r'ID="DESCRIPTION"\s+VALUE="([^"]+)"', window)
-                                if an: name = an.group(1).strip()
-                            
-                            name = clean_furniture_name(name)
-                            if not name or len(name) < 3: continue
-                            
-                            lower_name = name.lower()
-                            if not any(key in lower_name for key in furniture_keywords): continue
-                            if any(part in lower_name for part in parts_blacklist): continue
-                            
-                            dims = {}
-                            for d, alt in [('L', 'WIDTH'), ('A', 'HEIGHT'), ('P', 'DEPTH')]:
-                                val_matches = re.findall(rf'\b(?:{d}|{alt})="([\d.]+)"', window)
-                                if val_matches: dims[d] = float(val_matches[-1])
-                            
-                            if len(dims) == 3:
-                                found_items.append((name, dims))
-                    
-                    if not found_items:
-                        # Strategy B: Tag-centric fallback (for files without BudgetInfo)
-                        blocks = re.split(r'<(?:ENTITY|ITEM|INFORMACOES)\b', data)
-                        for block in blocks:
-                            if 'TYPE="MODULO"' in block or 'TYPE="WARDROBE"' in block:
-                                # Name
-                                desc = None
-                                attr_desc = re.search(r'ID="DESCRIPTION"\s+VALUE="([^"]+)"', block)
-                                if attr_desc:
-                                    desc = attr_desc.group(1).strip()
-                                else:
-                                    dm = re.search(r'DESCRIPTION="([^"]*)"', block)
-                                    if dm: desc = dm.group(1).strip()
-                                
-                                desc = clean_furniture_name(desc)
-                                if not desc or len(desc) < 3: continue
-                                
-                                lower_desc = desc.lower()
-                                # EXTREMELY STRICT for fallback: must be a known furniture type
-                                if not any(key in lower_desc for key in furniture_keywords): continue
-                                if any(part in lower_desc for part in parts_blacklist): continue
-                                
-                                # Dimensions
-                                dims = {}
-                                for d, alt in [('L', 'WIDTH'), ('A', 'HEIGHT'), ('P', 'DEPTH')]:
-                                    val = re.search(rf'\b(?:{d}|{alt})="([\d.]+)"', block)
-                                    if val: dims[d] = float(val.group(1))
-                                
-                                if len(dims) == 3:
-                                    found_items.append((desc, dims))
-
-                    # Strategy C: VIP Sub-components (Gaveteiros, Portas de Correr, Rodapés, Engrossos)
-                    # We run this ALWAYS, regardless of Strategy A or B finding the main module
-                    vip_keywords = [
-                        'gaveta interna', 'gaveteiro', 'porta de correr', 'porta deslizante', 
-                        'corpo de gaveta', 'moldura engros', 'rodapé', 'rodape', 'engrosso'
-                    ]
-                    matches = re.finditer(r'<ATTRIBUTE ID="DESCRIPTION" VALUE="([^"]+)"', data)
-                    
-                    for m in matches:
-                        desc = m.group(1).strip()
-                        lower_desc = desc.lower()
-                        
-                        if not any(k in lower_desc for k in vip_keywords):
-                            continue
-                            
-                        # Pular sub-partes muito granulares
-                        if 'fundo de gaveta' in lower_desc or 'lateral de gaveta' in lower_desc or 'frente gaveta' in lower_desc or 'posterior de gaveta' in lower_desc:
-                            continue
-                            
-                        start_pos = m.end()
-                        end_pos = min(len(data), start_pos + 3000)
-                        window = data[start_pos:end_pos]
-                        
-                        dim_match = re.search(r'<INSERTDIMENSION WIDTH="([\d.]+)" HEIGHT="([\d.]+)" DEPTH="([\d.]+)"', window)
-                        if dim_match:
-                            # Filtro de sanidade: ignorar se tamanho for 1x1x1 (placeholder Promob)
-                            l, a, p = float(dim_match.group(1)), float(dim_match.group(2)), float(dim_match.group(3))
-                            if l > 5 and a > 5 and p > 5:
-                                clean_desc = clean_furniture_name(desc)
-                                found_items.append((clean_desc, {'L': l, 'A': a, 'P': p}))
-
-                    # Process results
-
-                    for name, dims in found_items:
-                        if name not in discovery:
-                            discovery[name] = {'occurrences': 0, 'L': [], 'A': [], 'P': []}
-                        discovery[name]['occurrences'] += 1
-                        discovery[name]['L'].append(dims['L'])
-                        discovery[name]['A'].append(dims['A'])
-                        discovery[name]['P'].append(dims['P'])
-                        file_entities += 1
-                
-                # if file_entities > 0:
-                #    print(f"Found {file_entities} entities in {os.path.basename(filepath)}")
-                    
-        except Exception as e:
-            print(f"Error processing {os.path.basename(filepath)}: {e}")
+    # Single writer: read-merge-write is safe and keeps the merge exact (sums, not averages of averages)
+    names = list(discovery)
+    existing = {}
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        rows = conn.execute(f"SELECT name, {', '.join(PATTERN_STATS_COLUMNS)} FROM discovered_patterns WHERE name IN ({','.join('?' * len(chunk))})",
+                            chunk).fetchall()
+        existing.update((r['name'], pattern_from_row(r)) for r in rows)
+
+    rows = []
+    for name, batch_stats in discovery.items():
+        merged = merge_patterns(existing[name], batch_stats) if name in existing else batch_stats
+        rows.append([name] + pattern_to_row(merged))
+    conn.executemany(UPSERT_PATTERN_SQL, rows)
+    stats['new_patterns'] = stats.get('new_patterns', 0) + len(names) - len(existing)
+    stats['updated_patterns'] = stats.get('updated_patterns', 0) + len(existing)
+
+def train(train_dir=TRAIN_DIR, workers=None, limit=None):
+    conn = sqlite3.connect(DATABASE, timeout=30)
+    conn.row_factory = sqlite3.Row
 
-    # 3. Save to database
-    print("\nSaving patterns to database...")
-    new_items = 0
-    updated_items = 0
-    
-    for name, data in discovery.items():
-        avg_L = round(sum(data['L']) / len(data['L']), 0)
-        avg_A = round(sum(data['A']) / len(data['A']), 0)
-        avg_P = round(sum(data['P']) / len(data['P']), 0)
-        occ = data['occurrences']
-        
-        try:
-            cursor.execute('''
-                INSERT INTO discovered_patterns (name, avg_L, avg_A, avg_P, occurrences)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(name) DO UPDATE SET 
-                    avg_L = (avg_L + excluded.avg_L) / 2,
-                    avg_A = (avg_A + excluded.avg_A) / 2,
-                    avg_P = (avg_P + excluded.avg_P) / 2,
-                    occurrences = occurrences + excluded.occurrences,
-                    is_reviewed = 0
-            ''', (name, avg_L, avg_A, avg_P, occ))
-            if cursor.rowcount > 0:
-                new_items += 1
-            else:
-                updated_items += 1
-        except Exception as e:
-            print(f"DB Error saving {name}: {e}")
+    print(f"Starting Training from: {train_dir}")
+    try:
+        stats = run_pipeline(conn, train_dir, 'train', save_patterns, workers=workers, limit=limit)
+    finally:
+        conn.close()
 
-    conn.commit()
-    conn.close()
     print(f"\nTraining Complete!")
-    print(f"New Patterns Found: {new_items}")
-    print(f"Patterns Updated: {updated_items}")
+    print(f"Files Trained (New): {stats['processed']} ({stats['cached']} from parse cache), already trained: {stats['skipped']}")
+    print(f"New Patterns Found: {stats.get('new_patterns', 0)}")
+    print(f"Patterns Updated: {stats.get('updated_patterns', 0)}")
+    return stats
 
 if __name__ == "__main__":
-    train()
+    import argparse
+    parser = argparse.ArgumentParser(description='Learns module patterns (name + average L/A/P) from a Promob archive.')
+    parser.add_argument('train_dir', nargs='?', default=TRAIN_DIR, help='training archive directory')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes (default: all cores)')
+    parser.add_argument('--limit', type=int, default=None, help='max new files to train on')
+    args = parser.parse_args()
+    train(os.path.abspath(args.train_dir), workers=args.workers, limit=args.limit)
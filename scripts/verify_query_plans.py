@@ -0,0 +1,157 @@
+import sys
+import os
+import re
+import shutil
+import tempfile
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask_jwt_extended import create_access_token
+
+from app.database import DATABASE, db_pool, get_db, init_db
+
+# Query-plan regression check for contas. Runs the real code paths that read contas
+# (financeiro list, payroll, holerite print, reports, dashboards, calendar, billing) with a trace
+# on the connection, then EXPLAINs every captured SELECT: a "SCAN contas" means a full table (or
+# full index) scan, i.e. a query shape without a matching index, and a temp b-tree for ORDER BY
+# means the sort isn't served by an index. Full listings that read every row on purpose are in
+# ALLOWED_SCANS (they still must come out in index order).
+# Runs on a temporary copy of the database (migrations included); the scheduler is not started.
+# Usage: python scripts/verify_query_plans.py [path/to/app.db]   (exit code 1 on failure)
+
+CHECKED_TABLES = ('contas',)
+READS_TABLE = re.compile(r'\b(FROM|JOIN)\s+(' + '|'.join(CHECKED_TABLES) + r')\b', re.IGNORECASE)
+FULL_SCAN = re.compile(r'^SCAN (' + '|'.join(CHECKED_TABLES) + r')\b')
+SORT_STEP = re.compile(r'^USE TEMP B-TREE FOR (RIGHT PART OF |LAST TERM OF )?ORDER BY')
+
+# (pattern on the whitespace-normalized SQL, reason)
+ALLOWED_SCANS = [
+    (re.compile(r'^SELECT \* FROM contas ORDER BY vencimento$'),
+     '/api/contas without tipo is the full list of contas by design'),
+    (re.compile(r'^SELECT [\w, ]+ FROM contas ORDER BY vencimento (DESC|ASC)( LIMIT \d+)?$'),
+     'report listing / export without a range: every conta, newest first, LIMIT or streamed'),
+]
+
+
+def seed(db):
+    print("Setting up test data...")
+    cur = db.cursor()
+    cur.execute("INSERT INTO funcionarios (nome, salario_base) VALUES ('Plano Teste', 1000)")
+    func_id = cur.lastrowid
+    cur.execute("INSERT INTO funcionario_periodos (funcionario_id, data_contratacao) VALUES (?, '2020-01-01')", (func_id,))
+    cur.execute('''
+        INSERT INTO contas (tipo, descricao, valor, vencimento, status, categoria, funcionario_id)
+        VALUES ('pagar', 'Vale teste', 50, date('now'), 'pendente', 'vale_funcionario', ?)
+    ''', (func_id,))
+    return func_id
+
+
+def exercise(app, db, func_id):
+    """Every code path that reads contas, against the traced connection."""
+    from datetime import date, timedelta
+    from app.services import calendar_feed, ledger, payroll, reports
+
+    month = date.today().strftime('%Y-%m')
+    inicio, fim = reports.parse_range({}, 'month')
+
+    with app.app_context():
+        token = create_access_token(identity='1')
+    client = app.test_client()
+    client.set_cookie('access_token_cookie', token)
+    urls = [f'/api/contas?tipo={tipo}' for tipo in ('receber', 'pagar')] + [
+        '/api/contas',
+        f'/holerite/print/{func_id}?mes={month}',
+        '/api/relatorios/data',
+        f'/api/relatorios/data?inicio={inicio.isoformat()}&fim={(fim - timedelta(days=1)).isoformat()}',
+        '/api/relatorios/dashboard',
+        '/api/kpis',
+    ]
+    for url in urls:
+        resp = client.get(url)
+        if resp.status_code != 200:
+            print(f"  [WARN] GET {url} -> {resp.status_code}")
+
+    payroll.calculate(db, month)
+    payroll.calculate(db, month, [func_id])
+    reports.cash_flow(db, inicio, fim, 'month')
+    reports.cash_flow(db, inicio - timedelta(days=30), None, 'day')
+    for tipo in (None, 'receber'):
+        sql, params = reports.contas_query(inicio, fim, tipo)
+        list(reports.iter_rows(db, sql, params))
+    start, end = calendar_feed.default_window()
+    calendar_feed.window_events(db, start, end)
+    calendar_feed.changed_events(db, start, end, calendar_feed.sync_cursor(db))
+    ledger.is_billed(db, 0)
+
+
+def allowed_scan(sql):
+    return next((reason for pattern, reason in ALLOWED_SCANS if pattern.match(sql)), None)
+
+
+def check_plans(db, statements):
+    print(f"\n[-] Checking {len(statements)} distinct queries on {', '.join(CHECKED_TABLES)}...")
+    failures = 0
+    for sql in statements:
+        plan = [row['detail'] for row in db.execute('EXPLAIN QUERY PLAN ' + sql)]
+        normalized = ' '.join(sql.split())
+        reason = allowed_scan(normalized)
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        sorts = [step for step in plan if SORT_STEP.match(step)]
+        if (scans and not reason) or sorts:
+            failures += 1
+            print(f"  [FAIL] {normalized[:110]}")
+            for step in plan:
+                print(f"           {step}")
+        else:
+            print(f"  [OK] {normalized[:110]}")
+            print(f"         {'; '.join(step for step in plan if any(t in step for t in CHECKED_TABLES))}")
+            if scans:
+                print(f"         full scan allowed: {reason}")
+    return failures
+
+
+if __name__ == "__main__":
+    print("=== QUERY PLAN CHECK ===")
+    source = sys.argv[1] if len(sys.argv) > 1 else DATABASE
+    tmp = tempfile.mkdtemp()
+    # Never migrate / write the live database: work on a copy (or a fresh database)
+    if os.path.exists(source):
+        shutil.copy2(source, os.path.join(tmp, 'app.db'))
+        print(f"Using a copy of {source}")
+    else:
+        print(f"{source} not found, using an empty database")
+    db_pool.discard()
+    db_pool.path = os.path.join(tmp, 'app.db')
+
+    from app import create_app
+    app = create_app()
+    init_db(app)
+
+    with app.app_context():
+        db = get_db()
+        captured = []
+        try:
+            func_id = seed(db)
+            db.set_trace_callback(captured.append)
+            exercise(app, db, func_id)
+        finally:
+            db.set_trace_callback(None)
+            db.rollback()
+
+        # Identical statements (same query, same values) are checked once
+        statements = list(dict.fromkeys(
+            sql for sql in captured
+            if sql.lstrip().upper().startswith('SELECT') and READS_TABLE.search(sql)
+        ))
+        failures = check_plans(db, statements)
+    db_pool.discard()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    if not statements:
+        print("\n[FAIL] No contas queries were captured.")
+        sys.exit(1)
+    if failures:
+        print(f"\n=== {failures} QUERY(S) FALL BACK TO A FULL SCAN OR SORT ===")
+        sys.exit(1)
+    print("\n=== CHECK COMPLETED ===")
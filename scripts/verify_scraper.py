@@ -0,0 +1,219 @@
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import scraper
+from app.scraper import ScrapeEngine, SCRAPE_PARSER_VERSION, SCRAPE_RETRIES
+
+# Scraper engine check against a local stub HTTP server (no supplier site is contacted):
+# 200 parsing per site, ETag / 304 and unchanged-body cache paths, 404 without retry,
+# 5xx and 429 + Retry-After with backoff, per-site request spacing and the price strategies
+# of scrape_item on a temporary database.
+# Usage: python scripts/verify_scraper.py   (exit code 1 on failure)
+
+MIN_INTERVAL = 0.2
+TEST_BACKOFF = 0.05
+TIMING_SLACK = 0.02
+
+PAGES = {
+    'madeiranit': '<div class="product-info-main"><span class="price">R$ 1.234,56</span></div>',
+    'leomadeiras': '<div class="price-template"><span class="best-price">R$ 199,90</span></div>',
+    'madeverde': '<div><span class="preco-venda">R$ 250,00</span><span class="preco-promocional">R$ 210,00</span></div>',
+}
+EXPECTED = {'madeiranit': 1234.56, 'leomadeiras': 199.90, 'madeverde': 210.00}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /ok/<site>        200 with ETag "v1", 304 when If-None-Match matches
+    /nochange/<site>  200 without validators (same body every time)
+    /missing          404
+    /flaky/<key>      503 on the first two hits of <key>, then 200 (madeiranit page)
+    /throttle/<key>   429 + Retry-After: 1 on the first hit of <key>, then 200
+    /broken           500 always
+    """
+    hits = []
+    lock = threading.Lock()
+    counters = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def _send(self, status, body='', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        with self.lock:
+            self.hits.append((self.path, time.monotonic(), self.headers.get('If-None-Match')))
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        route, arg = parts[0], (parts[1] if len(parts) > 1 else '')
+        if route == 'ok':
+            if self.headers.get('If-None-Match') == '"v1"':
+                return self._send(304, headers={'ETag': '"v1"'})
+            return self._send(200, PAGES[arg], {'ETag': '"v1"'})
+        if route == 'nochange':
+            return self._send(200, PAGES[arg])
+        if route == 'flaky':
+            return self._send(503) if self._count(self.path) <= 2 else self._send(200, PAGES['madeiranit'])
+        if route == 'throttle':
+            if self._count(self.path) == 1:
+                return self._send(429, headers={'Retry-After': '1'})
+            return self._send(200, PAGES['madeiranit'])
+        if route == 'broken':
+            return self._send(500)
+        return self._send(404)
+
+
+def hits_for(prefix):
+    return [h for h in StubHandler.hits if h[0].startswith(prefix)]
+
+
+def as_cached(entry):
+    return {**entry, 'parser_version': SCRAPE_PARSER_VERSION}
+
+
+def check(label, ok, detail=''):
+    print(f"  [{'OK' if ok else 'FAIL'}] {label}{' - ' + detail if detail and not ok else ''}")
+    return ok
+
+
+def check_fetch(engine, base):
+    print("[-] Fetch, cache and retries...")
+    results = []
+    entries = {}
+    for site, price in EXPECTED.items():
+        entries[site] = e = engine.fetch(site, f'{base}/ok/{site}')
+        results.append(check(f"200 {site} parsed", e['outcome'] == 'parsed' and abs(e['price'] - price) < 0.001
+                             and e['etag'] == '"v1"', str(e)))
+
+    e = engine.fetch('madeiranit', f'{base}/ok/madeiranit', as_cached(entries['madeiranit']))
+    conditional = hits_for('/ok/madeiranit')[-1][2] == '"v1"'
+    results.append(check("304 reuses the cached price (If-None-Match sent)",
+                         conditional and e['outcome'] == 'not_modified' and e['status_code'] == 304
+                         and e['price'] == EXPECTED['madeiranit'], str(e)))
+
+    first = engine.fetch('leomadeiras', f'{base}/nochange/leomadeiras')
+    e = engine.fetch('leomadeiras', f'{base}/nochange/leomadeiras', as_cached(first))
+    results.append(check("same body hash is not re-parsed", e['outcome'] == 'unchanged'
+                         and e['price'] == EXPECTED['leomadeiras'], str(e)))
+
+    e = engine.fetch('madeiranit', f'{base}/missing')
+    results.append(check("404 is not retried", e['outcome'] == 'error' and len(hits_for('/missing')) == 1,
+                         f"{len(hits_for('/missing'))} hits"))
+
+    e = engine.fetch('madeiranit', f'{base}/flaky/a')
+    times = [t for _, t, _ in hits_for('/flaky/a')]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    results.append(check("503 retried with backoff until 200",
+                         e['outcome'] == 'parsed' and len(times) == 3
+                         and gaps[0] >= TEST_BACKOFF - TIMING_SLACK and gaps[1] >= 2 * TEST_BACKOFF - TIMING_SLACK,
+                         f"{len(times)} hits, gaps {[round(g, 3) for g in gaps]}"))
+
+    e = engine.fetch('madeiranit', f'{base}/throttle/a')
+    times = [t for _, t, _ in hits_for('/throttle/a')]
+    results.append(check("429 waits Retry-After before retrying",
+                         e['outcome'] == 'parsed' and len(times) == 2 and times[1] - times[0] >= 1 - TIMING_SLACK,
+                         f"{len(times)} hits"))
+
+    e = engine.fetch('madeiranit', f'{base}/broken')
+    results.append(check(f"5xx gives up after {SCRAPE_RETRIES} retries",
+                         e['outcome'] == 'error' and len(hits_for('/broken')) == SCRAPE_RETRIES + 1,
+                         f"{len(hits_for('/broken'))} hits"))
+    return results
+
+
+def check_spacing(engine, base):
+    print("\n[-] Per-site spacing under concurrency...")
+    jobs = [(i, 'madeverde', f'{base}/nochange/madeverde?n={i}') for i in range(6)]
+    jobs += [(10 + i, 'leomadeiras', f'{base}/nochange/leomadeiras?n={i}') for i in range(3)]
+    start = time.monotonic()
+    done = list(engine.fetch_many(jobs))
+    results = [check("every page answered", len(done) == len(jobs) and all(e['outcome'] == 'parsed' for _, _, e in done))]
+    for site, count in (('madeverde', 6), ('leomadeiras', 3)):
+        times = sorted(t for path, t, _ in hits_for(f'/nochange/{site}?n='))
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        results.append(check(f"{site}: {count} requests at least {MIN_INTERVAL}s apart",
+                             len(times) == count and min(gaps) >= MIN_INTERVAL - TIMING_SLACK,
+                             f"gaps {[round(g, 3) for g in gaps]}"))
+    # Sites are limited independently: the 3 leomadeiras pages don't wait for the 6 madeverde ones
+    leo_last = max(t for path, t, _ in hits_for('/nochange/leomadeiras?n='))
+    results.append(check("sites are spaced independently", leo_last - start < 5 * MIN_INTERVAL,
+                         f"last leomadeiras hit after {leo_last - start:.2f}s"))
+    return results
+
+
+def check_strategies(engine, base):
+    print("\n[-] Price strategies (scrape_item on a temporary database)...")
+    from app import create_app
+    from app.database import db_pool, get_db, init_db
+
+    tmp = tempfile.mkdtemp()
+    db_pool.discard()
+    db_pool.path = os.path.join(tmp, 'app.db')
+    app = create_app()
+    init_db(app)
+
+    results = []
+    scraper.engine, live_engine = engine, scraper.engine
+    try:
+        with app.app_context():
+            db = get_db()
+            for strategy, site in (('auto_max', 'madeiranit'), ('leomadeiras', 'leomadeiras'), ('madeverde', 'madeverde')):
+                cur = db.execute('''
+                    INSERT INTO estoque (nome, categoria, custo_unitario, price_strategy, url_madeiranit, url_leomadeiras, url_madeverde)
+                    VALUES (?, 'Teste', 1, ?, ?, ?, ?)
+                ''', (f'Item {strategy}', strategy, *(f'{base}/ok/{s}?item={strategy}' for s in ('madeiranit', 'leomadeiras', 'madeverde'))))
+                item = db.execute("SELECT * FROM estoque WHERE id = ?", (cur.lastrowid,)).fetchone()
+                res = scraper.scrape_item(db, item)
+                db.commit()
+                row = db.execute("SELECT custo_unitario, site_origem FROM estoque WHERE id = ?", (item['id'],)).fetchone()
+                results.append(check(f"{strategy} -> {site} R$ {EXPECTED[site]:.2f}",
+                                     res is not None and row['site_origem'] == site
+                                     and abs(row['custo_unitario'] - EXPECTED[site]) < 0.001, str(dict(row))))
+    finally:
+        scraper.engine = live_engine
+        db_pool.discard()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    print("=== SCRAPER ENGINE CHECK ===")
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    # Short backoff / spacing so the check runs in a few seconds (same code paths); no proxy for localhost
+    scraper.SCRAPE_BACKOFF = TEST_BACKOFF
+    os.environ.pop('SCRAPING_PROXY', None)
+    engine = ScrapeEngine(sites={site: {'headers': {}, 'min_interval': MIN_INTERVAL, 'max_concurrency': 2}
+                                 for site in PAGES})
+    try:
+        results = check_fetch(engine, base) + check_spacing(engine, base) + check_strategies(engine, base)
+    finally:
+        server.shutdown()
+
+    failures = results.count(False)
+    if failures:
+        print(f"\n=== {failures} CHECK(S) FAILED ===")
+        sys.exit(1)
+    print("\n=== CHECK COMPLETED ===")